@@ -1,11 +1,14 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from prometheus_client import start_http_server
 from config import config
 from handlers import user_handlers, moderator_handlers
 from database.db import init_db
+from database.queries import chat_history_buffer, last_message_tracker
 from services.vector_search import vector_search
 from middlewares.auth_middleware import AuthMiddleware
+from middlewares.db_session_middleware import DbSessionMiddleware
 from tasks.background_tasks import start_background_tasks
 
 # Настройка системы логирования
@@ -36,6 +39,8 @@ async def main():
         
         # Регистрация middleware
         logging.info("Регистрация middleware...")
+        # Сессия базы данных открывается первой: одна на обновление, доступна следующим middleware и обработчикам
+        dp.update.middleware.register(DbSessionMiddleware())
         dp.update.middleware.register(AuthMiddleware())
         
         # Регистрация обработчиков сообщений
@@ -44,18 +49,22 @@ async def main():
         dp.include_router(user_handlers.router)
         dp.include_router(moderator_handlers.router)
 
-        # Загрузка контекстного файла для векторного поиска
-        # Файл содержит информацию для поиска похожих вопросов
-        try:
-            logging.info("Загрузка контекстного файла...")
-            with open(config.CONTEXT_FILE, 'r', encoding='utf-8') as f:
-                contexts = f.read().split('\n\n')
-                vector_search.build_index(contexts)
-            logging.info(f"Загружено {len(contexts)} контекстов для векторного поиска")
-        except FileNotFoundError:
-            logging.warning(f"Контекстный файл не найден: {config.CONTEXT_FILE}")
-        except Exception as e:
-            logging.error(f"Ошибка при загрузке контекстного файла: {str(e)}")
+        # При остановке бота записываются сообщения истории чата, еще остающиеся в буфере,
+        # и отложенное время последних сообщений пользователей
+        dp.shutdown.register(chat_history_buffer.close)
+        dp.shutdown.register(last_message_tracker.flush)
+
+        # Запуск HTTP сервера метрик Prometheus (в том числе готовности vector_search_ready для проверок состояния)
+        start_http_server(config.PROMETHEUS_PORT)
+        logging.info(f"Метрики Prometheus доступны на порту {config.PROMETHEUS_PORT}")
+
+        # Прогрев векторного поиска в фоне: загрузка модели и контекстного файла
+        # Файл (или директория с файлами) содержит информацию для поиска похожих вопросов.
+        # Бот начинает отвечать сразу, готовность отражает vector_search.is_ready (метрика vector_search_ready)
+        logging.info("Запуск прогрева векторного поиска...")
+        asyncio.create_task(vector_search.warm_up(config.CONTEXT_FILE))
+        # Слежение за контекстным файлом: при изменении индекс перестраивается в фоне
+        asyncio.create_task(vector_search.watch(config.CONTEXT_FILE))
         
         # Запуск фоновых задач
         logging.info("Запуск фоновых задач...")
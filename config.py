@@ -13,14 +13,145 @@ class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     # Путь к файлу базы данных SQLite
     DB_PATH = os.getenv("DB_PATH", "bank_bot.db")
+    # Отложенная запись истории чата: сообщения накапливаются в памяти и записываются пачкой
+    CHAT_HISTORY_WRITE_BEHIND = os.getenv("CHAT_HISTORY_WRITE_BEHIND", "true").lower() == "true"
+    # Запись пачки при накоплении N сообщений или через T миллисекунд после первого сообщения пачки
+    CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "100"))
+    CHAT_HISTORY_FLUSH_MS = float(os.getenv("CHAT_HISTORY_FLUSH_MS", "200"))
+    # Отложенное обновление времени последнего сообщения пользователя: значения хранятся в памяти
+    # и записываются одним пакетным UPDATE раз в LAST_MESSAGE_FLUSH_INTERVAL секунд
+    LAST_MESSAGE_DEBOUNCE = os.getenv("LAST_MESSAGE_DEBOUNCE", "true").lower() == "true"
+    LAST_MESSAGE_FLUSH_INTERVAL = float(os.getenv("LAST_MESSAGE_FLUSH_INTERVAL", "60"))
     # Путь к файлу логов
     LOG_FILE = os.getenv("LOG_FILE", "bot.log")
-    # Порог схожести для векторного поиска (0.0 - 1.0)
+    # Порог схожести для векторного поиска: максимальное L2 расстояние
+    # или минимальное косинусное сходство (0.0 - 1.0) при VECTOR_METRIC=cosine
     SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.7"))
     # Максимальное количество токенов для генерации ответа
     MAX_TOKENS = int(os.getenv("MAX_TOKENS", "1500"))
+    # Модель OpenAI для генерации ответов
+    OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    # Адрес OpenAI-совместимого API (пустая строка - api.openai.com)
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+    # Маршруты к моделям: JSON список объектов name, model, base_url, api_key, max_prompt_tokens
+    # (пустая строка - один маршрут OPENAI_MODEL через OPENAI_BASE_URL)
+    OPENAI_ROUTES = os.getenv("OPENAI_ROUTES", "")
+    # Количество последних запросов для оценки задержки маршрута
+    OPENAI_ROUTE_WINDOW = int(os.getenv("OPENAI_ROUTE_WINDOW", "200"))
+    # Дублирующий запрос, если ответ не пришел за квантиль задержки маршрута (но не раньше минимальной задержки)
+    OPENAI_HEDGE_ENABLED = os.getenv("OPENAI_HEDGE_ENABLED", "false").lower() == "true"
+    OPENAI_HEDGE_QUANTILE = float(os.getenv("OPENAI_HEDGE_QUANTILE", "0.95"))
+    OPENAI_HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "1.0"))
+    # Бюджет входных токенов промпта и максимум токенов на контекст из базы знаний
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+    PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "800"))
+    # Системный промпт ассистента
+    SYSTEM_PROMPT = os.getenv(
+        "SYSTEM_PROMPT",
+        "Ты вежливый ассистент службы поддержки банка. Отвечай кратко и по делу, "
+        "опираясь на информацию из базы знаний, если она есть."
+    )
+    # Сводка диалога: старые сообщения сворачиваются в краткое содержание,
+    # в промпт передаются сводка и последние сообщения
+    SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+    # Обновление сводки после каждых N реплик пользователя, не вошедших в нее
+    SUMMARY_EVERY_TURNS = int(os.getenv("SUMMARY_EVERY_TURNS", "5"))
+    # Количество последних сообщений, которые всегда передаются в промпт без сжатия
+    SUMMARY_RECENT_MESSAGES = int(os.getenv("SUMMARY_RECENT_MESSAGES", "4"))
+    # Максимальная длина сводки в токенах
+    SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+    # Максимальное количество одновременных запросов к OpenAI
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    # Квоты OpenAI: запросов и токенов в минуту (0 - без ограничения)
+    OPENAI_RPM = float(os.getenv("OPENAI_RPM", "3500"))
+    OPENAI_TPM = float(os.getenv("OPENAI_TPM", "90000"))
+    # Повторы при 429/5xx: максимум попыток, базовая и максимальная задержка в секундах
+    OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+    OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+    OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "8"))
+    # Срок выполнения запроса к OpenAI в секундах с учетом очереди и повторов
+    OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "30"))
+    # Автоматический выключатель OpenAI: доля ошибок (включая медленные ответы) в окне последних запросов для размыкания
+    OPENAI_BREAKER_ERROR_RATE = float(os.getenv("OPENAI_BREAKER_ERROR_RATE", "0.5"))
+    # Ответ дольше указанного числа секунд считается ошибкой (0 - задержка не учитывается)
+    OPENAI_BREAKER_SLOW_CALL = float(os.getenv("OPENAI_BREAKER_SLOW_CALL", "15"))
+    # Размер окна и минимальное количество запросов в нем для оценки доли ошибок
+    OPENAI_BREAKER_WINDOW = int(os.getenv("OPENAI_BREAKER_WINDOW", "20"))
+    OPENAI_BREAKER_MIN_CALLS = int(os.getenv("OPENAI_BREAKER_MIN_CALLS", "5"))
+    # Время в разомкнутом состоянии до пробных запросов и количество успешных пробных запросов для замыкания
+    OPENAI_BREAKER_OPEN_SECONDS = float(os.getenv("OPENAI_BREAKER_OPEN_SECONDS", "30"))
+    OPENAI_BREAKER_TRIAL_CALLS = int(os.getenv("OPENAI_BREAKER_TRIAL_CALLS", "2"))
+    # Отложенные вопросы (ответ после восстановления OpenAI): максимальный размер очереди и время жизни в секундах
+    OPENAI_DEFERRED_QUEUE_SIZE = int(os.getenv("OPENAI_DEFERRED_QUEUE_SIZE", "1000"))
+    OPENAI_DEFERRED_TTL = float(os.getenv("OPENAI_DEFERRED_TTL", "3600"))
     # Путь к файлу с контекстной информацией
     CONTEXT_FILE = os.getenv("CONTEXT_FILE", "context.txt")
+    # Модель SentenceTransformer для создания эмбеддингов
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    # Директория для хранения FAISS индекса и кэша эмбеддингов между перезапусками
+    VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "storage/vector_index")
+    # Тип FAISS индекса: flat (точный поиск), ivf, hnsw или ivfpq (приближенный поиск),
+    # sq8 или pq (сжатое хранение: скалярное int8 или продуктовое квантование)
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+    # Метрика векторного поиска: l2 (расстояние) или cosine (скалярное произведение нормированных векторов)
+    VECTOR_METRIC = os.getenv("VECTOR_METRIC", "l2")
+    # Количество кластеров IVF индекса и число просматриваемых при поиске кластеров
+    VECTOR_IVF_NLIST = int(os.getenv("VECTOR_IVF_NLIST", "1024"))
+    VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+    # Количество связей на вершину и ширина поиска HNSW индекса
+    VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+    VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "80"))
+    VECTOR_HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
+    # Количество подвекторов и бит на код для продуктового квантования (IVF-PQ)
+    VECTOR_PQ_M = int(os.getenv("VECTOR_PQ_M", "16"))
+    VECTOR_PQ_NBITS = int(os.getenv("VECTOR_PQ_NBITS", "8"))
+    # Максимальная длина фрагмента контекста в токенах энкодера (0 - по max_seq_length модели) и перекрытие фрагментов
+    VECTOR_CHUNK_TOKENS = int(os.getenv("VECTOR_CHUNK_TOKENS", "0"))
+    VECTOR_CHUNK_OVERLAP = int(os.getenv("VECTOR_CHUNK_OVERLAP", "32"))
+    # Количество фрагментов, кодируемых и добавляемых в индекс за один шаг при построении
+    VECTOR_INGEST_BATCH_SIZE = int(os.getenv("VECTOR_INGEST_BATCH_SIZE", "256"))
+    # Количество процессов для кодирования корпуса при построении индекса (0 или 1 - в текущем процессе)
+    VECTOR_ENCODE_WORKERS = int(os.getenv("VECTOR_ENCODE_WORKERS", "0"))
+    # Хранение текстов контекстов: memory (список в памяти) или mmap (файл, отображаемый в память)
+    VECTOR_CONTEXT_STORAGE = os.getenv("VECTOR_CONTEXT_STORAGE", "memory")
+    # Период проверки изменения контекстного файла в секундах (0 - без автоматической перезагрузки)
+    VECTOR_RELOAD_INTERVAL = float(os.getenv("VECTOR_RELOAD_INTERVAL", "30"))
+    # Максимальный размер пачки запросов для кодирования и время ожидания ее заполнения (мс)
+    VECTOR_BATCH_SIZE = int(os.getenv("VECTOR_BATCH_SIZE", "32"))
+    VECTOR_BATCH_WAIT_MS = float(os.getenv("VECTOR_BATCH_WAIT_MS", "5"))
+    # Размер LRU кэша запросов (эмбеддинги и результаты поиска) и время жизни записей в секундах (0 - без ограничения)
+    VECTOR_QUERY_CACHE_SIZE = int(os.getenv("VECTOR_QUERY_CACHE_SIZE", "10000"))
+    VECTOR_QUERY_CACHE_TTL = float(os.getenv("VECTOR_QUERY_CACHE_TTL", "0"))
+    # Параметры BM25 лексического индекса
+    LEXICAL_BM25_K1 = float(os.getenv("LEXICAL_BM25_K1", "1.5"))
+    LEXICAL_BM25_B = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+    # Во сколько раз оценка лучшего документа должна превышать следующий, чтобы ответить без векторного поиска
+    LEXICAL_EXACT_MARGIN = float(os.getenv("LEXICAL_EXACT_MARGIN", "1.5"))
+    # Константа k в Reciprocal Rank Fusion при объединении лексического и векторного ранжирования
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+    # Ответ на вопрос напрямую из базы знаний без обращения к OpenAI при уверенном совпадении
+    FAQ_DIRECT_ANSWER = os.getenv("FAQ_DIRECT_ANSWER", "false").lower() == "true"
+    # Порог уверенного совпадения: максимальное L2 расстояние или минимальное косинусное сходство
+    FAQ_DIRECT_THRESHOLD = float(os.getenv("FAQ_DIRECT_THRESHOLD", "0.4"))
+    # Потоковая генерация ответа с постепенным редактированием сообщения в Telegram
+    OPENAI_STREAMING = os.getenv("OPENAI_STREAMING", "true").lower() == "true"
+    # Минимальный интервал между редактированиями сообщения в секундах (ограничения Telegram)
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+    
+    # Настройки семантического кэша ответов OpenAI
+    # Использовать кэш ответов на семантически эквивалентные запросы. По умолчанию выключен:
+    # англоязычная модель эмбеддингов близко располагает противоположные по смыслу русские
+    # вопросы («открыть вклад» и «закрыть вклад»), порог нужно проверить на реальных запросах
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    # Минимальное косинусное сходство последних реплик пользователя для ответа из кэша
+    RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+    # Количество предыдущих сообщений диалога, которые должны совпасть для ответа из кэша
+    RESPONSE_CACHE_HISTORY_MESSAGES = int(os.getenv("RESPONSE_CACHE_HISTORY_MESSAGES", "2"))
+    # Максимальное количество записей и время их жизни в секундах (0 - без ограничения)
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    # Файл SQLite для хранения кэша между перезапусками (пустая строка - только в памяти)
+    RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
     
     # Настройки очередей задач
     # URL для подключения к Redis
@@ -67,7 +198,10 @@ class Config:
         "BROADCAST_SENT": "Рассылка отправлена успешно.",
         "HELP_REQUEST": "Ваш запрос передан модератору.",
         "RATE_LIMIT_EXCEEDED": "Слишком много запросов. Пожалуйста, подождите.",
-        "PERMISSION_DENIED": "У вас нет прав для выполнения этой операции."
+        "PERMISSION_DENIED": "У вас нет прав для выполнения этой операции.",
+        "ANSWER_PLACEHOLDER": "Готовлю ответ...",
+        "DEGRADED_ANSWER": "Сервис ответов временно недоступен. Вот что удалось найти в базе знаний:\n\n{context}",
+        "ANSWER_DEFERRED": "Сервис ответов временно перегружен. Мы ответим на ваш вопрос, как только он восстановится."
     }
     
     # Слоты контекста диалога
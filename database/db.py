@@ -5,6 +5,7 @@ from config import config
 import logging
 import asyncio
 import contextlib
+from typing import Optional
 
 # Создание асинхронного движка базы данных
 # Использует SQLite с асинхронным драйвером aiosqlite
@@ -51,4 +52,47 @@ async def get_session() -> AsyncSession:
     try:
         yield session
     finally:
-        await session.close() 
\ No newline at end of file
+        await session.close() 
+
+@contextlib.asynccontextmanager
+async def session_scope(session: Optional[AsyncSession] = None, commit: bool = False) -> AsyncSession:
+    """
+    Сессия для выполнения запроса
+    
+    Если передана сессия единицы работы (одна на обновление Telegram, см.
+    middlewares/db_session_middleware.py), запрос выполняется в ней без коммита:
+    изменения фиксируются одним коммитом в конце обработки обновления. Пока
+    обновление обрабатывается, изменения не сбрасываются в базу, поэтому
+    транзакция записи не удерживает блокировку SQLite во время ожидания OpenAI.
+    Иначе открывается отдельная сессия, которая фиксируется при commit=True
+    
+    Аргументы:
+        session: Сессия единицы работы или None
+        commit: Фиксировать изменения отдельной сессии
+    
+    Возвращает:
+        AsyncSession: Сессия для выполнения запроса
+    """
+    if session is not None:
+        with session.no_autoflush:
+            yield session
+        return
+    async with get_session() as own_session:
+        yield own_session
+        if commit:
+            await own_session.commit()
+
+async def release_session(session: Optional[AsyncSession]):
+    """
+    Фиксация сделанного в сессии единицы работы и возврат ее соединения в пул
+    
+    Вызывается обработчиком перед долгим ожиданием (запрос к OpenAI, потоковая
+    отправка ответа), чтобы сессия обновления не удерживала соединение из пула
+    и транзакцию чтения SQLite. Последующие запросы в этой сессии берут
+    соединение заново, их изменения фиксируются коммитом в конце обновления
+    
+    Аргументы:
+        session: Сессия единицы работы или None
+    """
+    if session is not None and session.in_transaction():
+        await session.commit()
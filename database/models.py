@@ -50,4 +50,23 @@ class ChatHistory(Base):
     message = Column(String, nullable=False)
     is_from_user = Column(Boolean, nullable=False)
     timestamp = Column(DateTime, default=func.now())
-    is_moderator_chat = Column(Boolean, default=False) 
\ No newline at end of file
+    is_moderator_chat = Column(Boolean, default=False)
+
+class ConversationSummary(Base):
+    """
+    Модель краткого содержания диалога пользователя.
+    
+    Атрибуты:
+        id (int): Уникальный идентификатор записи
+        user_id (int): Идентификатор пользователя
+        summary (str): Краткое содержание сообщений, вошедших в сводку
+        last_message_id (int): ID последнего сообщения истории чата, вошедшего в сводку
+        updated_at (datetime): Дата и время обновления сводки
+    """
+    __tablename__ = 'conversation_summaries'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), unique=True, nullable=False)
+    summary = Column(String, nullable=False)
+    last_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now()) 
\ No newline at end of file
@@ -1,57 +1,258 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update
-from .models import User, ChatHistory
+from sqlalchemy import bindparam, insert, select, update
+from .models import User, ChatHistory, ConversationSummary
+from config import config
 from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
 import logging
-from .db import get_session
+from .db import get_session, session_scope
 
-async def create_user(telegram_id: int, phone_number: str, role: str = "user") -> User:
+class ChatHistoryBuffer:
+    """
+    Отложенная (write-behind) запись истории чата
+    Сообщения накапливаются в памяти и записываются одним пакетным INSERT и
+    одним коммитом при накоплении batch_size сообщений или через flush_ms
+    миллисекунд после первого сообщения пачки. Еще не записанные сообщения
+    добавляются к результату get_last_messages (read-your-writes), а перед
+    get_messages_after записываются, чтобы у всех сообщений выборки были ID
+    """
+    def __init__(self, batch_size: Optional[int] = None, flush_ms: Optional[float] = None):
+        """
+        Инициализация буфера
+        Args:
+            batch_size: Размер пачки (по умолчанию config.CHAT_HISTORY_BATCH_SIZE)
+            flush_ms: Максимальная задержка записи в миллисекундах (по умолчанию config.CHAT_HISTORY_FLUSH_MS)
+        """
+        self.batch_size = batch_size or config.CHAT_HISTORY_BATCH_SIZE
+        self.flush_ms = config.CHAT_HISTORY_FLUSH_MS if flush_ms is None else flush_ms
+        self._rows: List[ChatHistory] = []      # Ожидают записи
+        self._flushing: List[ChatHistory] = []  # Записываются в данный момент
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Количество еще не записанных сообщений"""
+        return len(self._rows) + len(self._flushing)
+
+    async def add(self, chat_message: ChatHistory):
+        """
+        Добавление сообщения в буфер
+        При заполнении пачки запись выполняется сразу (вызывающий ждет ее
+        завершения, что ограничивает рост буфера), иначе - по таймеру
+        Args:
+            chat_message: Сообщение истории чата (не привязанное к сессии)
+        """
+        # Время фиксируется при получении сообщения, а не при записи пачки
+        if chat_message.timestamp is None:
+            chat_message.timestamp = datetime.now()
+        self._rows.append(chat_message)
+        if len(self._rows) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    def pending(self, user_id: int) -> List[ChatHistory]:
+        """
+        Еще не записанные сообщения пользователя от старых к новым
+        Args:
+            user_id: ID пользователя
+        Returns:
+            List[ChatHistory]: Сообщения из буфера
+        """
+        return [msg for msg in self._flushing + self._rows if msg.user_id == user_id]
+
+    async def flush(self) -> int:
+        """
+        Запись накопленных сообщений
+        При ошибке сообщения возвращаются в буфер и будут записаны следующей пачкой
+        Returns:
+            int: Количество записанных сообщений
+        """
+        async with self._lock:
+            if not self._rows:
+                return 0
+            self._flushing, self._rows = self._rows, []
+            rows = [
+                {
+                    'user_id': msg.user_id,
+                    'message': msg.message,
+                    'is_from_user': msg.is_from_user,
+                    'timestamp': msg.timestamp,
+                    'is_moderator_chat': msg.is_moderator_chat
+                }
+                for msg in self._flushing
+            ]
+            try:
+                async with get_session() as session:
+                    result = await session.execute(
+                        insert(ChatHistory).returning(ChatHistory.id, sort_by_parameter_order=True),
+                        rows
+                    )
+                    ids = result.scalars().all()
+                    await session.commit()
+            except Exception as e:
+                logging.error(f"Ошибка при записи пачки истории чата ({len(rows)} сообщений): {str(e)}")
+                self._rows[:0] = self._flushing
+                self._flushing = []
+                return 0
+            except asyncio.CancelledError:
+                self._rows[:0] = self._flushing
+                self._flushing = []
+                raise
+            # ID позволяют не показывать сообщение дважды, если чтение застало его и в базе, и в буфере
+            for msg, message_id in zip(self._flushing, ids):
+                msg.id = message_id
+            flushed, self._flushing = len(self._flushing), []
+            return flushed
+
+    async def close(self):
+        """Остановка таймера и запись оставшихся сообщений (при завершении работы бота)"""
+        timer, self._timer = self._timer, None
+        if timer is not None and not timer.done():
+            timer.cancel()
+            await asyncio.gather(timer, return_exceptions=True)
+        await self.flush()
+        if self._rows:
+            logging.error(f"Не удалось записать {len(self._rows)} сообщений истории чата при завершении работы")
+
+    async def _flush_later(self):
+        """Запись пачки по истечении flush_ms"""
+        await asyncio.sleep(self.flush_ms / 1000)
+        await self.flush()
+        if self._rows and self._timer is asyncio.current_task():
+            # Пачка не записана (ошибка) или пополнилась во время записи: следующая попытка по таймеру
+            self._timer = asyncio.create_task(self._flush_later())
+
+# Создание глобального буфера истории чата
+chat_history_buffer = ChatHistoryBuffer()
+
+class LastMessageTracker:
+    """
+    Отложенное обновление времени последнего сообщения пользователей
+    Время хранится в памяти по telegram_id и записывается периодически одним
+    пакетным UPDATE, поэтому обработка сообщения не открывает транзакцию записи.
+    Значение используется только очисткой неактивных пользователей, для которой
+    задержка записи несущественна
+    """
+    def __init__(self):
+        """Инициализация: время последнего сообщения по telegram_id"""
+        self._dates: Dict[int, datetime] = {}
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        """Количество пользователей с незаписанным временем"""
+        return len(self._dates)
+
+    def touch(self, telegram_id: int, when: Optional[datetime] = None):
+        """
+        Запоминание времени последнего сообщения
+        Args:
+            telegram_id: Telegram ID пользователя
+            when: Время сообщения (по умолчанию текущее)
+        """
+        self._dates[telegram_id] = when or datetime.now()
+
+    async def flush(self) -> int:
+        """
+        Запись накопленных значений одним UPDATE (executemany) и одним коммитом
+        При ошибке значения возвращаются и будут записаны при следующем вызове
+        Returns:
+            int: Количество обновленных пользователей
+        """
+        async with self._lock:
+            if not self._dates:
+                return 0
+            pending, self._dates = self._dates, {}
+            statement = (
+                update(User.__table__)
+                .where(User.__table__.c.telegram_id == bindparam('target_telegram_id'))
+                .values(last_message_date=bindparam('target_date'))
+            )
+            try:
+                async with get_session() as session:
+                    await session.execute(statement, [
+                        {'target_telegram_id': telegram_id, 'target_date': date}
+                        for telegram_id, date in pending.items()
+                    ])
+                    await session.commit()
+            except Exception as e:
+                logging.error(f"Ошибка при записи времени последних сообщений ({len(pending)} пользователей): {str(e)}")
+                # Более новые значения, появившиеся во время записи, сохраняются
+                self._dates = {**pending, **self._dates}
+                return 0
+            except asyncio.CancelledError:
+                self._dates = {**pending, **self._dates}
+                raise
+            return len(pending)
+
+# Создание глобального трекера времени последних сообщений
+last_message_tracker = LastMessageTracker()
+
+async def create_user(telegram_id: int, phone_number: str, role: str = "user",
+                      session: Optional[AsyncSession] = None) -> User:
     """
     Создает нового пользователя в базе данных
     Args:
         telegram_id: Telegram ID пользователя
         phone_number: Номер телефона пользователя
         role: Роль пользователя (по умолчанию 'user')
+        session: Сессия единицы работы обновления (по умолчанию - отдельная сессия с коммитом)
     Returns:
         User: Созданный пользователь
     """
-    async with get_session() as session:
+    async with session_scope(session, commit=True) as db:
         user = User(
             telegram_id=telegram_id,
             phone_number=phone_number,
             role=role
         )
-        session.add(user)
-        await session.commit()
+        db.add(user)
+        if session is not None:
+            # ID нужен вызывающему коду сразу, до общего коммита
+            await db.flush()
         return user
 
-async def get_user_by_telegram_id(telegram_id: int) -> User:
+async def get_user_by_telegram_id(telegram_id: int, session: Optional[AsyncSession] = None) -> User:
     """
     Получает пользователя по Telegram ID
     Args:
         telegram_id: Telegram ID пользователя
+        session: Сессия единицы работы обновления
     Returns:
         User: Найденный пользователь или None
     """
-    async with get_session() as session:
-        result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    async with session_scope(session) as db:
+        result = await db.execute(select(User).where(User.telegram_id == telegram_id))
         return result.scalar_one_or_none()
 
-async def update_user_last_message(telegram_id: int):
+async def update_user_last_message(telegram_id: int, session: Optional[AsyncSession] = None):
     """
     Обновляет время последнего сообщения пользователя
+    При config.LAST_MESSAGE_DEBOUNCE значение только запоминается в памяти,
+    запись выполняет фоновая задача (см. LastMessageTracker)
     Args:
         telegram_id: Telegram ID пользователя
+        session: Сессия единицы работы обновления (не используется при отложенной записи)
     """
-    async with get_session() as session:
-        await session.execute(
+    if config.LAST_MESSAGE_DEBOUNCE:
+        last_message_tracker.touch(telegram_id)
+        return
+    if session is not None:
+        user = await get_user_by_telegram_id(telegram_id, session)
+        if user is not None:
+            user.last_message_date = datetime.now()
+        return
+    async with get_session() as db:
+        await db.execute(
             update(User)
             .where(User.telegram_id == telegram_id)
             .values(last_message_date=datetime.now())
         )
-        await session.commit()
+        await db.commit()
 
-async def add_chat_message(user_id: int, message: str, is_from_user: bool, is_moderator_chat: bool = False):
+async def add_chat_message(user_id: int, message: str, is_from_user: bool, is_moderator_chat: bool = False,
+                           session: Optional[AsyncSession] = None):
     """
     Добавляет сообщение в историю чата
     Args:
@@ -59,56 +260,138 @@ async def add_chat_message(user_id: int, message: str, is_from_user: bool, is_mo
         message: Текст сообщения
         is_from_user: Отправлено ли сообщение пользователем
         is_moderator_chat: Является ли сообщение частью чата с модератором
+        session: Сессия единицы работы обновления (не используется при отложенной записи)
     """
-    async with get_session() as session:
-        chat_message = ChatHistory(
-            user_id=user_id,
-            message=message,
-            is_from_user=is_from_user,
-            is_moderator_chat=is_moderator_chat
-        )
-        session.add(chat_message)
-        await session.commit()
+    chat_message = ChatHistory(
+        user_id=user_id,
+        message=message,
+        is_from_user=is_from_user,
+        is_moderator_chat=is_moderator_chat
+    )
+    if config.CHAT_HISTORY_WRITE_BEHIND:
+        await chat_history_buffer.add(chat_message)
+        return
+    async with session_scope(session, commit=True) as db:
+        db.add(chat_message)
+        if session is not None:
+            # Сообщение записывается общим коммитом, до него оно видно get_last_messages этой сессии
+            session.info.setdefault('pending_messages', []).append(chat_message)
 
-async def get_last_messages(user_id: int, limit: int = 5) -> list:
+async def get_last_messages(user_id: int, limit: int = 5, after_id: int = 0,
+                            session: Optional[AsyncSession] = None) -> list:
     """
     Получает последние сообщения пользователя
     Args:
         user_id: ID пользователя
         limit: Максимальное количество сообщений
+        after_id: Учитывать только сообщения с ID больше указанного (уже вошедшие в сводку пропускаются)
+        session: Сессия единицы работы обновления
+    Returns:
+        list: Список последних сообщений (включая еще не записанные сообщения буфера и сессии)
+    """
+    # Буфер читается до запроса: сообщение, записанное во время запроса, отсеивается по ID
+    buffered = chat_history_buffer.pending(user_id)
+    async with session_scope(session) as db:
+        result = await db.execute(
+            select(ChatHistory)
+            .where(ChatHistory.user_id == user_id, ChatHistory.id > after_id)
+            .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+            .limit(limit)
+        )
+        messages = list(reversed(result.scalars().all()))
+    stored_ids = {msg.id for msg in messages}
+    messages += [msg for msg in buffered if msg.id is None or (msg.id > after_id and msg.id not in stored_ids)]
+    if session is not None:
+        messages += [msg for msg in session.info.get('pending_messages', []) if msg.user_id == user_id]
+    return messages[-limit:] if limit else []
+
+async def get_messages_after(user_id: int, after_id: int = 0) -> list:
+    """
+    Получает все сообщения пользователя после указанного
+    Сообщения из буфера отложенной записи предварительно записываются в базу
+    Args:
+        user_id: ID пользователя
+        after_id: ID сообщения, после которого начинается выборка
     Returns:
-        list: Список последних сообщений
+        list: Список сообщений от старых к новым
     """
+    await chat_history_buffer.flush()
     async with get_session() as session:
         result = await session.execute(
             select(ChatHistory)
-            .where(ChatHistory.user_id == user_id)
-            .order_by(ChatHistory.timestamp.desc())
-            .limit(limit)
+            .where(ChatHistory.user_id == user_id, ChatHistory.id > after_id)
+            .order_by(ChatHistory.id)
+        )
+        return result.scalars().all()
+
+async def get_conversation_summary(user_id: int, session: Optional[AsyncSession] = None) -> ConversationSummary:
+    """
+    Получает сводку диалога пользователя
+    Args:
+        user_id: ID пользователя
+        session: Сессия единицы работы обновления
+    Returns:
+        ConversationSummary: Сводка или None, если она еще не создана
+    """
+    async with session_scope(session) as db:
+        result = await db.execute(
+            select(ConversationSummary).where(ConversationSummary.user_id == user_id)
+        )
+        return result.scalar_one_or_none()
+
+async def save_conversation_summary(user_id: int, summary: str, last_message_id: int):
+    """
+    Создает или обновляет сводку диалога пользователя
+    Args:
+        user_id: ID пользователя
+        summary: Текст сводки
+        last_message_id: ID последнего сообщения, вошедшего в сводку
+    """
+    async with get_session() as session:
+        result = await session.execute(
+            select(ConversationSummary).where(ConversationSummary.user_id == user_id)
         )
-        return list(reversed(result.scalars().all()))
+        record = result.scalar_one_or_none()
+        if record is None:
+            session.add(ConversationSummary(
+                user_id=user_id,
+                summary=summary,
+                last_message_id=last_message_id
+            ))
+        else:
+            record.summary = summary
+            record.last_message_id = last_message_id
+        await session.commit()
 
-async def get_all_users() -> list:
+async def get_all_users(session: Optional[AsyncSession] = None) -> list:
     """
     Получает список всех пользователей
+    Args:
+        session: Сессия единицы работы обновления
     Returns:
         list: Список всех пользователей
     """
-    async with get_session() as session:
-        result = await session.execute(select(User))
+    async with session_scope(session) as db:
+        result = await db.execute(select(User))
         return result.scalars().all()
 
-async def update_user_moderator_chat_status(telegram_id: int, status: bool):
+async def update_user_moderator_chat_status(telegram_id: int, status: bool, session: Optional[AsyncSession] = None):
     """
     Обновляет статус чата пользователя с модератором
     Args:
         telegram_id: Telegram ID пользователя
         status: Новый статус
+        session: Сессия единицы работы обновления
     """
-    async with get_session() as session:
-        await session.execute(
+    if session is not None:
+        user = await get_user_by_telegram_id(telegram_id, session)
+        if user is not None:
+            user.is_chatting_with_moderator = status
+        return
+    async with get_session() as db:
+        await db.execute(
             update(User)
             .where(User.telegram_id == telegram_id)
             .values(is_chatting_with_moderator=status)
         )
-        await session.commit() 
\ No newline at end of file
+        await db.commit()
@@ -1,14 +1,18 @@
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
+from sqlalchemy.ext.asyncio import AsyncSession
 from database.queries import (
     get_user_by_telegram_id,
     get_all_users,
     add_chat_message,
     update_user_moderator_chat_status
 )
+from database.db import release_session
+from services.vector_search import vector_search
 from config import config
 import logging
+from typing import Optional
 
 # Создание роутера для обработки сообщений от модераторов
 router = Router()
@@ -24,13 +28,13 @@ def is_moderator(user):
     return user and user.role == "MODERATOR"
 
 @router.message(Command("broadcast"))
-async def cmd_broadcast(message: Message):
+async def cmd_broadcast(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /broadcast
     Отправляет сообщение всем пользователям бота
     """
     # Проверяем права модератора
-    user = await get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id(message.from_user.id, session)
     if not is_moderator(user):
         await message.answer("Недостаточно прав для выполнения операции")
         return
@@ -42,7 +46,9 @@ async def cmd_broadcast(message: Message):
         return
 
     # Получаем список всех пользователей
-    users = await get_all_users()
+    users = await get_all_users(session)
+    # Рассылка может идти долго, соединение на это время возвращается в пул
+    await release_session(session)
     success_count = 0
     
     # Отправляем сообщение каждому пользователю
@@ -55,14 +61,42 @@ async def cmd_broadcast(message: Message):
 
     await message.answer(f"Рассылка отправлена {success_count} пользователям")
 
+@router.message(Command("reload_kb"))
+async def cmd_reload_kb(message: Message, session: Optional[AsyncSession] = None):
+    """
+    Обработчик команды /reload_kb
+    Перезагружает базу знаний из контекстного файла без перезапуска бота
+    """
+    # Проверяем права модератора
+    user = await get_user_by_telegram_id(message.from_user.id, session)
+    if not is_moderator(user):
+        await message.answer("Недостаточно прав для выполнения операции")
+        return
+
+    await message.answer("Перезагрузка базы знаний...")
+    try:
+        count = await vector_search.reload(config.CONTEXT_FILE)
+    except FileNotFoundError:
+        await message.answer(f"Контекстный файл не найден: {config.CONTEXT_FILE}")
+        return
+    except Exception as e:
+        logging.error(f"Ошибка при перезагрузке базы знаний: {str(e)}")
+        await message.answer(f"Ошибка при перезагрузке базы знаний: {str(e)}")
+        return
+
+    if count is None:
+        await message.answer("Перезагрузка базы знаний уже выполняется")
+        return
+    await message.answer(f"База знаний перезагружена: {count} контекстов")
+
 @router.message(Command("end"))
-async def cmd_end(message: Message):
+async def cmd_end(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /end
     Завершает чат с конкретным пользователем
     """
     # Проверяем права модератора
-    user = await get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id(message.from_user.id, session)
     if not is_moderator(user):
         await message.answer("Недостаточно прав для выполнения операции")
         return
@@ -75,7 +109,7 @@ async def cmd_end(message: Message):
         return
 
     # Получаем пользователя
-    target_user = await get_user_by_telegram_id(user_id)
+    target_user = await get_user_by_telegram_id(user_id, session)
     if not target_user:
         await message.answer("Пользователь не найден")
         return
@@ -86,7 +120,7 @@ async def cmd_end(message: Message):
         return
 
     # Завершаем чат
-    await update_user_moderator_chat_status(target_user.telegram_id, False)
+    await update_user_moderator_chat_status(target_user.telegram_id, False, session)
     
     # Отправляем уведомления
     await message.answer(f"Чат с пользователем {user_id} завершен")
@@ -100,13 +134,13 @@ async def cmd_end(message: Message):
         await message.answer(f"Ошибка при отправке уведомления пользователю: {str(e)}")
 
 @router.message(lambda message: message.text and message.text.startswith('/reply'))
-async def handle_reply(message: Message):
+async def handle_reply(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /reply
     Отправляет сообщение конкретному пользователю
     """
     # Проверяем права модератора
-    user = await get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id(message.from_user.id, session)
     if not is_moderator(user):
         return
 
@@ -124,7 +158,7 @@ async def handle_reply(message: Message):
         return
 
     # Получаем пользователя
-    target_user = await get_user_by_telegram_id(user_id)
+    target_user = await get_user_by_telegram_id(user_id, session)
     if not target_user:
         await message.answer("Пользователь не найден")
         return
@@ -139,7 +173,7 @@ async def handle_reply(message: Message):
         await message.bot.send_message(target_user.telegram_id, reply_text)
         
         # Сохраняем сообщение в истории
-        await add_chat_message(target_user.id, reply_text, False, True)
+        await add_chat_message(target_user.id, reply_text, False, True, session=session)
         
         # Подтверждаем отправку модератору
         await message.answer(f"Сообщение отправлено пользователю {user_id}")
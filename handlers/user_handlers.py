@@ -3,21 +3,30 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import release_session
 from database.queries import (
     get_user_by_telegram_id,
     add_chat_message,
-    get_last_messages,
     update_user_last_message,
     update_user_moderator_chat_status,
     create_user
 )
 from services.openai_service import openai_service
+from services.summary_service import conversation_summarizer
 from services.vector_search import vector_search
 from services.queue_service import process_moderator_notification
 from config import config
+import asyncio
 import logging
 import re
+import time
 from datetime import datetime
+from typing import AsyncIterator, Optional
+
+# Максимальная длина текста сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
 
 # Создание роутера для обработки сообщений от пользователей
 router = Router()
@@ -48,14 +57,63 @@ def validate_phone_number(phone: str) -> bool:
         return phone.startswith('7')
     return False
 
+async def answer_streaming(message: Message, deltas: AsyncIterator[str]) -> str:
+    """
+    Отправка ответа по мере генерации
+    Отправляет заглушку и редактирует ее не чаще config.STREAM_EDIT_INTERVAL;
+    текст длиннее лимита Telegram дописывается отдельными сообщениями в конце
+    Args:
+        message: Сообщение пользователя
+        deltas: Фрагменты ответа
+    Returns:
+        str: Полный текст ответа
+    """
+    reply = await message.answer(config.MESSAGES["ANSWER_PLACEHOLDER"])
+    text = ""
+    shown = ""
+    next_edit = time.monotonic()  # Первые фрагменты показываются сразу
+
+    async def edit(new_text: str):
+        nonlocal shown, next_edit
+        try:
+            await reply.edit_text(new_text)
+            shown = new_text
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: пропускаем промежуточные правки
+            next_edit = time.monotonic() + e.retry_after
+        except TelegramBadRequest as e:
+            # Текст не изменился - не ошибка
+            if "not modified" not in str(e):
+                raise
+            shown = new_text
+
+    async for delta in deltas:
+        text += delta
+        if time.monotonic() >= next_edit:
+            next_edit = time.monotonic() + config.STREAM_EDIT_INTERVAL
+            visible = text[:TELEGRAM_MESSAGE_LIMIT]
+            if visible.strip() and visible != shown:
+                await edit(visible)
+
+    # Итоговый текст отправляется обязательно, с ожиданием разрешенного момента правки
+    if not text.strip():
+        return text
+    first = text[:TELEGRAM_MESSAGE_LIMIT]
+    while first != shown:
+        await asyncio.sleep(max(0.0, next_edit - time.monotonic()))
+        await edit(first)
+    for start in range(TELEGRAM_MESSAGE_LIMIT, len(text), TELEGRAM_MESSAGE_LIMIT):
+        await message.answer(text[start:start + TELEGRAM_MESSAGE_LIMIT])
+    return text
+
 @router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /start
     Начинает процесс регистрации нового пользователя
     """
     try:
-        user = await get_user_by_telegram_id(message.from_user.id)
+        user = await get_user_by_telegram_id(message.from_user.id, session)
         if not user:
             # Если пользователь не зарегистрирован, запрашиваем номер телефона
             await message.answer(config.MESSAGES["WELCOME"])
@@ -68,7 +126,7 @@ async def cmd_start(message: Message, state: FSMContext):
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @router.message(RegistrationStates.waiting_for_phone)
-async def process_phone(message: Message, state: FSMContext):
+async def process_phone(message: Message, state: FSMContext, session: Optional[AsyncSession] = None):
     """
     Обработчик ввода номера телефона
     Создает нового пользователя в базе данных
@@ -87,7 +145,7 @@ async def process_phone(message: Message, state: FSMContext):
             phone = '7' + phone[1:]
         
         # Создание пользователя в базе данных
-        user = await create_user(message.from_user.id, phone)
+        user = await create_user(message.from_user.id, phone, session=session)
         await message.answer(config.MESSAGES["REGISTRATION_SUCCESS"])
         await state.clear()
     except Exception as e:
@@ -96,16 +154,16 @@ async def process_phone(message: Message, state: FSMContext):
         await state.clear()
 
 @router.message(Command("help"))
-async def cmd_help(message: Message):
+async def cmd_help(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /help
     Подключает пользователя к модератору
     """
     try:
-        user = await get_user_by_telegram_id(message.from_user.id)
+        user = await get_user_by_telegram_id(message.from_user.id, session)
         if user:
             # Активируем режим чата с модератором
-            await update_user_moderator_chat_status(user.telegram_id, True)
+            await update_user_moderator_chat_status(user.telegram_id, True, session)
             await message.answer(config.MESSAGES["HELP_REQUEST"])
             
             # Уведомляем модераторов о новом запросе
@@ -122,16 +180,16 @@ async def cmd_help(message: Message):
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @router.message(Command("end"))
-async def cmd_end(message: Message):
+async def cmd_end(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик команды /end
     Завершает чат с модератором
     """
     try:
-        user = await get_user_by_telegram_id(message.from_user.id)
+        user = await get_user_by_telegram_id(message.from_user.id, session)
         if user and user.is_chatting_with_moderator:
             # Деактивируем режим чата с модератором
-            await update_user_moderator_chat_status(user.telegram_id, False)
+            await update_user_moderator_chat_status(user.telegram_id, False, session)
             await message.answer(config.MESSAGES["CHAT_ENDED"])
         elif user:
             await message.answer("Вы не находитесь в активном чате с модератором.")
@@ -139,40 +197,85 @@ async def cmd_end(message: Message):
         logging.error(f"Ошибка при завершении чата с модератором: {str(e)}")
         await message.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-@router.message()
-async def handle_message(message: Message):
+# Команды сюда не попадают: нераспознанные этим роутером команды (/reload_kb,
+# /broadcast, /reply) обрабатываются роутером модераторов, подключенным следом
+@router.message(lambda message: not (message.text or "").startswith('/'))
+async def handle_message(message: Message, session: Optional[AsyncSession] = None):
     """
     Обработчик всех остальных сообщений
-    Обрабатывает обычные сообщения пользователя и генерирует ответы
+    Обрабатывает обычные сообщения пользователя и генерирует ответы.
+    Запросы к базе данных выполняются в сессии обновления; прочитанное и
+    вопрос фиксируются до запроса к OpenAI, ответ - после отправки
+    (см. DbSessionMiddleware)
     """
     try:
         # Проверяем регистрацию пользователя
-        user = await get_user_by_telegram_id(message.from_user.id)
+        user = await get_user_by_telegram_id(message.from_user.id, session)
         if not user:
             await message.answer("Пожалуйста, зарегистрируйтесь с помощью команды /start")
             return
 
         if user.is_chatting_with_moderator:
             # Если пользователь в чате с модератором, пересылаем сообщение
-            await add_chat_message(user.id, message.text, True, True)
+            await add_chat_message(user.id, message.text, True, True, session=session)
             return
 
         # Обновляем время последнего сообщения пользователя
-        await update_user_last_message(user.telegram_id)
+        await update_user_last_message(user.telegram_id, session)
 
         # Добавляем сообщение в историю чата
-        await add_chat_message(user.id, message.text, True)
+        await add_chat_message(user.id, message.text, True, session=session)
 
-        # Получаем последние сообщения для контекста
-        chat_history = await get_last_messages(user.id)
-        formatted_messages = openai_service.format_messages(chat_history)
+        # Быстрый путь: уверенное совпадение с базой знаний отвечается без OpenAI
+        if config.FAQ_DIRECT_ANSWER:
+            try:
+                answer = await vector_search.direct_answer(message.text)
+            except Exception as e:
+                logging.error(f"Ошибка при поиске ответа в базе знаний: {str(e)}")
+                answer = None
+            if answer:
+                await add_chat_message(user.id, answer, False, session=session)
+                await message.answer(answer)
+                return
+
+        # Получаем сводку диалога, последние сообщения и контекст из базы знаний для промпта
+        summary, chat_history = await conversation_summarizer.load(user.id, session)
+        context = None
+        if vector_search.is_ready:
+            try:
+                # Гибридный поиск: однозначное совпадение по ключевым словам не требует кодирования запроса
+                results = await vector_search.hybrid_search_async(
+                    message.text, k=1, threshold=vector_search.threshold
+                )
+                context = results[0][0] if results else None
+            except Exception as e:
+                logging.error(f"Ошибка при поиске контекста: {str(e)}")
+        formatted_messages = openai_service.build_messages(chat_history, context, summary)
+        # Соединение не удерживается на время ответа OpenAI, ответ записывается
+        # в той же сессии коротким коммитом в конце обновления
+        await release_session(session)
+
+        async def deliver_later(answer: str):
+            # Ответ на вопрос, отложенный до восстановления OpenAI
+            await add_chat_message(user.id, answer, False)
+            await message.answer(answer)
 
         try:
+            if config.OPENAI_STREAMING:
+                # Показываем ответ по мере генерации, в историю сохраняется только итоговый текст
+                response = await answer_streaming(
+                    message, openai_service.stream_chat_completion(formatted_messages, deliver_later)
+                )
+                await add_chat_message(user.id, response, False, session=session)
+                conversation_summarizer.schedule(user.id)
+                return
+
             # Получаем ответ от OpenAI
-            response = await openai_service.get_chat_completion(formatted_messages)
+            response = await openai_service.get_chat_completion(formatted_messages, deliver_later)
             
-            # Добавляем ответ бота в историю чата
-            await add_chat_message(user.id, response, False)
+            # Добавляем ответ бота в историю чата и обновляем сводку диалога в фоне
+            await add_chat_message(user.id, response, False, session=session)
+            conversation_summarizer.schedule(user.id)
             
             # Отправляем ответ пользователю
             await message.answer(response)
@@ -24,7 +24,7 @@ class AuthMiddleware(BaseMiddleware):
         user_id = event.from_user.id
 
         # Получаем пользователя из базы данных
-        user = await get_user_by_telegram_id(user_id)
+        user = await get_user_by_telegram_id(user_id, data.get('session'))
 
         # Проверяем команды, доступные без авторизации
         if event.text and event.text.startswith('/start'):
@@ -0,0 +1,38 @@
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from database.db import get_session
+import logging
+
+class DbSessionMiddleware(BaseMiddleware):
+    """
+    Middleware единицы работы с базой данных
+    Открывает одну сессию на обновление Telegram и передает ее обработчикам
+    через data['session']. Запросы из database/queries.py, получившие эту
+    сессию, используют одно соединение, а изменения фиксируются одним
+    коммитом после обработки обновления. Перед долгим ожиданием (OpenAI)
+    обработчик фиксирует прочитанное и записанное через release_session, и
+    соединение возвращается в пул: иначе каждое ожидающее ответа обновление
+    держало бы соединение и транзакцию чтения SQLite, а при пуле с
+    ограниченным числом соединений (QueuePool: 5 + 10 по умолчанию) даже
+    короткие обновления вроде /help ждали бы pool_timeout
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with get_session() as session:
+            data['session'] = session
+            result = await handler(event, data)
+
+            # Один коммит на обновление (для SQLite без изменений он ничего не записывает);
+            # при ошибке обработчика сессия закрывается без коммита и изменения откатываются
+            if session.in_transaction():
+                try:
+                    await session.commit()
+                except Exception as e:
+                    logging.error(f"Ошибка при сохранении изменений обновления: {str(e)}")
+                    raise
+            return result
@@ -0,0 +1,150 @@
+from collections import deque
+from prometheus_client import Counter, Gauge
+from typing import Optional
+import logging
+import time
+
+# Метрики Prometheus автоматического выключателя
+breaker_state = Gauge(
+    'circuit_breaker_state',
+    'Состояние автоматического выключателя: 0 - замкнут, 1 - пробные запросы, 2 - разомкнут',
+    ['name']
+)
+breaker_rejected = Counter(
+    'circuit_breaker_rejected_total',
+    'Запросы, отклоненные разомкнутым автоматическим выключателем',
+    ['name']
+)
+
+class CircuitOpenError(Exception):
+    """Запрос отклонен: автоматический выключатель разомкнут"""
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель (circuit breaker) для внешнего API
+    Учитывает результаты последних запросов в скользящем окне; слишком
+    медленный ответ считается ошибкой. Когда доля ошибок превышает порог,
+    выключатель размыкается и запросы сразу отклоняются. Через open_seconds
+    пропускается несколько пробных запросов: если все успешны, выключатель
+    замыкается, при первой ошибке снова размыкается. Каждое разрешение
+    помечено поколением состояния, в котором оно выдано: результаты запросов,
+    начатых до смены состояния, не учитываются (медленный успешный ответ,
+    начатый до сбоя, не считается пробным)
+    """
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, error_rate: float = 0.5, slow_call_seconds: float = 10.0, window: int = 20,
+                 min_calls: int = 5, open_seconds: float = 30.0, trial_calls: int = 2):
+        """
+        Инициализация выключателя
+        Args:
+            name: Название для метрик и логов
+            error_rate: Доля ошибок в окне, при которой выключатель размыкается (0.0 - 1.0)
+            slow_call_seconds: Ответ дольше указанного числа секунд считается ошибкой (0 - не учитывать задержку)
+            window: Количество последних запросов в окне
+            min_calls: Минимальное количество запросов в окне для оценки доли ошибок
+            open_seconds: Время в разомкнутом состоянии до пробных запросов
+            trial_calls: Количество успешных пробных запросов для замыкания
+        """
+        self.name = name
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.trial_calls = trial_calls
+        self.outcomes = deque(maxlen=window)  # True - ошибка или медленный ответ
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trials_started = 0
+        self._trials_passed = 0
+        self._generation = 1  # Увеличивается при каждой смене состояния
+        breaker_state.labels(name=name).set(self.STATE_VALUES[self.CLOSED])
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние; по истечении open_seconds разомкнутый выключатель переходит к пробным запросам"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> Optional[int]:
+        """
+        Проверка, можно ли выполнить запрос
+        В режиме пробных запросов одновременно пропускается не больше trial_calls
+        запросов; разрешенный запрос должен завершиться вызовом record или release
+        с полученным разрешением
+        Returns:
+            Optional[int]: Разрешение (поколение состояния, всегда истинно) или None,
+                если запрос отклонен
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return self._generation
+        if state == self.HALF_OPEN and self._trials_started < self.trial_calls:
+            self._trials_started += 1
+            return self._generation
+        breaker_rejected.labels(name=self.name).inc()
+        return None
+
+    def record(self, latency: Optional[float], permit: Optional[int] = None):
+        """
+        Учет результата разрешенного запроса
+        Args:
+            latency: Задержка ответа в секундах или None при ошибке
+            permit: Разрешение, полученное от allow (None - запрос текущего состояния)
+        """
+        if permit is not None and permit != self._generation:
+            # Запрос начался до смены состояния: результат уже не влияет на него
+            return
+        failed = latency is None or (self.slow_call_seconds > 0 and latency > self.slow_call_seconds)
+        if self._state == self.HALF_OPEN:
+            if failed:
+                self._open()
+                return
+            self._trials_passed += 1
+            if self._trials_passed >= self.trial_calls:
+                self.outcomes.clear()
+                self._set_state(self.CLOSED)
+            return
+        if self._state == self.OPEN:
+            # Запрос начался до размыкания: результат уже не влияет на состояние
+            return
+
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.error_rate:
+            self._open()
+
+    def release(self, permit: Optional[int] = None):
+        """
+        Освобождение разрешения без результата (запрос отменен)
+        Args:
+            permit: Разрешение, полученное от allow (None - запрос текущего состояния)
+        """
+        if permit is not None and permit != self._generation:
+            return
+        if self._state == self.HALF_OPEN and self._trials_started > self._trials_passed:
+            self._trials_started -= 1
+
+    def retry_after(self) -> float:
+        """Время в секундах до следующих пробных запросов (0, если выключатель не разомкнут)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def _open(self):
+        """Размыкание выключателя"""
+        self._opened_at = time.monotonic()
+        self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        """Переход в новое состояние с обновлением метрики"""
+        if state != self._state:
+            logging.warning(f"Автоматический выключатель {self.name}: {self._state} -> {state}")
+        self._state = state
+        self._generation += 1
+        self._trials_started = 0
+        self._trials_passed = 0
+        breaker_state.labels(name=self.name).set(self.STATE_VALUES[state])
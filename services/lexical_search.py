@@ -0,0 +1,171 @@
+import heapq
+import math
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+import snowballstemmer
+from config import config
+
+# Частые русские слова, которые не несут смысла для поиска по FAQ
+STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его ее ей
+если есть еще же за здесь и из или им их к как какая какие каким какой когда кто ли либо мне можно мой мы на
+над надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под после при про с со так
+также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья эта эти это я
+""".split())
+
+_TOKEN_PATTERN = re.compile(r'\w+')
+_stemmers = threading.local()
+
+@lru_cache(maxsize=100000)
+def stem(word: str) -> str:
+    """
+    Получение основы русского слова стеммером Snowball
+    Результаты кэшируются, стеммер создается отдельно для каждого потока
+    Args:
+        word: Слово в нижнем регистре
+    Returns:
+        str: Основа слова
+    """
+    stemmer = getattr(_stemmers, 'russian', None)
+    if stemmer is None:
+        stemmer = _stemmers.russian = snowballstemmer.stemmer('russian')
+    return stemmer.stemWord(word)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбиение текста на термы для инвертированного индекса
+    Приводит к нижнему регистру, заменяет ё на е, убирает стоп-слова и выделяет основы слов
+    Args:
+        text: Исходный текст
+    Returns:
+        List[str]: Список термов
+    """
+    words = _TOKEN_PATTERN.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+class LexicalIndex:
+    """
+    Инвертированный индекс с ранжированием BM25
+    Документы идентифицируются теми же ID, что и векторы в FAISS индексе;
+    поиск проходит только по спискам документов терминов запроса
+    """
+    def __init__(self, k1: Optional[float] = None, b: Optional[float] = None):
+        """
+        Инициализация индекса
+        Args:
+            k1: Параметр насыщения частоты терма BM25 (по умолчанию config.LEXICAL_BM25_K1)
+            b: Параметр нормализации по длине документа BM25 (по умолчанию config.LEXICAL_BM25_B)
+        """
+        self.k1 = config.LEXICAL_BM25_K1 if k1 is None else k1
+        self.b = config.LEXICAL_BM25_B if b is None else b
+        self.postings: Dict[str, Dict[int, int]] = {}  # терм -> {ID документа: частота}
+        self.doc_terms: Dict[int, Dict[str, int]] = {}  # ID документа -> {терм: частота}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        """Количество документов в индексе"""
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: int, text: str):
+        """
+        Добавление документа в индекс (существующий документ с тем же ID заменяется)
+        Args:
+            doc_id: ID документа
+            text: Текст документа
+        """
+        if doc_id in self.doc_lengths:
+            self.remove(doc_id)
+        terms = tokenize(text)
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_terms[doc_id] = frequencies
+        self.doc_lengths[doc_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, doc_id: int):
+        """
+        Удаление документа из индекса
+        Args:
+            doc_id: ID документа (неизвестный ID игнорируется)
+        """
+        frequencies = self.doc_terms.pop(doc_id, None)
+        if frequencies is None:
+            return
+        for term in frequencies:
+            documents = self.postings[term]
+            del documents[doc_id]
+            if not documents:
+                del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def clear(self):
+        """Удаление всех документов"""
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Поиск документов по BM25
+        Args:
+            query: Поисковый запрос
+            k: Максимальное количество результатов
+        Returns:
+            List[Tuple[int, float]]: Список (ID документа, оценка BM25) по убыванию оценки
+        """
+        scores = self._score(set(tokenize(query)))
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def exact_hit(self, query: str) -> Tuple[Optional[int], float]:
+        """
+        Поиск однозначного лексического совпадения
+        Совпадение считается однозначным, если лучший документ содержит все термы
+        запроса и его оценка BM25 превосходит следующий документ в
+        config.LEXICAL_EXACT_MARGIN раз
+        Args:
+            query: Поисковый запрос
+        Returns:
+            Tuple[Optional[int], float]: ID документа и его оценка или (None, 0.0)
+        """
+        terms = set(tokenize(query))
+        results = heapq.nlargest(2, self._score(terms).items(), key=lambda item: item[1])
+        if not results:
+            return None, 0.0
+        doc_id, score = results[0]
+        if not terms.issubset(self.doc_terms[doc_id]):
+            return None, 0.0
+        if len(results) > 1 and score < results[1][1] * config.LEXICAL_EXACT_MARGIN:
+            return None, 0.0
+        return doc_id, score
+
+    def _score(self, terms: Set[str]) -> Dict[int, float]:
+        """
+        Подсчет оценок BM25 для документов, содержащих термы запроса
+        Args:
+            terms: Уникальные термы запроса
+        Returns:
+            Dict[int, float]: Отображение ID документа -> оценка
+        """
+        count = len(self.doc_lengths)
+        if not count or not terms:
+            return {}
+        average_length = self.total_length / count
+        scores: Dict[int, float] = {}
+        for term in terms:
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+            idf = math.log(1 + (count - len(documents) + 0.5) / (len(documents) + 0.5))
+            for doc_id, frequency in documents.items():
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / average_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (
+                    frequency + self.k1 * length_norm
+                )
+        return scores
@@ -0,0 +1,234 @@
+from collections import deque
+from openai import AsyncOpenAI
+from prometheus_client import Counter, Histogram
+from typing import Any, AsyncIterator, Dict, List, Optional
+import asyncio
+import json
+import logging
+import time
+from config import config
+from services.openai_gateway import OpenAIGateway
+
+# Метрики Prometheus маршрутизации запросов к моделям
+route_latency = Histogram(
+    'openai_route_latency_seconds',
+    'Время ответа маршрута OpenAI (для потоковых запросов - до первого фрагмента)',
+    ['route', 'kind'],
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
+route_errors = Counter('openai_route_errors_total', 'Ошибки запросов по маршрутам OpenAI', ['route'])
+hedged_requests = Counter(
+    'openai_hedged_requests_total',
+    'Запросы с дублирующим (hedged) запросом',
+    ['winner']  # primary - успел основной запрос, hedge - дублирующий
+)
+
+class Route:
+    """
+    Маршрут запросов: модель и endpoint с собственным клиентом и шлюзом
+    Хранит скользящее окно задержек и сглаженную долю ошибок для выбора маршрута
+    """
+    def __init__(self, name: str, model: str, client: AsyncOpenAI, max_prompt_tokens: int = 0):
+        """
+        Инициализация маршрута
+        Args:
+            name: Название маршрута для метрик
+            model: Модель OpenAI
+            client: Клиент AsyncOpenAI endpoint
+            max_prompt_tokens: Максимальная длина промпта для маршрута (0 - без ограничения)
+        """
+        self.name = name
+        self.model = model
+        self.client = client
+        self.gateway = OpenAIGateway(client)
+        self.max_prompt_tokens = max_prompt_tokens
+        self.latencies = deque(maxlen=config.OPENAI_ROUTE_WINDOW)
+        self.error_rate = 0.0
+
+    def accepts(self, prompt_tokens: int) -> bool:
+        """Помещается ли промпт в ограничение маршрута"""
+        return not self.max_prompt_tokens or prompt_tokens <= self.max_prompt_tokens
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Квантиль задержки по скользящему окну
+        Args:
+            q: Квантиль (0.0 - 1.0)
+        Returns:
+            Optional[float]: Задержка в секундах или None, если данных нет
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def score(self) -> float:
+        """
+        Оценка маршрута для выбора (меньше - лучше): медианная задержка с штрафом за ошибки
+        Маршрут без данных получает нулевую оценку, чтобы на него попал трафик
+        """
+        median = self.quantile(0.5)
+        if median is None:
+            return 0.0
+        return median * (1 + 10 * self.error_rate)
+
+    def record(self, latency: Optional[float], kind: str = "completion"):
+        """
+        Учет результата запроса
+        Args:
+            latency: Задержка в секундах или None при ошибке
+            kind: completion - полный ответ, first_chunk - первый фрагмент потока
+        """
+        if latency is None:
+            route_errors.labels(route=self.name).inc()
+            self.error_rate = 0.9 * self.error_rate + 0.1
+            return
+        route_latency.labels(route=self.name, kind=kind).observe(latency)
+        self.error_rate = 0.9 * self.error_rate
+        if kind == "completion":
+            self.latencies.append(latency)
+
+def load_routes() -> List[Route]:
+    """
+    Создание маршрутов из config.OPENAI_ROUTES
+    OPENAI_ROUTES - JSON список объектов с полями name, model, base_url, api_key
+    и max_prompt_tokens; если он пуст, используется один маршрут по
+    config.OPENAI_MODEL и config.OPENAI_BASE_URL
+    Returns:
+        List[Route]: Маршруты в порядке приоритета
+    """
+    specs: List[Dict[str, Any]] = json.loads(config.OPENAI_ROUTES) if config.OPENAI_ROUTES else []
+    if not specs:
+        specs = [{"name": "default", "model": config.OPENAI_MODEL, "base_url": config.OPENAI_BASE_URL}]
+    routes = []
+    for position, spec in enumerate(specs):
+        client = AsyncOpenAI(
+            api_key=spec.get("api_key") or config.OPENAI_API_KEY,
+            base_url=spec.get("base_url") or config.OPENAI_BASE_URL or None,
+            max_retries=0  # Повторы выполняет шлюз
+        )
+        routes.append(Route(
+            spec.get("name") or f"route{position}",
+            spec.get("model") or config.OPENAI_MODEL,
+            client,
+            int(spec.get("max_prompt_tokens") or 0)
+        ))
+    return routes
+
+class ModelRouter:
+    """
+    Маршрутизация запросов по моделям и endpoint
+    Маршрут выбирается по длине промпта и скользящей оценке задержки и ошибок.
+    Если включено дублирование, после задержки на уровне p95 отправляется
+    второй запрос (на следующий по оценке маршрут), проигравший запрос отменяется
+    """
+    def __init__(self, routes: List[Route]):
+        """
+        Инициализация маршрутизатора
+        Args:
+            routes: Маршруты в порядке приоритета
+        """
+        if not routes:
+            raise ValueError("Не задано ни одного маршрута OpenAI")
+        self.routes = routes
+
+    def choose(self, prompt_tokens: int) -> List[Route]:
+        """
+        Упорядочивание подходящих маршрутов по оценке
+        Args:
+            prompt_tokens: Длина промпта в токенах
+        Returns:
+            List[Route]: Маршруты от лучшего к худшему (все, если ни один не подходит по длине)
+        """
+        eligible = [route for route in self.routes if route.accepts(prompt_tokens)] or list(self.routes)
+        # sorted устойчив: при равной оценке сохраняется порядок из конфигурации
+        return sorted(eligible, key=lambda route: route.score())
+
+    async def create(self, prompt_tokens: int, estimated_tokens: int, **kwargs) -> Any:
+        """
+        Запрос chat completion через выбранный маршрут с дублированием
+        Args:
+            prompt_tokens: Длина промпта в токенах
+            estimated_tokens: Оценка расхода токенов для квоты TPM
+            **kwargs: Параметры client.chat.completions.create без model
+        Returns:
+            Ответ API
+        """
+        routes = self.choose(prompt_tokens)
+        primary = asyncio.ensure_future(self._call(routes[0], estimated_tokens, kwargs))
+        tasks = [primary]
+        # Незавершенные запросы отменяются при любом выходе, в том числе при отмене вызывающего
+        try:
+            if not config.OPENAI_HEDGE_ENABLED:
+                return await primary
+
+            delay = routes[0].quantile(config.OPENAI_HEDGE_QUANTILE)
+            delay = max(config.OPENAI_HEDGE_MIN_DELAY, delay if delay is not None else config.OPENAI_HEDGE_MIN_DELAY)
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            # Дублирующий запрос уходит на следующий маршрут (или на тот же, если он единственный)
+            hedge_route = routes[1] if len(routes) > 1 else routes[0]
+            hedge = asyncio.ensure_future(self._call(hedge_route, estimated_tokens, kwargs))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        hedged_requests.labels(winner="primary" if task is primary else "hedge").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def stream(self, prompt_tokens: int, estimated_tokens: int, **kwargs) -> AsyncIterator[Any]:
+        """
+        Потоковый запрос через лучший маршрут (без дублирования: ответ уже
+        показывается пользователю по мере генерации)
+        Args:
+            prompt_tokens: Длина промпта в токенах
+            estimated_tokens: Оценка расхода токенов для квоты TPM
+            **kwargs: Параметры client.chat.completions.create без model
+        Returns:
+            AsyncIterator[Any]: Фрагменты ответа API
+        """
+        route = self.choose(prompt_tokens)[0]
+        started = time.monotonic()
+        first = True
+        try:
+            async for chunk in route.gateway.stream(estimated_tokens, model=route.model, **kwargs):
+                if first:
+                    route.record(time.monotonic() - started, kind="first_chunk")
+                    first = False
+                yield chunk
+        except Exception:
+            route.record(None)
+            raise
+
+    async def _call(self, route: Route, estimated_tokens: int, kwargs: Dict[str, Any]) -> Any:
+        """
+        Запрос через маршрут с учетом задержки и ошибок
+        Args:
+            route: Маршрут
+            estimated_tokens: Оценка расхода токенов
+            kwargs: Параметры client.chat.completions.create без model
+        Returns:
+            Ответ API
+        """
+        started = time.monotonic()
+        try:
+            response = await route.gateway.create(estimated_tokens, model=route.model, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            route.record(None)
+            logging.warning(f"Ошибка маршрута OpenAI {route.name} ({type(e).__name__}): {str(e)}")
+            raise
+        route.record(time.monotonic() - started)
+        return response
@@ -0,0 +1,254 @@
+from contextlib import asynccontextmanager
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from prometheus_client import Counter, Gauge, Histogram
+from typing import Any, AsyncIterator, Optional
+import asyncio
+import logging
+import random
+import time
+from config import config
+from services.prompt_builder import count_message_tokens, count_tokens
+
+# Метрики Prometheus очереди запросов к OpenAI
+openai_queue_depth = Gauge('openai_queue_depth', 'Запросы к OpenAI, ожидающие слота или квоты')
+openai_in_flight = Gauge('openai_in_flight', 'Выполняющиеся запросы к OpenAI')
+openai_queue_wait = Histogram('openai_queue_wait_seconds', 'Время ожидания слота и квоты перед запросом к OpenAI')
+openai_retries = Counter('openai_retries_total', 'Повторные запросы к OpenAI', ['reason'])
+openai_requests = Counter('openai_requests_total', 'Запросы к OpenAI', ['status'])
+
+# Ошибки, после которых запрос имеет смысл повторить (429, 5xx, сеть, таймаут)
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError, APITimeoutError, asyncio.TimeoutError)
+
+class DeadlineExceeded(Exception):
+    """Запрос к OpenAI не уложился в отведенное время с учетом ожидания и повторов"""
+
+class TokenBucket:
+    """
+    Ведро токенов для равномерного расходования квоты в минуту
+    Ожидающие запросы обслуживаются по очереди, поэтому крупный запрос
+    не голодает из-за потока мелких
+    """
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Инициализация ведра
+        Args:
+            per_minute: Квота в минуту (0 - без ограничения)
+            capacity: Максимальный запас (по умолчанию квота в минуту)
+        """
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self, amount: float = 1):
+        """
+        Ожидание и списание квоты
+        Args:
+            amount: Количество списываемых единиц (не больше емкости ведра)
+        """
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float):
+        """
+        Возврат неизрасходованной квоты (оценка оказалась больше фактического расхода)
+        Args:
+            amount: Количество возвращаемых единиц (отрицательное - доплата)
+        """
+        if not self.rate:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def _refill(self):
+        """Пополнение ведра за прошедшее время"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+class OpenAIGateway:
+    """
+    Шлюз запросов к OpenAI
+    Ограничивает число одновременных запросов, распределяет запросы и токены
+    по квотам RPM/TPM, повторяет запросы при 429/5xx с экспоненциальной
+    задержкой и случайным разбросом и прерывает запросы по истечении срока
+    """
+    def __init__(self, client, max_concurrency: Optional[int] = None, rpm: Optional[float] = None,
+                 tpm: Optional[float] = None, max_retries: Optional[int] = None, timeout: Optional[float] = None):
+        """
+        Инициализация шлюза
+        Args:
+            client: Клиент AsyncOpenAI
+            max_concurrency: Максимум одновременных запросов (по умолчанию config.OPENAI_MAX_CONCURRENCY)
+            rpm: Квота запросов в минуту (по умолчанию config.OPENAI_RPM)
+            tpm: Квота токенов в минуту (по умолчанию config.OPENAI_TPM)
+            max_retries: Максимум повторов (по умолчанию config.OPENAI_MAX_RETRIES)
+            timeout: Срок выполнения запроса в секундах (по умолчанию config.OPENAI_REQUEST_TIMEOUT)
+        """
+        self.client = client
+        self.max_concurrency = max_concurrency or config.OPENAI_MAX_CONCURRENCY
+        self.max_retries = config.OPENAI_MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = timeout or config.OPENAI_REQUEST_TIMEOUT
+        self.requests_bucket = TokenBucket(config.OPENAI_RPM if rpm is None else rpm)
+        self.tokens_bucket = TokenBucket(config.OPENAI_TPM if tpm is None else tpm)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def create(self, estimated_tokens: int, **kwargs) -> Any:
+        """
+        Запрос chat completion с ограничениями и повторами
+        Args:
+            estimated_tokens: Оценка расхода токенов (промпт + максимум ответа) для квоты TPM
+            **kwargs: Параметры client.chat.completions.create
+        Returns:
+            Ответ API
+        """
+        deadline = time.monotonic() + self.timeout
+        async with self._slot(estimated_tokens, deadline):
+            response = await self._call_with_retries(kwargs, deadline)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self.tokens_bucket.refund(estimated_tokens - usage.total_tokens)
+        return response
+
+    async def stream(self, estimated_tokens: int, **kwargs) -> AsyncIterator[Any]:
+        """
+        Потоковый запрос chat completion с ограничениями и повторами
+        Повторяется только открытие потока; слот занят до конца чтения ответа,
+        срок ограничивает время до первого фрагмента и паузы между фрагментами.
+        Поток не содержит usage, поэтому после чтения неизрасходованная часть
+        квоты TPM возвращается по локальному подсчету токенов промпта и ответа
+        Args:
+            estimated_tokens: Оценка расхода токенов для квоты TPM
+            **kwargs: Параметры client.chat.completions.create (stream=True добавляется)
+        Returns:
+            AsyncIterator[Any]: Фрагменты ответа API
+        """
+        deadline = time.monotonic() + self.timeout
+        async with self._slot(estimated_tokens, deadline):
+            stream = await self._call_with_retries(dict(kwargs, stream=True), deadline)
+            iterator = stream.__aiter__()
+            completion = []
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    choices = getattr(chunk, 'choices', None)
+                    if choices and choices[0].delta.content:
+                        completion.append(choices[0].delta.content)
+                    yield chunk
+            finally:
+                # Возврат квоты и при прерванном чтении: расход - полученная часть ответа
+                model = kwargs.get('model')
+                used = count_message_tokens(kwargs.get('messages', []), model) + count_tokens("".join(completion), model)
+                self.tokens_bucket.refund(estimated_tokens - used)
+
+    @asynccontextmanager
+    async def _slot(self, estimated_tokens: int, deadline: float):
+        """
+        Ожидание слота конкурентности и квот RPM/TPM
+        Args:
+            estimated_tokens: Оценка расхода токенов
+            deadline: Момент истечения срока запроса (time.monotonic)
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.monotonic()
+        openai_queue_depth.inc()
+        acquired = False
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self._remaining(deadline))
+            acquired = True
+            await asyncio.wait_for(self.requests_bucket.acquire(1), self._remaining(deadline))
+            await asyncio.wait_for(self.tokens_bucket.acquire(estimated_tokens), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            if acquired:
+                self._semaphore.release()
+            openai_requests.labels(status="deadline").inc()
+            raise DeadlineExceeded("Истек срок ожидания очереди запросов к OpenAI")
+        except BaseException:
+            # Отмена во время ожидания квот (например, проигравший хеджированный запрос)
+            # не должна оставлять слот занятым
+            if acquired:
+                self._semaphore.release()
+            raise
+        finally:
+            openai_queue_depth.dec()
+            openai_queue_wait.observe(time.monotonic() - started)
+        openai_in_flight.inc()
+        try:
+            yield
+        finally:
+            openai_in_flight.dec()
+            self._semaphore.release()
+
+    async def _call_with_retries(self, kwargs: dict, deadline: float) -> Any:
+        """
+        Вызов API с повторами при временных ошибках
+        Задержка растет экспоненциально со случайным разбросом (full jitter);
+        заголовок Retry-After учитывается, если сервер его прислал
+        Args:
+            kwargs: Параметры client.chat.completions.create
+            deadline: Момент истечения срока запроса (time.monotonic)
+        Returns:
+            Ответ API
+        """
+        attempt = 0
+        while True:
+            try:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(**kwargs), self._remaining(deadline)
+                )
+                openai_requests.labels(status="ok").inc()
+                return response
+            except RETRYABLE_ERRORS as e:
+                reason = type(e).__name__
+                delay = self._backoff(attempt, e)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    openai_requests.labels(status="deadline" if isinstance(e, asyncio.TimeoutError) else "error").inc()
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise DeadlineExceeded("Истек срок выполнения запроса к OpenAI") from e
+                    raise
+                attempt += 1
+                openai_retries.labels(reason=reason).inc()
+                logging.warning(f"Повтор запроса к OpenAI через {delay:.2f} с ({reason}), попытка {attempt}")
+                await asyncio.sleep(delay)
+            except Exception:
+                openai_requests.labels(status="error").inc()
+                raise
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Задержка перед повтором
+        Args:
+            attempt: Номер неудачной попытки, начиная с 0
+            error: Ошибка попытки
+        Returns:
+            float: Задержка в секундах
+        """
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        ceiling = min(config.OPENAI_RETRY_MAX_DELAY, config.OPENAI_RETRY_BASE_DELAY * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        """Оставшееся до срока время (не меньше нуля)"""
+        return max(0.0, deadline - time.monotonic())
@@ -1,7 +1,46 @@
-from openai import AsyncOpenAI
 from config import config
+from prometheus_client import Counter
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.model_router import ModelRouter, load_routes
+from services.prompt_builder import prompt_builder, count_message_tokens, count_tokens, record_usage
+from services.response_cache import response_cache, history_hash
+from services.single_flight import SingleFlight
+from services.vector_search import vector_search
+import asyncio
+import hashlib
+import json
 import logging
-from typing import List, Dict
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Dict, Optional
+
+# Ответ пользователю при ошибке OpenAI API
+ERROR_MESSAGE = "Извините, произошла ошибка при обработке запроса."
+
+class IncompleteResponseError(Exception):
+    """Потоковый ответ ведущего запроса прерван: объединенные с ним запросы выполняются заново"""
+
+# Метрика Prometheus ответов в деградированном режиме
+degraded_answers = Counter(
+    'openai_degraded_answers_total',
+    'Ответы без OpenAI при ошибке API или разомкнутом выключателе',
+    ['kind']  # knowledge_base - из базы знаний, deferred - вопрос отложен, error - сообщение об ошибке
+)
+
+def prompt_key(messages: List[Dict[str, str]]) -> str:
+    """
+    Ключ промпта для объединения одинаковых запросов
+    Тексты сообщений нормализуются: регистр и пробельные символы не учитываются
+    Args:
+        messages: Список сообщений в формате OpenAI
+    Returns:
+        str: SHA-256 хэш модели, лимита токенов и нормализованных сообщений
+    """
+    normalized = [
+        [msg.get("role"), " ".join(str(msg.get("content", "")).split()).lower()]
+        for msg in messages
+    ]
+    payload = json.dumps([config.OPENAI_MODEL, config.MAX_TOKENS, normalized], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
 class OpenAIService:
     """
@@ -11,30 +50,328 @@ class OpenAIService:
     def __init__(self):
         """
         Инициализация сервиса OpenAI
-        Создает клиент с API ключом и устанавливает максимальное количество токенов
+        Создает маршруты к моделям (у каждого свой клиент и шлюз с повторами)
+        и устанавливает максимальное количество токенов
         """
-        self.client = AsyncOpenAI(api_key=config.OPENAI_API_KEY)
+        self.router = ModelRouter(load_routes())
+        self.client = self.router.routes[0].client  # Клиент основного маршрута
         self.max_tokens = config.MAX_TOKENS
+        # Одинаковые одновременные запросы ждут один ответ API
+        self._in_flight = SingleFlight("openai")
+        # При частых ошибках и медленных ответах запросы сразу получают локальный ответ
+        self.breaker = CircuitBreaker(
+            "openai",
+            error_rate=config.OPENAI_BREAKER_ERROR_RATE,
+            slow_call_seconds=config.OPENAI_BREAKER_SLOW_CALL,
+            window=config.OPENAI_BREAKER_WINDOW,
+            min_calls=config.OPENAI_BREAKER_MIN_CALLS,
+            open_seconds=config.OPENAI_BREAKER_OPEN_SECONDS,
+            trial_calls=config.OPENAI_BREAKER_TRIAL_CALLS
+        )
+        # Отложенные вопросы: (время постановки, сообщения, функция доставки ответа)
+        self._deferred: asyncio.Queue = asyncio.Queue(maxsize=config.OPENAI_DEFERRED_QUEUE_SIZE)
 
-    async def get_chat_completion(self, messages: List[Dict[str, str]]) -> str:
+    async def get_chat_completion(self, messages: List[Dict[str, str]],
+                                  deliver: Optional[Callable[[str], Awaitable[Any]]] = None) -> str:
         """
         Получение ответа от модели GPT
+        Ответ на семантически эквивалентный запрос с той же историей берется
+        из кэша ответов без обращения к API, а одинаковые одновременные запросы
+        объединяются в один. При ошибке API или разомкнутом выключателе
+        возвращается локальный ответ (см. fallback_answer)
         Args:
             messages: Список сообщений в формате OpenAI
+            deliver: Функция доставки ответа, если вопрос придется отложить
         Returns:
-            str: Сгенерированный ответ или сообщение об ошибке
+            str: Сгенерированный или локальный ответ
         """
+        cache_key = await self._cache_key(messages)
+        if cache_key is not None:
+            cached = response_cache.get(*cache_key)
+            if cached is not None:
+                return cached
+
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            while True:
+                try:
+                    return await self._in_flight.do(prompt_key(messages), lambda: self._complete(messages, cache_key))
+                except IncompleteResponseError:
+                    continue  # Поток, к которому присоединился запрос, прерван: запрос выполняется заново
+        except CircuitOpenError:
+            return await self.fallback_answer(messages, deliver)
+        except Exception as e:
+            logging.error(f"Ошибка OpenAI API ({type(e).__name__}): {str(e)}")
+            return await self.fallback_answer(messages, deliver)
+
+    async def _complete(self, messages: List[Dict[str, str]], cache_key: Optional[tuple]) -> str:
+        """
+        Запрос ответа у API с сохранением в кэш ответов
+        Args:
+            messages: Список сообщений в формате OpenAI
+            cache_key: Ключ кэша ответов или None
+        Returns:
+            str: Сгенерированный ответ
+        """
+        started = time.perf_counter()
+        content = await self._request(messages, self.max_tokens, 0.7)  # 0.7 - параметр креативности ответов
+        if cache_key is not None:
+            response_cache.record_latency(time.perf_counter() - started)
+            response_cache.put(*cache_key, content)
+        return content
+
+    async def _request(self, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+        """
+        Запрос к API через автоматический выключатель
+        Args:
+            messages: Список сообщений в формате OpenAI
+            max_tokens: Максимальная длина ответа в токенах
+            temperature: Параметр креативности ответа
+        Returns:
+            str: Сгенерированный ответ
+        Raises:
+            CircuitOpenError: Выключатель разомкнут, запрос не выполнялся
+        """
+        permit = self.breaker.allow()
+        if permit is None:
+            raise CircuitOpenError("OpenAI временно недоступен")
+        prompt_tokens = count_message_tokens(messages)
+        started = time.perf_counter()
+        try:
+            response = await self.router.create(
+                prompt_tokens,
+                prompt_tokens + max_tokens,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        except asyncio.CancelledError:
+            self.breaker.release(permit)
+            raise
+        except Exception:
+            self.breaker.record(None, permit)
+            raise
+        self.breaker.record(time.perf_counter() - started, permit)
+
+        content = response.choices[0].message.content or ""
+        if response.usage is not None:
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        else:
+            record_usage(prompt_tokens, count_tokens(content))
+        return content
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]],
+                                     deliver: Optional[Callable[[str], Awaitable[Any]]] = None) -> AsyncIterator[str]:
+        """
+        Потоковое получение ответа от модели GPT
+        Возвращает фрагменты ответа по мере генерации; ответ из кэша или
+        выполняющегося такого же запроса возвращается одним фрагментом.
+        Полный ответ сохраняется в кэш после завершения генерации; если чтение
+        потока прервано, ответ не кэшируется, а объединенные запросы выполняются заново
+        Args:
+            messages: Список сообщений в формате OpenAI
+            deliver: Функция доставки ответа, если вопрос придется отложить
+        Returns:
+            AsyncIterator[str]: Фрагменты ответа (или локальный ответ одним фрагментом,
+                если выключатель разомкнут или ошибка произошла до первого фрагмента)
+        """
+        cache_key = await self._cache_key(messages)
+        if cache_key is not None:
+            cached = response_cache.get(*cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        key = prompt_key(messages)
+        while key in self._in_flight:
+            try:
+                answer = await self._in_flight.wait(key)
+            except IncompleteResponseError:
+                continue  # Ведущий поток прерван: ждем новый ведущий запрос или становимся им
+            except Exception:
+                # Ошибка до первого фрагмента: у каждого запроса свой локальный ответ
+                # (и своя доставка, если вопрос придется отложить)
+                answer = await self.fallback_answer(messages, deliver)
+            yield answer
+            return
+        permit = self.breaker.allow()
+        if permit is None:
+            yield await self.fallback_answer(messages, deliver)
+            return
+        future = self._in_flight.lead(key)
+
+        parts = []
+        recorded = False
+        completed = False
+        try:
+            started = time.perf_counter()
+            first_chunk = None
+            stream = self.router.stream(
+                count_message_tokens(messages),
+                self._estimate_tokens(messages),
                 messages=messages,
                 max_tokens=self.max_tokens,
                 temperature=0.7  # Параметр креативности ответов
             )
-            return response.choices[0].message.content
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                    parts.append(delta)
+                    yield delta
+            # Для выключателя задержка потока - время до первого фрагмента
+            self.breaker.record(first_chunk if first_chunk is not None else time.perf_counter() - started, permit)
+            recorded = completed = True
         except Exception as e:
-            logging.error(f"Ошибка OpenAI API: {str(e)}")
-            return "Извините, произошла ошибка при обработке запроса."
+            logging.error(f"Ошибка OpenAI API ({type(e).__name__}): {str(e)}")
+            self.breaker.record(None, permit)
+            recorded = True
+            if not parts:
+                future.set_exception(e)
+                yield await self.fallback_answer(messages, deliver)
+            return
+        finally:
+            if not recorded:
+                # Чтение прервано до завершения: разрешение выключателя освобождается без результата
+                self.breaker.release(permit)
+            # Ожидающие такой же запрос получают полный ответ; обрезанный ответ
+            # им не отдается, они выполняют запрос заново
+            if not future.done():
+                if completed:
+                    future.set_result("".join(parts) or ERROR_MESSAGE)
+                else:
+                    future.set_exception(IncompleteResponseError("Потоковый ответ OpenAI прерван"))
+
+        # Потоковый ответ не содержит usage, токены считаются локально
+        record_usage(count_message_tokens(messages), count_tokens("".join(parts)))
+        # Сюда доходит только полностью прочитанный поток
+        if completed and cache_key is not None and parts:
+            response_cache.record_latency(time.perf_counter() - started)
+            response_cache.put(*cache_key, "".join(parts))
+
+    async def get_service_completion(self, messages: List[Dict[str, str]], max_tokens: int,
+                                     temperature: float = 0.3) -> str:
+        """
+        Запрос ответа для служебных задач (например, сводки диалога)
+        Не использует кэш ответов и объединение запросов, ошибки API пробрасываются
+        Args:
+            messages: Список сообщений в формате OpenAI
+            max_tokens: Максимальная длина ответа в токенах
+            temperature: Параметр креативности ответа
+        Returns:
+            str: Сгенерированный ответ
+        """
+        return await self._request(messages, max_tokens, temperature)
+
+    async def fallback_answer(self, messages: List[Dict[str, str]],
+                              deliver: Optional[Callable[[str], Awaitable[Any]]] = None) -> str:
+        """
+        Локальный ответ без OpenAI (деградированный режим)
+        Возвращает лучшее совпадение из базы знаний; если его нет и передана
+        функция доставки, вопрос ставится в очередь и будет отвечен после
+        восстановления API
+        Args:
+            messages: Список сообщений в формате OpenAI
+            deliver: Функция доставки отложенного ответа
+        Returns:
+            str: Ответ из базы знаний, уведомление об отложенном ответе или сообщение об ошибке
+        """
+        query = messages[-1].get("content") if messages and messages[-1].get("role") == "user" else None
+        if query and vector_search.is_ready:
+            try:
+                results = await vector_search.hybrid_search_async(
+                    query, k=1, threshold=vector_search.threshold
+                )
+                context = results[0][0] if results else None
+            except Exception as e:
+                logging.error(f"Ошибка при поиске локального ответа: {str(e)}")
+                context = None
+            if context:
+                degraded_answers.labels(kind="knowledge_base").inc()
+                return config.MESSAGES["DEGRADED_ANSWER"].format(context=context)
+
+        if deliver is not None and not self._deferred.full():
+            self._deferred.put_nowait((time.monotonic(), messages, deliver))
+            degraded_answers.labels(kind="deferred").inc()
+            return config.MESSAGES["ANSWER_DEFERRED"]
+        degraded_answers.labels(kind="error").inc()
+        return ERROR_MESSAGE
+
+    async def process_deferred(self) -> None:
+        """
+        Фоновая обработка отложенных вопросов
+        Ждет пробных запросов выключателя, получает ответ и доставляет его
+        пользователю; вопросы старше config.OPENAI_DEFERRED_TTL отбрасываются
+        """
+        while True:
+            queued_at, messages, deliver = await self._deferred.get()
+            try:
+                while time.monotonic() - queued_at < config.OPENAI_DEFERRED_TTL:
+                    try:
+                        answer = await self._request(messages, self.max_tokens, 0.7)
+                    except CircuitOpenError:
+                        await asyncio.sleep(max(1.0, self.breaker.retry_after()))
+                        continue
+                    except Exception as e:
+                        logging.error(f"Ошибка OpenAI API при обработке отложенного вопроса ({type(e).__name__}): {str(e)}")
+                        await asyncio.sleep(max(1.0, self.breaker.retry_after()))
+                        continue
+                    await deliver(answer)
+                    break
+                else:
+                    logging.warning("Отложенный вопрос отброшен: истекло время ожидания восстановления OpenAI")
+            except Exception as e:
+                logging.error(f"Ошибка при доставке отложенного ответа: {str(e)}")
+
+    def _estimate_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """
+        Оценка расхода токенов запроса для квоты TPM: промпт и максимальная длина ответа
+        Args:
+            messages: Список сообщений в формате OpenAI
+        Returns:
+            int: Количество токенов
+        """
+        return count_message_tokens(messages) + self.max_tokens
+
+    async def _cache_key(self, messages: List[Dict[str, str]]) -> Optional[tuple]:
+        """
+        Ключ кэша ответов: эмбеддинг последней реплики пользователя и хэш истории
+        Кэш не используется, пока модель эмбеддингов не загружена
+        Args:
+            messages: Список сообщений в формате OpenAI
+        Returns:
+            Optional[tuple]: (эмбеддинг, хэш истории) или None, если кэш не применим
+        """
+        if not config.RESPONSE_CACHE_ENABLED or not vector_search.is_loaded:
+            return None
+        if not messages or messages[-1].get("role") != "user" or not messages[-1].get("content"):
+            return None
+        try:
+            embedding = await vector_search.embed_async(messages[-1]["content"])
+        except Exception as e:
+            logging.error(f"Ошибка при создании эмбеддинга для кэша ответов: {str(e)}")
+            return None
+        return embedding, history_hash(messages)
+
+    def build_messages(self, chat_history: List[Dict], context: Optional[str] = None,
+                       summary: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        Сборка промпта в пределах бюджета токенов
+        Добавляет системный промпт, найденный в базе знаний контекст и сводку
+        более ранней части диалога; старые сообщения истории обрезаются или
+        отбрасываются при нехватке бюджета
+        Args:
+            chat_history: Последние сообщения из базы данных, не вошедшие в сводку
+            context: Контекст из базы знаний, относящийся к вопросу
+            summary: Краткое содержание более ранней части диалога
+        Returns:
+            List[Dict[str, str]]: Сообщения в формате OpenAI
+        """
+        messages, tokens = prompt_builder.build(self.format_messages(chat_history), context, summary)
+        logging.debug(f"Промпт: {len(messages)} сообщений, {tokens} токенов")
+        return messages
 
     def format_messages(self, chat_history: List[Dict]) -> List[Dict[str, str]]:
         """
@@ -0,0 +1,270 @@
+from aiohttp import web
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from services.prompt_builder import count_message_tokens, count_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+# Слова для генерации ответов заглушки
+REPLY_WORDS = (
+    "для", "открытия", "вклада", "карты", "кредита", "нужен", "паспорт", "обратитесь", "в", "отделение",
+    "банка", "или", "мобильное", "приложение", "условия", "зависят", "от", "суммы", "и", "срока"
+)
+
+class OpenAIStubServer:
+    """
+    Локальная заглушка OpenAI-совместимого API chat completions
+    Отвечает с настраиваемым распределением задержки, поддерживает потоковые
+    ответы (SSE), внедряет ошибки 429/500 и зависания, считает токены.
+    Генератор случайных чисел инициализируется seed, поэтому прогоны воспроизводимы
+    """
+    def __init__(self, latency: str = "fixed", latency_mean: float = 0.5, latency_spread: float = 0.1,
+                 chunk_delay: float = 0.02, completion_tokens: int = 60, error_429_rate: float = 0.0,
+                 error_500_rate: float = 0.0, timeout_rate: float = 0.0, timeout_seconds: float = 600.0,
+                 seed: Optional[int] = None):
+        """
+        Инициализация заглушки
+        Args:
+            latency: Распределение задержки ответа (fixed, uniform, normal, lognormal, exponential)
+            latency_mean: Средняя задержка в секундах
+            latency_spread: Разброс: половина ширины для uniform, стандартное отклонение
+                для normal, сигма логарифма для lognormal
+            chunk_delay: Пауза между фрагментами потокового ответа в секундах
+            completion_tokens: Примерная длина ответа в токенах (не больше max_tokens запроса)
+            error_429_rate: Доля ответов 429 Too Many Requests
+            error_500_rate: Доля ответов 500 Internal Server Error
+            timeout_rate: Доля запросов, которые зависают на timeout_seconds
+            timeout_seconds: Длительность зависания
+            seed: Начальное значение генератора случайных чисел
+        """
+        if latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Неизвестное распределение задержки: {latency}. Допустимые: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_spread = latency_spread
+        self.chunk_delay = chunk_delay
+        self.completion_tokens = completion_tokens
+        self.error_429_rate = error_429_rate
+        self.error_500_rate = error_500_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.random = random.Random(seed)
+        self.stats: Dict[str, Any] = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Сброс счетчиков"""
+        self.stats = {
+            'requests': 0,
+            'responses': 0,
+            'streams': 0,
+            'errors': {'429': 0, '500': 0, 'timeout': 0},
+            'prompt_tokens': 0,
+            'completion_tokens': 0
+        }
+
+    def create_app(self) -> web.Application:
+        """
+        Создание aiohttp приложения
+        Returns:
+            web.Application: Приложение с маршрутами /v1/chat/completions, /v1/models и /stats
+        """
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.handle_chat_completions)
+        app.router.add_get('/v1/models', self.handle_models)
+        app.router.add_get('/stats', self.handle_stats)
+        app.router.add_post('/stats/reset', self.handle_stats_reset)
+        return app
+
+    async def handle_chat_completions(self, request: web.Request) -> web.StreamResponse:
+        """Обработчик POST /v1/chat/completions"""
+        self.stats['requests'] += 1
+        try:
+            body = await request.json()
+            messages: List[Dict[str, str]] = body["messages"]
+            model = body.get("model", "stub")
+        except (ValueError, KeyError, TypeError):
+            return self._error(400, "invalid_request_error", "Некорректное тело запроса")
+
+        # Внедрение ошибок
+        roll = self.random.random()
+        if roll < self.error_429_rate:
+            self.stats['errors']['429'] += 1
+            return self._error(429, "rate_limit_exceeded", "Превышена квота запросов", {'Retry-After': '1'})
+        roll -= self.error_429_rate
+        if roll < self.error_500_rate:
+            self.stats['errors']['500'] += 1
+            return self._error(500, "server_error", "Внутренняя ошибка заглушки")
+        roll -= self.error_500_rate
+        if roll < self.timeout_rate:
+            self.stats['errors']['timeout'] += 1
+            await asyncio.sleep(self.timeout_seconds)
+            return self._error(504, "timeout", "Истекло время ожидания")
+
+        prompt_tokens = count_message_tokens(messages)
+        max_tokens = body.get("max_tokens") or self.completion_tokens
+        words = self._reply_words(messages, min(self.completion_tokens, max_tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        await asyncio.sleep(self._sample_latency())
+        if body.get("stream"):
+            return await self._stream(request, completion_id, created, model, words, prompt_tokens)
+
+        content = " ".join(words)
+        completion_tokens = count_tokens(content)
+        self._account(prompt_tokens, completion_tokens)
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    async def handle_models(self, request: web.Request) -> web.Response:
+        """Обработчик GET /v1/models"""
+        return web.json_response({"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """Обработчик GET /stats: счетчики запросов, ошибок и токенов"""
+        return web.json_response(self.stats)
+
+    async def handle_stats_reset(self, request: web.Request) -> web.Response:
+        """Обработчик POST /stats/reset"""
+        self.reset_stats()
+        return web.json_response(self.stats)
+
+    async def _stream(self, request: web.Request, completion_id: str, created: int, model: str,
+                      words: List[str], prompt_tokens: int) -> web.StreamResponse:
+        """
+        Потоковый ответ в формате server-sent events
+        Args:
+            request: Запрос
+            completion_id: ID ответа
+            created: Время создания (unix)
+            model: Модель из запроса
+            words: Слова ответа, по одному на фрагмент
+            prompt_tokens: Токены промпта
+        Returns:
+            web.StreamResponse: Завершенный потоковый ответ
+        """
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        async def send(delta: Dict[str, str], finish_reason: Optional[str] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+        await send({"role": "assistant", "content": ""})
+        for position, word in enumerate(words):
+            await send({"content": word if position == 0 else " " + word})
+            await asyncio.sleep(self.chunk_delay)
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+
+        self.stats['streams'] += 1
+        self._account(prompt_tokens, count_tokens(" ".join(words)))
+        return response
+
+    def _account(self, prompt_tokens: int, completion_tokens: int):
+        """Учет успешного ответа и токенов"""
+        self.stats['responses'] += 1
+        self.stats['prompt_tokens'] += prompt_tokens
+        self.stats['completion_tokens'] += completion_tokens
+
+    def _sample_latency(self) -> float:
+        """Случайная задержка ответа по выбранному распределению (не меньше нуля)"""
+        mean, spread = self.latency_mean, self.latency_spread
+        if self.latency == "uniform":
+            value = self.random.uniform(mean - spread, mean + spread)
+        elif self.latency == "normal":
+            value = self.random.gauss(mean, spread)
+        elif self.latency == "lognormal":
+            # Медиана равна mean, хвост задается spread
+            value = mean * self.random.lognormvariate(0, spread)
+        elif self.latency == "exponential":
+            value = self.random.expovariate(1 / mean) if mean > 0 else 0.0
+        else:
+            value = mean
+        return max(0.0, value)
+
+    def _reply_words(self, messages: List[Dict[str, str]], tokens: int) -> List[str]:
+        """
+        Детерминированный текст ответа, зависящий от последнего сообщения
+        Args:
+            messages: Сообщения запроса
+            tokens: Примерная длина ответа в токенах
+        Returns:
+            List[str]: Слова ответа
+        """
+        last = messages[-1].get("content", "") if messages else ""
+        generator = random.Random(last)
+        words = []
+        while count_tokens(" ".join(words)) < tokens:
+            words.append(generator.choice(REPLY_WORDS))
+        return words or [REPLY_WORDS[0]]
+
+    @staticmethod
+    def _error(status: int, code: str, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+        """Ответ с ошибкой в формате OpenAI API"""
+        return web.json_response(
+            {"error": {"message": message, "type": code, "param": None, "code": code}},
+            status=status,
+            headers=headers
+        )
+
+if __name__ == '__main__':
+    # Запуск заглушки: python -m services.openai_stub_server --port 8080
+    # Бот направляется на нее через OPENAI_BASE_URL=http://localhost:8080/v1
+    parser = argparse.ArgumentParser(description="Локальная заглушка OpenAI chat completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--latency-mean", type=float, default=0.5)
+    parser.add_argument("--latency-spread", type=float, default=0.5)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-500-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    stub = OpenAIStubServer(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_spread=args.latency_spread,
+        chunk_delay=args.chunk_delay,
+        completion_tokens=args.completion_tokens,
+        error_429_rate=args.error_429_rate,
+        error_500_rate=args.error_500_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        seed=args.seed
+    )
+    web.run_app(stub.create_app(), host=args.host, port=args.port)
@@ -0,0 +1,198 @@
+from functools import lru_cache
+from prometheus_client import Counter, Histogram
+from typing import Dict, List, Optional, Tuple
+import logging
+from config import config
+
+# Служебные токены на каждое сообщение и на начало ответа (формат chat completions)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Метрики Prometheus расхода токенов
+openai_tokens = Counter(
+    'openai_tokens_total',
+    'Количество токенов в запросах к OpenAI',
+    ['kind']  # prompt - входные токены, completion - сгенерированные
+)
+prompt_tokens_histogram = Histogram(
+    'openai_prompt_tokens',
+    'Размер промпта в токенах',
+    buckets=(128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+)
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """
+    Токенизатор модели OpenAI
+    Создается один раз на модель; если tiktoken недоступен, возвращается None
+    и количество токенов оценивается приближенно
+    Args:
+        model: Название модели
+    Returns:
+        Токенизатор tiktoken или None
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"Токенизатор tiktoken недоступен, используется приближенный подсчет: {str(e)}")
+        return None
+
+@lru_cache(maxsize=10000)
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Подсчет токенов текста
+    Результаты кэшируются: история диалога пересчитывается при каждом запросе
+    Args:
+        text: Текст
+        model: Название модели (по умолчанию config.OPENAI_MODEL)
+    Returns:
+        int: Количество токенов
+    """
+    encoding = get_encoding(model or config.OPENAI_MODEL)
+    if encoding is None:
+        # Для русского текста в cl100k_base выходит около 2.5 символов на токен
+        return int(len(text) / 2.5) + 1
+    return len(encoding.encode(text))
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False, model: Optional[str] = None) -> str:
+    """
+    Обрезка текста до заданного количества токенов
+    Args:
+        text: Текст
+        max_tokens: Максимальное количество токенов
+        keep_end: Сохранять конец текста вместо начала
+        model: Название модели (по умолчанию config.OPENAI_MODEL)
+    Returns:
+        str: Обрезанный текст
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model or config.OPENAI_MODEL)
+    if encoding is None:
+        length = int((max_tokens - 1) * 2.5)
+        return text[-length:] if keep_end else text[:length]
+    tokens = encoding.encode(text)
+    # Граница обрезки может прийтись на середину слова, и при повторном
+    # кодировании токенов станет больше - тогда обрезаем сильнее
+    limit = max_tokens
+    while limit > 0:
+        result = encoding.decode(tokens[-limit:] if keep_end else tokens[:limit])
+        if len(encoding.encode(result)) <= max_tokens:
+            return result
+        limit -= 1
+    return ""
+
+def count_message_tokens(messages: List[Dict[str, str]], model: Optional[str] = None) -> int:
+    """
+    Подсчет токенов списка сообщений с учетом служебных токенов
+    Args:
+        messages: Сообщения в формате OpenAI
+        model: Название модели (по умолчанию config.OPENAI_MODEL)
+    Returns:
+        int: Количество токенов промпта
+    """
+    return sum(TOKENS_PER_MESSAGE + count_tokens(msg["content"], model) for msg in messages) + TOKENS_PER_REPLY
+
+def record_usage(prompt_tokens: int, completion_tokens: int):
+    """
+    Учет расхода токенов запроса
+    Args:
+        prompt_tokens: Токены промпта
+        completion_tokens: Сгенерированные токены
+    """
+    openai_tokens.labels(kind="prompt").inc(prompt_tokens)
+    openai_tokens.labels(kind="completion").inc(completion_tokens)
+    prompt_tokens_histogram.observe(prompt_tokens)
+    logging.info(f"Токены OpenAI: промпт {prompt_tokens}, ответ {completion_tokens}")
+
+class PromptBuilder:
+    """
+    Сборка промпта в пределах бюджета входных токенов
+    Порядок заполнения бюджета: системный промпт, найденный контекст из базы
+    знаний (не больше context_budget), сводка предыдущего диалога (не больше
+    config.SUMMARY_MAX_TOKENS), последняя реплика пользователя и далее
+    предыдущие сообщения от новых к старым. Старые сообщения, не поместившиеся
+    в бюджет, обрезаются или отбрасываются
+    """
+    def __init__(self, budget: Optional[int] = None, context_budget: Optional[int] = None,
+                 system_prompt: Optional[str] = None, model: Optional[str] = None):
+        """
+        Инициализация сборщика
+        Args:
+            budget: Бюджет входных токенов (по умолчанию config.PROMPT_TOKEN_BUDGET)
+            context_budget: Максимум токенов на контекст из базы знаний (по умолчанию config.PROMPT_CONTEXT_TOKENS)
+            system_prompt: Системный промпт (по умолчанию config.SYSTEM_PROMPT)
+            model: Название модели для токенизатора (по умолчанию config.OPENAI_MODEL)
+        """
+        self.budget = budget or config.PROMPT_TOKEN_BUDGET
+        self.context_budget = config.PROMPT_CONTEXT_TOKENS if context_budget is None else context_budget
+        self.system_prompt = config.SYSTEM_PROMPT if system_prompt is None else system_prompt
+        self.model = model or config.OPENAI_MODEL
+
+    def build(self, history: List[Dict[str, str]], context: Optional[str] = None,
+              summary: Optional[str] = None) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Сборка сообщений для OpenAI API
+        Args:
+            history: Сообщения диалога в формате OpenAI от старых к новым
+            context: Найденный контекст из базы знаний
+            summary: Краткое содержание более ранней части диалога
+        Returns:
+            Tuple[List[Dict[str, str]], int]: Сообщения и количество токенов промпта
+        """
+        remaining = self.budget - TOKENS_PER_REPLY
+        head: List[Dict[str, str]] = []
+
+        if self.system_prompt:
+            remaining -= self._add(head, "system", self.system_prompt, remaining)
+        if context:
+            limit = min(self.context_budget, remaining - TOKENS_PER_MESSAGE)
+            text = truncate_tokens(f"Информация из базы знаний:\n{context}", limit, model=self.model)
+            if text:
+                remaining -= self._add(head, "system", text, remaining)
+        if summary:
+            limit = min(config.SUMMARY_MAX_TOKENS, remaining - TOKENS_PER_MESSAGE)
+            text = truncate_tokens(f"Краткое содержание предыдущего диалога:\n{summary}", limit, model=self.model)
+            if text:
+                remaining -= self._add(head, "system", text, remaining)
+
+        # История заполняется от новых сообщений к старым
+        tail: List[Dict[str, str]] = []
+        for position, msg in enumerate(reversed(history)):
+            if remaining <= TOKENS_PER_MESSAGE:
+                break
+            # Последняя реплика обрезается с конца, старые сообщения - с начала (важнее их окончание)
+            used = self._add(tail, msg["role"], msg["content"], remaining, keep_end=position > 0)
+            if not used:
+                break
+            remaining -= used
+        messages = head + list(reversed(tail))
+        return messages, count_message_tokens(messages, self.model)
+
+    def _add(self, messages: List[Dict[str, str]], role: str, text: str, remaining: int,
+             keep_end: bool = False) -> int:
+        """
+        Добавление сообщения с обрезкой под оставшийся бюджет
+        Args:
+            messages: Список, в который добавляется сообщение
+            role: Роль отправителя
+            text: Текст сообщения
+            remaining: Оставшийся бюджет токенов
+            keep_end: Сохранять конец текста при обрезке
+        Returns:
+            int: Израсходованные токены (0, если сообщение не поместилось)
+        """
+        text = truncate_tokens(text, remaining - TOKENS_PER_MESSAGE, keep_end=keep_end, model=self.model)
+        if not text:
+            return 0
+        messages.append({"role": role, "content": text})
+        return TOKENS_PER_MESSAGE + count_tokens(text, self.model)
+
+# Создание глобального экземпляра сборщика промпта
+prompt_builder = PromptBuilder()
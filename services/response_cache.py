@@ -0,0 +1,243 @@
+import numpy as np
+from collections import OrderedDict
+from prometheus_client import Counter
+from typing import Dict, List, Optional
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import config
+
+# Метрики Prometheus семантического кэша ответов
+response_cache_requests = Counter(
+    'response_cache_requests_total',
+    'Обращения к семантическому кэшу ответов OpenAI',
+    ['result']  # hit - ответ из кэша, miss - запрос к OpenAI
+)
+response_cache_saved_seconds = Counter(
+    'response_cache_saved_seconds_total',
+    'Сэкономленное время ответа OpenAI (по средней задержке запросов)'
+)
+
+def history_hash(messages: List[Dict[str, str]]) -> str:
+    """
+    Хэш значимой части истории диалога
+    Учитываются последние config.RESPONSE_CACHE_HISTORY_MESSAGES сообщений перед
+    последней репликой пользователя и системные сообщения
+    Args:
+        messages: Сообщения в формате OpenAI, последнее - реплика пользователя
+    Returns:
+        str: SHA-256 хэш
+    """
+    previous = messages[:-1]
+    system = [msg for msg in previous if msg.get("role") == "system"]
+    dialog = [msg for msg in previous if msg.get("role") != "system"]
+    count = config.RESPONSE_CACHE_HISTORY_MESSAGES
+    relevant = system + (dialog[-count:] if count > 0 else [])
+    payload = json.dumps(
+        [[msg.get("role"), msg.get("content")] for msg in relevant],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SemanticResponseCache:
+    """
+    Семантический кэш ответов модели
+    Запись находится по эмбеддингу последней реплики пользователя (косинусное
+    сходство не ниже порога) среди записей с тем же хэшем истории диалога.
+    Размер ограничен с вытеснением давно не использованных записей (LRU),
+    записи устаревают через ttl секунд. При заданном path записи хранятся
+    в SQLite и переживают перезапуск
+    """
+    def __init__(self, maxsize: int, ttl: float, threshold: float, path: Optional[str] = None):
+        """
+        Инициализация кэша
+        Args:
+            maxsize: Максимальное количество записей
+            ttl: Время жизни записи в секундах (0 - без ограничения)
+            threshold: Минимальное косинусное сходство реплик для попадания
+            path: Путь к файлу SQLite (None или пустая строка - только память)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.path = path or None
+        self._entries = OrderedDict()  # ID -> (хэш истории, эмбеддинг, ответ, время создания)
+        self._buckets: Dict[str, List[int]] = {}  # хэш истории -> ID записей
+        self._matrices: Dict[str, np.ndarray] = {}  # хэш истории -> матрица эмбеддингов записей
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._average_latency: Optional[float] = None  # Средняя задержка запросов к OpenAI
+        if self.path:
+            self._open_db()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, embedding: np.ndarray, context_hash: str) -> Optional[str]:
+        """
+        Поиск ответа на семантически эквивалентный запрос
+        Args:
+            embedding: Эмбеддинг последней реплики пользователя
+            context_hash: Хэш значимой истории диалога
+        Returns:
+            Optional[str]: Сохраненный ответ или None
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            # Устаревшие записи удаляются до выбора лучшей, чтобы не заслонять действующие
+            if self.ttl and context_hash in self._buckets:
+                now = time.monotonic()
+                expired = [i for i in self._buckets[context_hash] if now - self._entries[i][3] > self.ttl]
+                for expired_id in expired:
+                    self._remove(expired_id)
+                if expired and self._db is not None:
+                    self._db.commit()
+            ids = self._buckets.get(context_hash)
+            entry_id = None
+            if ids:
+                matrix = self._matrices.get(context_hash)
+                if matrix is None:
+                    matrix = self._matrices[context_hash] = np.stack([self._entries[i][1] for i in ids])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = ids[best]
+            if entry_id is None:
+                self.misses += 1
+                response_cache_requests.labels(result="miss").inc()
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            response_cache_requests.labels(result="hit").inc()
+            if self._average_latency is not None:
+                self.saved_seconds += self._average_latency
+                response_cache_saved_seconds.inc(self._average_latency)
+            return self._entries[entry_id][2]
+
+    def put(self, embedding: np.ndarray, context_hash: str, response: str, created: Optional[float] = None):
+        """
+        Сохранение ответа
+        Args:
+            embedding: Эмбеддинг последней реплики пользователя
+            context_hash: Хэш значимой истории диалога
+            response: Ответ модели
+            created: Время создания по time.monotonic (по умолчанию текущее)
+        """
+        embedding = self._normalize(embedding)
+        created = time.monotonic() if created is None else created
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (context_hash, embedding, response, created)
+            self._buckets.setdefault(context_hash, []).append(entry_id)
+            self._matrices.pop(context_hash, None)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT INTO responses (id, history_hash, embedding, response, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (entry_id, context_hash, embedding.tobytes(), response, time.time() - (time.monotonic() - created))
+                )
+                self._db.commit()
+
+    def record_latency(self, seconds: float):
+        """
+        Учет задержки запроса к OpenAI для оценки сэкономленного времени
+        Args:
+            seconds: Длительность запроса
+        """
+        with self._lock:
+            if self._average_latency is None:
+                self._average_latency = seconds
+            else:
+                # Экспоненциальное скользящее среднее
+                self._average_latency = 0.9 * self._average_latency + 0.1 * seconds
+
+    def clear(self):
+        """Удаление всех записей"""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._matrices.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Статистика кэша
+        Returns:
+            Dict[str, float]: Попадания, промахи, доля попаданий, размер и сэкономленное время
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'size': len(self._entries),
+            'saved_seconds': self.saved_seconds
+        }
+
+    def _remove(self, entry_id: int):
+        """Удаление записи (вызывается под блокировкой)"""
+        context_hash = self._entries.pop(entry_id)[0]
+        ids = self._buckets[context_hash]
+        ids.remove(entry_id)
+        if not ids:
+            del self._buckets[context_hash]
+        self._matrices.pop(context_hash, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM responses WHERE id = ?", (entry_id,))
+
+    def _open_db(self):
+        """Открытие файла SQLite и загрузка сохраненных записей"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "id INTEGER PRIMARY KEY, history_hash TEXT, embedding BLOB, response TEXT, created_at REAL)"
+        )
+        now = time.time()
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        rows = self._db.execute(
+            "SELECT id, history_hash, embedding, response, created_at FROM responses ORDER BY id"
+        ).fetchall()
+        for entry_id, context_hash, embedding, response, created_at in rows[-self.maxsize:]:
+            self._entries[entry_id] = (
+                context_hash,
+                np.frombuffer(embedding, dtype='float32'),
+                response,
+                time.monotonic() - (now - created_at)
+            )
+            self._buckets.setdefault(context_hash, []).append(entry_id)
+        if len(rows) > self.maxsize:
+            self._db.execute("DELETE FROM responses WHERE id < ?", (rows[-self.maxsize][0],))
+        self._db.commit()
+        self._next_id = rows[-1][0] + 1 if rows else 0
+        logging.info(f"Загружено {len(self._entries)} записей кэша ответов из {self.path}")
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        """Нормированная копия эмбеддинга float32 для косинусного сходства"""
+        embedding = np.asarray(embedding, dtype='float32').ravel()
+        norm = float(np.linalg.norm(embedding))
+        return embedding / norm if norm else embedding.copy()
+
+# Создание глобального экземпляра кэша ответов
+response_cache = SemanticResponseCache(
+    config.RESPONSE_CACHE_SIZE,
+    config.RESPONSE_CACHE_TTL,
+    config.RESPONSE_CACHE_THRESHOLD,
+    config.RESPONSE_CACHE_PATH
+)
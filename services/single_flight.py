@@ -0,0 +1,88 @@
+from prometheus_client import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable
+import asyncio
+
+# Метрика Prometheus объединенных запросов
+coalesced_requests = Counter(
+    'single_flight_coalesced_total',
+    'Запросы, дождавшиеся результата такого же выполняющегося запроса',
+    ['name']
+)
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных операций
+    Пока операция с ключом выполняется, повторные вызовы с тем же ключом не
+    запускают ее заново, а ждут общий результат (или общую ошибку).
+    Отмена одного из ожидающих не отменяет операцию для остальных
+    """
+    def __init__(self, name: str):
+        """
+        Инициализация
+        Args:
+            name: Название для метрик
+        """
+        self.name = name
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Выполняется ли операция с ключом"""
+        return key in self._futures
+
+    def __len__(self) -> int:
+        """Количество выполняющихся операций"""
+        return len(self._futures)
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнение операции или ожидание уже выполняющейся
+        Args:
+            key: Ключ операции
+            factory: Функция, создающая корутину операции
+        Returns:
+            Any: Результат операции
+        """
+        future = self._futures.get(key)
+        if future is not None:
+            coalesced_requests.labels(name=self.name).inc()
+            return await asyncio.shield(future)
+        future = asyncio.ensure_future(factory())
+        self._register(key, future)
+        return await asyncio.shield(future)
+
+    def lead(self, key: Hashable) -> asyncio.Future:
+        """
+        Регистрация операции, результат которой вызывающий выставит сам
+        Используется, когда результат собирается постепенно (потоковый ответ)
+        Args:
+            key: Ключ операции
+        Returns:
+            asyncio.Future: Future, которому нужно выставить результат или ошибку
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._register(key, future)
+        return future
+
+    async def wait(self, key: Hashable) -> Any:
+        """
+        Ожидание результата выполняющейся операции
+        Args:
+            key: Ключ операции
+        Returns:
+            Any: Результат операции
+        """
+        coalesced_requests.labels(name=self.name).inc()
+        return await asyncio.shield(self._futures[key])
+
+    def _register(self, key: Hashable, future: asyncio.Future):
+        """Регистрация future под ключом до его завершения"""
+        self._futures[key] = future
+
+        def forget(done: asyncio.Future):
+            if self._futures.get(key) is done:
+                del self._futures[key]
+            # Ошибку получают ожидающие; если их не было, она не должна попасть в лог как необработанная
+            if not done.cancelled():
+                done.exception()
+
+        future.add_done_callback(forget)
@@ -0,0 +1,149 @@
+from prometheus_client import Counter
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+from config import config
+from database.queries import (
+    get_conversation_summary,
+    get_last_messages,
+    get_messages_after,
+    save_conversation_summary
+)
+from services.openai_service import openai_service
+from services.prompt_builder import truncate_tokens
+
+# Метрика Prometheus обновлений сводки диалога
+summary_refreshes = Counter(
+    'conversation_summary_refreshes_total',
+    'Обновления сводки диалога',
+    ['result']  # updated - сводка обновлена, skipped - мало новых реплик, error - ошибка
+)
+
+# Инструкция модели для составления сводки
+SUMMARY_PROMPT = (
+    "Ты составляешь краткое содержание диалога клиента с ассистентом службы поддержки банка. "
+    "Объедини предыдущее краткое содержание с новыми сообщениями. Сохрани факты о клиенте, "
+    "его вопросы, данные ответы и нерешенные вопросы. Пиши кратко, от третьего лица, без вступлений."
+)
+
+class ConversationSummarizer:
+    """
+    Скользящая сводка диалога пользователя
+    Сообщения, вышедшие за последние config.SUMMARY_RECENT_MESSAGES, после
+    каждых config.SUMMARY_EVERY_TURNS реплик пользователя сворачиваются фоновой
+    задачей в краткое содержание, которое хранится рядом с историей чата.
+    В промпт передаются сводка и только новые сообщения, поэтому его размер не
+    растет с длиной диалога
+    """
+    def __init__(self):
+        """Инициализация: фоновые задачи обновления по пользователям"""
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    @property
+    def history_limit(self) -> int:
+        """Максимальное количество сообщений, не вошедших в сводку, передаваемых в промпт"""
+        return config.SUMMARY_RECENT_MESSAGES + 2 * config.SUMMARY_EVERY_TURNS
+
+    async def load(self, user_id: int, session: Optional[AsyncSession] = None) -> Tuple[Optional[str], List]:
+        """
+        Получение сводки и последних сообщений для промпта
+        Args:
+            user_id: ID пользователя
+            session: Сессия единицы работы обновления
+        Returns:
+            Tuple[Optional[str], List]: Текст сводки (или None) и сообщения, не вошедшие в нее
+        """
+        if not config.SUMMARY_ENABLED:
+            return None, await get_last_messages(user_id, session=session)
+        summary = await get_conversation_summary(user_id, session=session)
+        if summary is None:
+            return None, await get_last_messages(user_id, limit=self.history_limit, session=session)
+        messages = await get_last_messages(
+            user_id, limit=self.history_limit, after_id=summary.last_message_id, session=session
+        )
+        return summary.summary, messages
+
+    def schedule(self, user_id: int):
+        """
+        Запуск фонового обновления сводки, если оно еще не выполняется для пользователя
+        Args:
+            user_id: ID пользователя
+        """
+        if not config.SUMMARY_ENABLED:
+            return
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self.refresh(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+
+    async def refresh(self, user_id: int) -> bool:
+        """
+        Обновление сводки, если накопилось достаточно новых реплик
+        Args:
+            user_id: ID пользователя
+        Returns:
+            bool: True, если сводка обновлена
+        """
+        try:
+            summary = await get_conversation_summary(user_id)
+            pending = await get_messages_after(user_id, summary.last_message_id if summary else 0)
+            # Последние сообщения остаются в промпте как есть
+            fold = pending[:max(0, len(pending) - config.SUMMARY_RECENT_MESSAGES)]
+            if sum(1 for msg in fold if msg.is_from_user) < config.SUMMARY_EVERY_TURNS:
+                summary_refreshes.labels(result="skipped").inc()
+                return False
+
+            text = await openai_service.get_service_completion(
+                self.build_prompt(summary.summary if summary else None, fold),
+                config.SUMMARY_MAX_TOKENS
+            )
+            text = text.strip()
+            if not text:
+                raise ValueError("Пустая сводка")
+            await save_conversation_summary(user_id, text, fold[-1].id)
+            summary_refreshes.labels(result="updated").inc()
+            logging.info(f"Сводка диалога пользователя {user_id} обновлена: {len(fold)} сообщений")
+            return True
+        except Exception as e:
+            summary_refreshes.labels(result="error").inc()
+            logging.error(f"Ошибка при обновлении сводки диалога пользователя {user_id}: {str(e)}")
+            return False
+
+    def build_prompt(self, summary: Optional[str], messages: List) -> List[Dict[str, str]]:
+        """
+        Сообщения запроса на составление сводки
+        Args:
+            summary: Предыдущая сводка
+            messages: Сообщения истории чата, которые нужно в нее добавить
+        Returns:
+            List[Dict[str, str]]: Сообщения в формате OpenAI
+        """
+        dialog = "\n".join(
+            f"{'Клиент' if msg.is_from_user else 'Ассистент'}: {msg.message}" for msg in messages
+        )
+        # Если новых сообщений слишком много, важнее их окончание
+        dialog = truncate_tokens(dialog, config.PROMPT_TOKEN_BUDGET, keep_end=True)
+        parts = []
+        if summary:
+            parts.append(f"Предыдущее краткое содержание:\n{summary}")
+        parts.append(f"Новые сообщения:\n{dialog}")
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n\n".join(parts)}
+        ]
+
+    async def wait(self):
+        """Ожидание завершения выполняющихся обновлений сводки"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _forget(self, user_id: int, task: asyncio.Task):
+        """Удаление завершенной задачи"""
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+# Создание глобального экземпляра сервиса сводки диалога
+conversation_summarizer = ConversationSummarizer()
@@ -1,39 +1,1026 @@
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
-from typing import List, Tuple
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
 import logging
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from prometheus_client import Counter, Gauge, Histogram
 from config import config
+from services.lexical_search import LexicalIndex
+
+# Имена файлов, из которых состоит сохраненный на диске индекс
+INDEX_FILE = "index.faiss"
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+
+# Поддерживаемые типы FAISS индекса и метрики
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq", "sq8", "pq")
+METRICS = ("l2", "cosine")
+CONTEXT_STORAGES = ("memory", "mmap")
+# Расширения файлов, читаемых из директории с контекстами
+CONTEXT_FILE_EXTENSIONS = (".txt", ".md")
+
+# Метрики Prometheus для ответов из базы знаний без обращения к OpenAI
+faq_direct_answers = Counter(
+    'faq_direct_answers_total',
+    'Результаты поиска прямого ответа в базе знаний',
+    ['result']  # hit - ответ найден, miss - нет уверенного совпадения, not_ready - индекс не загружен
+)
+faq_direct_answer_time = Histogram('faq_direct_answer_seconds', 'Время поиска прямого ответа в базе знаний')
+# Готовность векторного поиска для проверок состояния (1 - прогрев завершен и модель загружена)
+vector_search_ready = Gauge('vector_search_ready', 'Готовность векторного поиска')
+
+def iter_paragraphs(path: str) -> Iterator[str]:
+    """
+    Потоковое чтение абзацев из контекстного файла или директории с файлами
+    Файлы читаются построчно, абзацы разделяются пустыми строками
+    Args:
+        path: Путь к файлу или директории (файлы .txt и .md читаются в алфавитном порядке)
+    Returns:
+        Iterator[str]: Непустые абзацы
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith(CONTEXT_FILE_EXTENSIONS):
+                    yield from iter_paragraphs(os.path.join(root, filename))
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line.rstrip('\r\n'))
+            elif lines:
+                yield '\n'.join(lines).strip()
+                lines = []
+        if lines:
+            yield '\n'.join(lines).strip()
+
+def create_index(index_type: str, train_embeddings: np.ndarray, metric: str = "l2") -> faiss.Index:
+    """
+    Создание FAISS индекса заданного типа
+    Индексы IVF и квантователи обучаются на переданных эмбеддингах, поэтому для
+    маленького корпуса число кластеров уменьшается, IVF-PQ заменяется на IVF, а PQ на SQ8
+    Args:
+        index_type: Тип индекса (flat, ivf, hnsw, ivfpq, sq8, pq)
+        train_embeddings: Эмбеддинги для обучения индекса
+        metric: Метрика (l2 или cosine; для cosine эмбеддинги должны быть нормированы)
+    Returns:
+        faiss.Index: Индекс с поддержкой пользовательских ID (IndexIDMap2)
+    """
+    count, dimension = train_embeddings.shape
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    if index_type == "flat":
+        index = faiss.IndexFlat(dimension, faiss_metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, config.VECTOR_HNSW_M, faiss_metric)
+        index.hnsw.efConstruction = config.VECTOR_HNSW_EF_CONSTRUCTION
+    elif index_type in ("ivf", "ivfpq"):
+        # FAISS рекомендует не меньше 39 обучающих векторов на кластер
+        nlist = max(1, min(config.VECTOR_IVF_NLIST, count // 39))
+        quantizer = faiss.IndexFlat(dimension, faiss_metric)
+        if index_type == "ivfpq" and count < 2 ** config.VECTOR_PQ_NBITS:
+            logging.warning(f"Недостаточно векторов для обучения IVF-PQ ({count}), используется IVF")
+            index_type = "ivf"
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss_metric)
+        else:
+            if dimension % config.VECTOR_PQ_M:
+                raise ValueError(f"Размерность {dimension} не делится на VECTOR_PQ_M={config.VECTOR_PQ_M}")
+            index = faiss.IndexIVFPQ(
+                quantizer, dimension, nlist, config.VECTOR_PQ_M, config.VECTOR_PQ_NBITS, faiss_metric
+            )
+        index.train(train_embeddings)
+    elif index_type in ("sq8", "pq"):
+        if index_type == "pq" and count < 2 ** config.VECTOR_PQ_NBITS:
+            logging.warning(f"Недостаточно векторов для обучения PQ ({count}), используется SQ8")
+            index_type = "sq8"
+        if index_type == "sq8":
+            # 1 байт на компоненту вместо 4
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss_metric)
+        else:
+            if dimension % config.VECTOR_PQ_M:
+                raise ValueError(f"Размерность {dimension} не делится на VECTOR_PQ_M={config.VECTOR_PQ_M}")
+            # VECTOR_PQ_M кодов по VECTOR_PQ_NBITS бит на вектор
+            index = faiss.IndexPQ(dimension, config.VECTOR_PQ_M, config.VECTOR_PQ_NBITS, faiss_metric)
+        index.train(train_embeddings)
+    else:
+        raise ValueError(f"Неизвестный тип индекса: {index_type}. Допустимые: {', '.join(INDEX_TYPES)}")
+    index = faiss.IndexIDMap2(index)
+    apply_search_params(index)
+    return index
+
+def apply_search_params(index: faiss.Index):
+    """
+    Установка параметров поиска из конфигурации (nprobe для IVF, efSearch для HNSW)
+    Параметры применяются и к загруженным с диска индексам
+    Args:
+        index: FAISS индекс (допускается обертка IndexIDMap2)
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = config.VECTOR_IVF_NPROBE
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = config.VECTOR_HNSW_EF_SEARCH
+
+def ensure_writable(index: faiss.Index):
+    """
+    Перенос списков IVF индекса, отображенного в память с диска, в обычную память
+    Отображенные списки IVF доступны только для чтения (добавление в них завершает
+    процесс), остальные типы индексов при загрузке с IO_FLAG_MMAP изменяемы
+    Args:
+        index: FAISS индекс (допускается обертка IndexIDMap2)
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if not isinstance(inner, faiss.IndexIVF):
+        return
+    mapped = faiss.downcast_InvertedLists(inner.invlists)
+    if not isinstance(mapped, faiss.OnDiskInvertedLists):
+        return
+    invlists = faiss.ArrayInvertedLists(inner.nlist, inner.code_size)
+    for list_no in range(inner.nlist):
+        size = mapped.list_size(list_no)
+        if size:
+            invlists.add_entries(list_no, size, mapped.get_ids(list_no), mapped.get_codes(list_no))
+    inner.replace_invlists(invlists, True)
+    invlists.this.disown()  # Списками теперь владеет индекс
+
+def supports_remove(index: faiss.Index) -> bool:
+    """
+    Проверка, поддерживает ли индекс удаление векторов
+    HNSW не умеет удалять векторы, для него удаленные ID только помечаются
+    Args:
+        index: FAISS индекс (допускается обертка IndexIDMap2)
+    Returns:
+        bool: True если удаление поддерживается
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(inner, faiss.IndexHNSW)
+
+def training_size(index_type: str) -> int:
+    """
+    Рекомендуемое количество векторов для обучения индекса
+    Args:
+        index_type: Тип индекса
+    Returns:
+        int: Количество векторов (0, если индекс не требует обучения на большой выборке)
+    """
+    # FAISS рекомендует не меньше 39 обучающих векторов на центроид
+    if index_type in ("ivf", "ivfpq"):
+        return 39 * config.VECTOR_IVF_NLIST
+    if index_type == "pq":
+        return 39 * 2 ** config.VECTOR_PQ_NBITS
+    return 0
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """
+    Оценка памяти, занимаемой FAISS индексом
+    Учитывает коды векторов, служебные структуры IVF и HNSW и таблицы ID
+    Args:
+        index: FAISS индекс (допускается обертка IndexIDMap2)
+    Returns:
+        int: Оценка размера в байтах
+    """
+    total = 0
+    inner = index
+    if isinstance(index, faiss.IndexIDMap):
+        inner = faiss.downcast_index(index.index)
+        # id_map (int64) и обратная хэш-таблица IndexIDMap2
+        total += index.ntotal * (8 + 32)
+    if isinstance(inner, faiss.IndexHNSW):
+        storage = faiss.downcast_index(inner.storage)
+        total += storage.code_size * storage.ntotal + inner.hnsw.neighbors.size() * 4
+    elif isinstance(inner, faiss.IndexIVF):
+        quantizer = faiss.downcast_index(inner.quantizer)
+        total += inner.code_size * inner.ntotal + 8 * inner.ntotal + quantizer.ntotal * inner.d * 4
+    else:
+        total += inner.code_size * inner.ntotal
+    return total
+
+def normalize_query(text: str) -> str:
+    """
+    Нормализация текста запроса для ключа кэша
+    Приводит к нижнему регистру, заменяет ё на е, убирает пунктуацию и лишние пробелы
+    Args:
+        text: Текст запроса
+    Returns:
+        str: Нормализованный текст
+    """
+    text = text.lower().replace('ё', 'е')
+    text = re.sub(r'[^\w\s]|_', ' ', text)
+    return ' '.join(text.split())
+
+class LRUCache:
+    """
+    Потокобезопасный LRU кэш ограниченного размера с необязательным временем жизни записей
+    Ведет счетчики попаданий и промахов
+    """
+    def __init__(self, maxsize: int, ttl: float = 0):
+        """
+        Инициализация кэша
+        Args:
+            maxsize: Максимальное количество записей (0 отключает кэш)
+            ttl: Время жизни записи в секундах (0 - без ограничения)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Получение значения из кэша
+        Args:
+            key: Ключ записи
+        Returns:
+            Optional[Any]: Значение или None, если записи нет или она устарела
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl and time.monotonic() - item[1] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: str, value: Any):
+        """
+        Сохранение значения в кэш с вытеснением давно не использованных записей
+        Args:
+            key: Ключ записи
+            value: Значение
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Удаление всех записей (счетчики сохраняются)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Статистика использования кэша
+        Returns:
+            Dict[str, int]: Количество попаданий, промахов и текущий размер
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+class EmbeddingBatcher:
+    """
+    Микро-батчинг кодирования запросов
+    Запросы, пришедшие в течение max_wait_ms, объединяются в один вызов encode,
+    который выполняется в отдельном потоке и не блокирует цикл событий
+    """
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int, max_wait_ms: float):
+        """
+        Инициализация батчера
+        Args:
+            encode: Функция кодирования списка текстов в матрицу эмбеддингов
+            max_batch_size: Максимальное количество запросов в одной пачке
+            max_wait_ms: Максимальное время ожидания заполнения пачки в миллисекундах
+        """
+        self.encode_batch = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vector-encode")
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    async def encode(self, text: str) -> np.ndarray:
+        """
+        Кодирование одного запроса в составе пачки
+        Args:
+            text: Текст запроса
+        Returns:
+            np.ndarray: Эмбеддинг запроса
+        """
+        loop = asyncio.get_running_loop()
+        # Очередь и обработчик привязаны к циклу событий, в котором созданы
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _run(self):
+        """Сбор запросов в пачки и их кодирование в рабочем потоке"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # Запросы, накопившиеся за время предыдущего кодирования, забираем сразу
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self.encode_batch, texts)
+            except Exception as e:
+                logging.error(f"Ошибка при кодировании пачки запросов: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+class ContextStore:
+    """
+    Хранилище текстов контекстов во временном файле, отображаемом в память
+    Тексты дописываются в конец файла в UTF-8, в памяти остаются только смещения
+    и длины. Поддерживает интерфейс списка, который использует VectorSearch:
+    индексация, присваивание (None помечает слот свободным), append, len и итерация
+    """
+    def __init__(self, contexts: Iterable[Optional[str]] = (), directory: Optional[str] = None):
+        """
+        Инициализация хранилища
+        Args:
+            contexts: Начальные тексты контекстов
+            directory: Директория для временного файла (по умолчанию системная)
+        """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Файл без имени удаляется системой при закрытии или завершении процесса
+        self._file = tempfile.TemporaryFile(dir=directory or None)
+        self._size = 0
+        self._mmap = None
+        self._count = 0
+        self._offsets = np.zeros(1024, dtype='int64')
+        self._lengths = np.full(1024, -1, dtype='int64')  # -1 - пустой слот
+        for context in contexts:
+            self.append(context)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, position: int) -> Optional[str]:
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("Индекс контекста вне диапазона")
+        length = int(self._lengths[position])
+        if length < 0:
+            return None
+        offset = int(self._offsets[position])
+        if self._mmap is None or len(self._mmap) < offset + length:
+            self._remap()
+        return self._mmap[offset:offset + length].decode('utf-8')
+
+    def __setitem__(self, position: int, context: Optional[str]):
+        if not 0 <= position < self._count:
+            raise IndexError("Индекс контекста вне диапазона")
+        if context is None:
+            self._lengths[position] = -1
+            return
+        data = context.encode('utf-8')
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._offsets[position] = self._size
+        self._lengths[position] = len(data)
+        self._size += len(data)
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        for position in range(self._count):
+            yield self[position]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (list, ContextStore)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def append(self, context: Optional[str]):
+        """
+        Добавление текста в конец хранилища
+        Args:
+            context: Текст контекста или None для пустого слота
+        """
+        if self._count == len(self._offsets):
+            self._offsets = np.concatenate([self._offsets, np.zeros(self._count, dtype='int64')])
+            self._lengths = np.concatenate([self._lengths, np.full(self._count, -1, dtype='int64')])
+        self._count += 1
+        self[self._count - 1] = context
+
+    def memory_bytes(self) -> int:
+        """Память, занимаемая таблицами смещений (сами тексты лежат в файле)"""
+        return int(self._offsets.nbytes + self._lengths.nbytes)
+
+    def file_bytes(self) -> int:
+        """Размер файла с текстами"""
+        return self._size
+
+    def _remap(self):
+        """Отображение файла в память заново после его роста"""
+        self._file.flush()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+
+# Модель процесса-воркера параллельного кодирования, загружается один раз при его запуске
+_worker_model = None
+
+def _init_encode_worker(model_name: str):
+    """
+    Инициализация процесса-воркера: загрузка модели
+    Каждый воркер использует один поток torch, чтобы процессы не делили ядра между собой
+    Args:
+        model_name: Название модели SentenceTransformer
+    """
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    """
+    Кодирование пачки текстов в процессе-воркере
+    Args:
+        texts: Тексты для кодирования
+    Returns:
+        np.ndarray: Матрица эмбеддингов float32
+    """
+    return _worker_model.encode(texts).astype('float32')
+
+def source_mtime(path: str) -> Optional[float]:
+    """
+    Время последнего изменения контекстного файла или директории
+    Для директории учитываются сама директория (добавление и удаление файлов)
+    и все файлы контекстов в ней
+    Args:
+        path: Путь к файлу или директории с контекстами
+    Returns:
+        Optional[float]: Наибольшее время изменения или None, если путь не существует
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if os.path.isdir(path):
+        for root, _, names in os.walk(path):
+            mtime = max(mtime, os.path.getmtime(root))
+            for name in names:
+                if name.lower().endswith(CONTEXT_FILE_EXTENSIONS):
+                    try:
+                        mtime = max(mtime, os.path.getmtime(os.path.join(root, name)))
+                    except OSError:
+                        continue
+    return mtime
+
+class IndexState:
+    """
+    Согласованный снимок данных индекса: FAISS индекс, тексты, ключи и BM25 индекс
+    Поиск берет ссылку на снимок один раз, поэтому замена снимка при перезагрузке
+    базы знаний атомарна и не требует блокировок на пути поиска
+    """
+    def __init__(self, contexts):
+        """
+        Инициализация пустого снимка
+        Args:
+            contexts: Пустое хранилище текстов контекстов
+        """
+        self.index = None  # FAISS индекс для быстрого поиска
+        self.contexts = contexts  # Позиция = ID в индексе, None = свободный слот
+        self.keys: List[Optional[str]] = []  # Стабильные ключи контекстов по ID
+        self.hashes: List[Optional[str]] = []  # Хэши содержимого контекстов по ID
+        self.key_to_id: Dict[str, int] = {}  # Отображение ключ -> ID в индексе
+        self.free_ids: List[int] = []  # Освободившиеся ID для повторного использования
+        self.dead_count = 0  # Удаленные, но оставшиеся в индексе векторы (HNSW)
+        self.lexical = LexicalIndex()  # BM25 индекс по тем же ID для гибридного поиска
+
+    @property
+    def is_empty(self) -> bool:
+        """Пуст ли индекс"""
+        return not self.index or self.index.ntotal == 0
+
+class _StateAttribute:
+    """Атрибут VectorSearch, хранящийся в текущем снимке IndexState"""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return getattr(instance._state, self.name)
+
+    def __set__(self, instance, value):
+        setattr(instance._state, self.name, value)
+
+def content_hash(text: str) -> str:
+    """
+    Вычисление хэша содержимого контекста
+    Используется как ключ кэша эмбеддингов: одинаковый текст не кодируется повторно
+    Args:
+        text: Текст контекста
+    Returns:
+        str: SHA-256 хэш текста в шестнадцатеричном виде
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
 class VectorSearch:
     """
     Сервис для векторного поиска похожих контекстов
-    Использует FAISS для эффективного поиска и SentenceTransformer для эмбеддингов
+    Использует FAISS для эффективного поиска и SentenceTransformer для эмбеддингов.
+    Контексты хранятся в индексе с идентификаторами (IndexIDMap2): позиция контекста
+    в self.contexts совпадает с его ID в FAISS, поэтому добавление, удаление и
+    обновление затрагивают только измененные векторы.
+    Модель загружается лениво при первом обращении или фоновым прогревом (warm_up).
+    Данные индекса хранятся в снимке IndexState, который при перезагрузке базы
+    знаний (reload) строится заново в фоне и подменяется одним присваиванием
     """
-    def __init__(self):
+    index = _StateAttribute('index')
+    contexts = _StateAttribute('contexts')
+    lexical = _StateAttribute('lexical')
+    _keys = _StateAttribute('keys')
+    _hashes = _StateAttribute('hashes')
+    _key_to_id = _StateAttribute('key_to_id')
+    _free_ids = _StateAttribute('free_ids')
+    _dead_count = _StateAttribute('dead_count')
+
+    def __init__(self, index_dir: Optional[str] = None, index_type: Optional[str] = None,
+                 metric: Optional[str] = None, context_storage: Optional[str] = None):
         """
         Инициализация сервиса векторного поиска
-        Загружает модель для создания эмбеддингов и устанавливает порог схожести
+        Устанавливает порог схожести; модель для создания эмбеддингов не загружается
+        Args:
+            index_dir: Директория для сохранения индекса и кэша эмбеддингов
+                (по умолчанию config.VECTOR_INDEX_DIR, пустая строка отключает сохранение)
+            index_type: Тип FAISS индекса (по умолчанию config.VECTOR_INDEX_TYPE)
+            metric: Метрика поиска l2 или cosine (по умолчанию config.VECTOR_METRIC)
+            context_storage: Хранение текстов memory или mmap (по умолчанию config.VECTOR_CONTEXT_STORAGE)
         """
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')  # Модель для создания эмбеддингов
-        self.index = None  # FAISS индекс для быстрого поиска
-        self.contexts = []  # Список контекстов
+        self.model_name = config.EMBEDDING_MODEL
+        self._model = None  # Модель для создания эмбеддингов, загружается при первом обращении
+        self._model_lock = threading.Lock()
+        self._ready = False  # Прогрев завершен: модель и база знаний загружены
         self.threshold = config.SIMILARITY_THRESHOLD  # Порог схожести для фильтрации результатов
+        self.index_dir = config.VECTOR_INDEX_DIR if index_dir is None else index_dir
+        self.index_type = index_type or config.VECTOR_INDEX_TYPE
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Неизвестный тип индекса: {self.index_type}. Допустимые: {', '.join(INDEX_TYPES)}")
+        self.metric = metric or config.VECTOR_METRIC
+        if self.metric not in METRICS:
+            raise ValueError(f"Неизвестная метрика: {self.metric}. Допустимые: {', '.join(METRICS)}")
+        self.context_storage = context_storage or config.VECTOR_CONTEXT_STORAGE
+        if self.context_storage not in CONTEXT_STORAGES:
+            raise ValueError(
+                f"Неизвестный способ хранения контекстов: {self.context_storage}. "
+                f"Допустимые: {', '.join(CONTEXT_STORAGES)}"
+            )
+        # Текущий снимок индекса; тексты хранятся в списке или ContextStore
+        self._state = IndexState(self._new_context_store())
+        self._source_mtime: Optional[float] = None  # Время изменения загруженной базы знаний
+        self._reload_lock = threading.Lock()
+
+        # Кэш эмбеддингов: сохраненная на диске матрица (memory-map) и новые эмбеддинги
+        self._cache_rows: Optional[Dict[str, int]] = None
+        self._cache_matrix: Optional[np.ndarray] = None
+        self._new_embeddings: Dict[str, np.ndarray] = {}
+
+        # Кэши запросов: нормализованный текст -> эмбеддинг и -> ближайший контекст
+        self._embedding_cache = LRUCache(config.VECTOR_QUERY_CACHE_SIZE, config.VECTOR_QUERY_CACHE_TTL)
+        self._result_cache = LRUCache(config.VECTOR_QUERY_CACHE_SIZE, config.VECTOR_QUERY_CACHE_TTL)
+
+        # Пакетное кодирование запросов для асинхронного поиска
+        self._batcher = EmbeddingBatcher(
+            lambda texts: self.model.encode(texts).astype('float32'),
+            config.VECTOR_BATCH_SIZE,
+            config.VECTOR_BATCH_WAIT_MS
+        )
+
+    def __len__(self) -> int:
+        """Количество контекстов в индексе"""
+        return len(self._key_to_id)
+
+    @property
+    def model(self):
+        """
+        Модель SentenceTransformer
+        Загружается при первом обращении; одновременные обращения ждут одной загрузки
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    # Импорт sentence_transformers тянет torch, поэтому он тоже отложен
+                    from sentence_transformers import SentenceTransformer
+                    started = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name)
+                    logging.info(f"Модель {self.model_name} загружена за {time.perf_counter() - started:.1f} с")
+        return self._model
+
+    @property
+    def is_loaded(self) -> bool:
+        """Загружена ли модель"""
+        return self._model is not None
+
+    @property
+    def is_ready(self) -> bool:
+        """Готовность сервиса для проверок состояния: прогрев завершен и модель загружена"""
+        return self._ready and self._model is not None
 
-    def build_index(self, contexts: List[str]):
+    async def warm_up(self, context_path: Optional[str] = None):
+        """
+        Фоновый прогрев сервиса
+        Загружает модель и базу знаний в рабочем потоке, не блокируя цикл событий,
+        после чего выставляет флаг готовности. Ошибка загрузки базы знаний
+        не мешает готовности: поиск просто не находит контекстов
+        Args:
+            context_path: Путь к контекстному файлу или директории (None - только модель)
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, lambda: self.model)
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке модели {self.model_name}: {str(e)}")
+            return
+
+        if context_path:
+            try:
+                logging.info("Загрузка контекстного файла...")
+                self._source_mtime = source_mtime(context_path)
+                count = await loop.run_in_executor(None, self.ingest, context_path)
+                logging.info(f"Загружено {count} контекстов для векторного поиска")
+                logging.info(f"Память векторного поиска: {self.memory_usage()}")
+            except FileNotFoundError:
+                logging.warning(f"Контекстный файл не найден: {context_path}")
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке контекстного файла: {str(e)}")
+        self._ready = True
+
+    async def reload(self, context_path: str) -> Optional[int]:
+        """
+        Перезагрузка базы знаний без остановки поиска
+        Новый индекс строится в рабочем потоке в отдельном снимке (неизмененные
+        абзацы берутся из кэша эмбеддингов) и подменяет текущий одним присваиванием.
+        Поиск во время перестроения работает по старому снимку
+        Args:
+            context_path: Путь к контекстному файлу или директории
+        Returns:
+            Optional[int]: Количество фрагментов в новом индексе или None,
+                если перезагрузка уже выполняется
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logging.info("Перезагрузка базы знаний уже выполняется")
+            return None
+        try:
+            mtime = source_mtime(context_path)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            shadow = await loop.run_in_executor(None, self._build_shadow, context_path)
+            # Замена снимка и кэша эмбеддингов построенными в фоне
+            self._state = shadow._state
+            self._cache_rows, self._cache_matrix = shadow._cache_rows, shadow._cache_matrix
+            self._new_embeddings = shadow._new_embeddings
+            self._result_cache.clear()
+            self._source_mtime = mtime
+            logging.info(
+                f"База знаний перезагружена за {time.perf_counter() - started:.1f} с: {len(self)} контекстов"
+            )
+            return len(self)
+        finally:
+            self._reload_lock.release()
+
+    async def watch(self, context_path: str, interval: Optional[float] = None):
+        """
+        Слежение за изменением контекстного файла с перезагрузкой базы знаний
+        Args:
+            context_path: Путь к контекстному файлу или директории
+            interval: Период проверки в секундах (по умолчанию config.VECTOR_RELOAD_INTERVAL,
+                0 отключает слежение)
+        """
+        interval = config.VECTOR_RELOAD_INTERVAL if interval is None else interval
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            mtime = source_mtime(context_path)
+            if mtime is None or mtime == self._source_mtime:
+                continue
+            logging.info(f"Контекстный файл изменен, перезагрузка базы знаний: {context_path}")
+            try:
+                await self.reload(context_path)
+            except Exception as e:
+                logging.error(f"Ошибка при перезагрузке базы знаний: {str(e)}")
+
+    def _build_shadow(self, context_path: str) -> 'VectorSearch':
+        """
+        Построение индекса в отдельном экземпляре с общей моделью
+        Args:
+            context_path: Путь к контекстному файлу или директории
+        Returns:
+            VectorSearch: Экземпляр с готовым снимком индекса
+        """
+        shadow = VectorSearch(
+            index_dir=self.index_dir,
+            index_type=self.index_type,
+            metric=self.metric,
+            context_storage=self.context_storage
+        )
+        shadow._model = self.model
+        shadow.ingest(context_path)
+        return shadow
+
+    def build_index(self, contexts: List[str], keys: Optional[List[str]] = None):
         """
         Построение FAISS индекса из контекстов
-        Создает векторные представления текстов и строит индекс для быстрого поиска
+        Создает векторные представления текстов и строит индекс для быстрого поиска.
+        Если на диске уже есть индекс для тех же контекстов, он загружается без
+        повторного кодирования; иначе кодируются только новые или измененные контексты.
+        Контексты кодируются и добавляются пачками по config.VECTOR_INGEST_BATCH_SIZE
+        Args:
+            contexts: Список текстовых контекстов
+            keys: Стабильные ключи контекстов (по умолчанию хэш содержимого)
+        """
+        self._reset()
+        if not contexts:
+            return
+
+        if keys is None:
+            keys = [content_hash(context) for context in contexts]
+        # Повторяющиеся ключи (например, одинаковые абзацы) попадают в индекс один раз
+        items = dict(zip(keys, contexts))
+        keys = list(items)
+        contexts = list(items.values())
+        hashes = [content_hash(context) for context in contexts]
+        if self._load_index(keys, hashes):
+            self.contexts = self._new_context_store(contexts)
+            self._keys = keys
+            self._hashes = hashes
+            self._key_to_id = {key: context_id for context_id, key in enumerate(keys)}
+            for context_id, context in enumerate(contexts):
+                self.lexical.add(context_id, context)
+            logging.info(f"FAISS индекс загружен с диска: {len(contexts)} контекстов")
+            return
+
+        # Первая пачка обучает IVF индексы и квантователи, поэтому для них она больше
+        batch_size = max(1, config.VECTOR_INGEST_BATCH_SIZE)
+        first_batch = max(batch_size, training_size(self.index_type))
+        with self._parallel_encoder(contexts, hashes) as embedded:
+            start = 0
+            while start < len(keys):
+                end = start + (first_batch if start == 0 else batch_size)
+                if embedded is not None:
+                    self._receive_embeddings(embedded, hashes[start:end])
+                self.upsert_contexts({key: items[key] for key in keys[start:end]})
+                start = end
+        self.save()
+
+    def ingest(self, path: str) -> int:
+        """
+        Загрузка базы знаний из контекстного файла или директории
+        Файлы читаются потоково, абзацы нарезаются на фрагменты по токенам
+        энкодера, одинаковые фрагменты отбрасываются, после чего индекс
+        строится пачками фиксированного размера. Корпус целиком в память
+        не читается: между пачками хранятся только хэши уже встреченных фрагментов.
+        Если на диске есть индекс, он загружается в режиме memory-map: фрагменты
+        сверяются с сохраненными ключами и хэшами, кодируются и добавляются только
+        новые, исчезнувшие из файла удаляются
+        Args:
+            path: Путь к файлу или директории с контекстами
+        Returns:
+            int: Количество фрагментов в индексе
+        """
+        self._reset()
+        restored = self._restore_index()
+        changed = not restored
+        with self._streaming_encoder(self._iter_batches(self.iter_chunks(path))) as batches:
+            for batch in batches:
+                new_items = {}
+                for chunk in batch:
+                    key = content_hash(chunk)
+                    context_id = self._key_to_id.get(key)
+                    if context_id is not None and self.contexts[context_id] is None and self._hashes[context_id] == key:
+                        # Фрагмент есть в сохраненном индексе: вектор уже в нем, восстанавливается только текст
+                        self.contexts[context_id] = chunk
+                        self.lexical.add(context_id, chunk)
+                    else:
+                        new_items[key] = chunk
+                if new_items:
+                    self.upsert_contexts(new_items)
+                    changed = True
+        if restored:
+            # Фрагменты сохраненного индекса, которых больше нет в контекстном файле
+            stale = [key for key, context_id in self._key_to_id.items() if self.contexts[context_id] is None]
+            if stale:
+                self.remove_contexts(stale)
+                changed = True
+            logging.info(f"FAISS индекс загружен с диска: {len(self)} контекстов, изменен: {changed}")
+        if changed:
+            self.save()
+        return len(self)
+
+    def _iter_batches(self, chunks: Iterator[str]) -> Iterator[List[str]]:
+        """
+        Нарезка потока фрагментов на пачки по config.VECTOR_INGEST_BATCH_SIZE
+        Первая пачка обучает IVF индексы и квантователи, поэтому для них она больше
+        Args:
+            chunks: Поток фрагментов
+        Returns:
+            Iterator[List[str]]: Пачки фрагментов
+        """
+        batch_size = max(1, config.VECTOR_INGEST_BATCH_SIZE)
+        batch = list(islice(chunks, max(batch_size, training_size(self.index_type))))
+        while batch:
+            yield batch
+            batch = list(islice(chunks, batch_size))
+
+    def iter_chunks(self, path: str) -> Iterator[str]:
+        """
+        Потоковая нарезка контекстов на фрагменты без повторов
+        Args:
+            path: Путь к файлу или директории с контекстами
+        Returns:
+            Iterator[str]: Уникальные фрагменты в порядке появления
+        """
+        seen = set()
+        for paragraph in iter_paragraphs(path):
+            for chunk in self.chunk_text(paragraph):
+                chunk_hash = content_hash(chunk)
+                if chunk_hash not in seen:
+                    seen.add(chunk_hash)
+                    yield chunk
+
+    def chunk_text(self, text: str) -> List[str]:
+        """
+        Нарезка текста на фрагменты, помещающиеся в окно энкодера
+        Фрагменты по config.VECTOR_CHUNK_TOKENS токенов (по умолчанию max_seq_length
+        модели) перекрываются на config.VECTOR_CHUNK_OVERLAP токенов; границы
+        фрагментов выравниваются по словам исходного текста
+        Args:
+            text: Текст абзаца
+        Returns:
+            List[str]: Фрагменты текста
+        """
+        max_tokens = config.VECTOR_CHUNK_TOKENS or self.model.max_seq_length - 2
+        offsets = self.model.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )['offset_mapping']
+        if len(offsets) <= max_tokens:
+            return [text]
+
+        step = max(1, max_tokens - config.VECTOR_CHUNK_OVERLAP)
+        chunks = []
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + max_tokens]
+            begin, end = window[0][0], window[-1][1]
+            # Разорванные на границах фрагмента слова отбрасываются,
+            # они целиком попадают в соседний фрагмент за счет перекрытия
+            if begin > 0 and not text[begin - 1].isspace():
+                word_end = next((i for i in range(begin, end) if text[i].isspace()), end)
+                if word_end < end:
+                    begin = word_end
+            if end < len(text) and not text[end].isspace():
+                word_start = next((i for i in range(end - 1, begin, -1) if text[i].isspace()), begin)
+                if word_start > begin:
+                    end = word_start
+            chunks.append(text[begin:end].strip())
+            if start + max_tokens >= len(offsets):
+                break
+        return chunks
+
+    def add_contexts(self, contexts: List[str], keys: Optional[List[str]] = None) -> List[str]:
+        """
+        Добавление контекстов в индекс без его перестроения
+        Контексты с уже существующими ключами обновляются
         Args:
             contexts: Список текстовых контекстов
+            keys: Стабильные ключи контекстов (по умолчанию хэш содержимого)
+        Returns:
+            List[str]: Ключи добавленных контекстов
+        """
+        if keys is None:
+            keys = [content_hash(context) for context in contexts]
+        elif len(keys) != len(contexts):
+            raise ValueError("Количество ключей не совпадает с количеством контекстов")
+        self.upsert_contexts(dict(zip(keys, contexts)))
+        return list(keys)
+
+    def upsert_contexts(self, items: Dict[str, str]):
+        """
+        Добавление или обновление контекстов по стабильному ключу
+        Кодируются и переиндексируются только новые и измененные контексты,
+        обновленный контекст сохраняет свой ID
+        Args:
+            items: Отображение ключ -> текст контекста
         """
-        self.contexts = contexts
-        # Создание эмбеддингов для всех контекстов
-        embeddings = self.model.encode(contexts)
-        dimension = embeddings.shape[1]
-        # Создание и заполнение FAISS индекса
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(embeddings.astype('float32'))
+        if self.index is not None:
+            ensure_writable(self.index)
+        changed_keys = []
+        changed_contexts = []
+        changed_hashes = []
+        for key, context in items.items():
+            context_hash = content_hash(context)
+            context_id = self._key_to_id.get(key)
+            if context_id is not None and self._hashes[context_id] == context_hash:
+                continue  # Контекст не изменился
+            changed_keys.append(key)
+            changed_contexts.append(context)
+            changed_hashes.append(context_hash)
+        if not changed_keys:
+            return
+
+        embeddings = self._prepare_embeddings(self._encode_cached(changed_contexts, changed_hashes))
+        if self.index is None:
+            self.index = create_index(self.index_type, embeddings, self.metric)
+
+        # Удаляем старые векторы обновляемых контекстов, ID сохраняются за ключами.
+        # Если индекс не поддерживает удаление, контекст получает новый ID
+        updated_keys = [key for key in changed_keys if key in self._key_to_id]
+        if updated_keys and supports_remove(self.index):
+            updated_ids = [self._key_to_id[key] for key in updated_keys]
+            self.index.remove_ids(np.array(updated_ids, dtype='int64'))
+        elif updated_keys:
+            for key in updated_keys:
+                self._mark_dead(self._key_to_id.pop(key))
+
+        ids = []
+        for key, context, context_hash in zip(changed_keys, changed_contexts, changed_hashes):
+            context_id = self._key_to_id.get(key)
+            if context_id is None:
+                context_id = self._allocate_id()
+                self._key_to_id[key] = context_id
+            self.contexts[context_id] = context
+            self._keys[context_id] = key
+            self._hashes[context_id] = context_hash
+            self.lexical.add(context_id, context)
+            ids.append(context_id)
+        self.index.add_with_ids(embeddings, np.array(ids, dtype='int64'))
+        self._result_cache.clear()
+
+    def remove_contexts(self, keys: Iterable[str]) -> int:
+        """
+        Удаление контекстов из индекса без его перестроения
+        Args:
+            keys: Ключи удаляемых контекстов (неизвестные ключи игнорируются)
+        Returns:
+            int: Количество удаленных контекстов
+        """
+        ids = []
+        for key in keys:
+            context_id = self._key_to_id.pop(key, None)
+            if context_id is None:
+                continue
+            ids.append(context_id)
+        if not ids:
+            return 0
+
+        ensure_writable(self.index)
+        if supports_remove(self.index):
+            self.index.remove_ids(np.array(ids, dtype='int64'))
+            for context_id in ids:
+                self.contexts[context_id] = None
+                self._keys[context_id] = None
+                self._hashes[context_id] = None
+                self._free_ids.append(context_id)
+                self.lexical.remove(context_id)
+        else:
+            for context_id in ids:
+                self._mark_dead(context_id)
+        self._result_cache.clear()
+        return len(ids)
 
     def search(self, query: str) -> Tuple[str, float]:
         """
@@ -43,20 +1030,820 @@ class VectorSearch:
         Returns:
             Tuple[str, float]: Найденный контекст и его оценка схожести
         """
-        if not self.index:
+        state = self._state
+        if state.is_empty:
             return None, 0.0
 
+        key = normalize_query(query)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            return self._apply_threshold(*cached)
+
         # Создание эмбеддинга для запроса
-        query_embedding = self.model.encode([query])
+        query_embedding = self._embed(key, query)
+        return self._best_match(key, query_embedding, state)
+
+    async def search_async(self, query: str) -> Tuple[str, float]:
+        """
+        Асинхронный поиск наиболее релевантного контекста
+        Кодирование выполняется в рабочем потоке, одновременные запросы
+        объединяются в один вызов модели
+        Args:
+            query: Поисковый запрос
+        Returns:
+            Tuple[str, float]: Найденный контекст и его оценка схожести
+        """
+        state = self._state
+        if state.is_empty:
+            return None, 0.0
+
+        key = normalize_query(query)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            return self._apply_threshold(*cached)
+
+        query_embedding = await self.embed_async(query)
+        return self._best_match(key, query_embedding, state)
+
+    async def embed_async(self, text: str) -> np.ndarray:
+        """
+        Асинхронное создание эмбеддинга текста через микро-батчинг
+        Повторные запросы берутся из LRU кэша без обращения к модели
+        Args:
+            text: Текст для кодирования
+        Returns:
+            np.ndarray: Эмбеддинг float32
+        """
+        key = normalize_query(text)
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = await self._batcher.encode(text)
+            self._embedding_cache.put(key, embedding)
+        return embedding
+
+    def search_many(self, queries: List[str], k: int = 5) -> List[List[Tuple[str, float]]]:
+        """
+        Пакетный поиск k ближайших контекстов для списка запросов
+        Все запросы кодируются одним вызовом модели (кроме найденных в кэше)
+        и ищутся одним вызовом FAISS; порог схожести не применяется
+        Args:
+            queries: Список поисковых запросов
+            k: Количество контекстов для каждого запроса
+        Returns:
+            List[List[Tuple[str, float]]]: Для каждого запроса список (контекст, оценка),
+                упорядоченный от наиболее похожего. Оценка - L2 расстояние
+                или косинусное сходство в зависимости от метрики
+        """
+        if not queries:
+            return []
+        state = self._state
+        if state.is_empty:
+            return [[] for _ in queries]
+
+        keys = [normalize_query(query) for query in queries]
+        embeddings: List[Optional[np.ndarray]] = [self._embedding_cache.get(key) for key in keys]
+        # Уникальные запросы без эмбеддинга в кэше кодируются одной пачкой
+        missing: Dict[str, str] = {}
+        for key, query, embedding in zip(keys, queries, embeddings):
+            if embedding is None and key not in missing:
+                missing[key] = query
+        if missing:
+            encoded = self.model.encode(list(missing.values())).astype('float32')
+            for key, embedding in zip(missing, encoded):
+                self._embedding_cache.put(key, embedding)
+            encoded_by_key = dict(zip(missing, encoded))
+            embeddings = [
+                embedding if embedding is not None else encoded_by_key[key]
+                for key, embedding in zip(keys, embeddings)
+            ]
+
+        results = self._search_embeddings(np.stack(embeddings), k, state)
+        return [[(state.contexts[context_id], score) for context_id, score in row] for row in results]
+
+    def hybrid_search(self, query: str, k: int = 5, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Гибридный поиск: BM25 по инвертированному индексу и векторный поиск
+        Однозначное совпадение по ключевым словам возвращается из лексического
+        индекса без кодирования запроса, иначе ранжирования объединяются
+        методом Reciprocal Rank Fusion
+        Args:
+            query: Поисковый запрос
+            k: Количество контекстов
+            threshold: Порог схожести; если задан, в результат попадают только
+                контексты, прошедшие его в векторном поиске
+        Returns:
+            List[Tuple[str, float]]: Список (контекст, RRF оценка) по убыванию оценки
+        """
+        state = self._state
+        lexical = self._lexical_ranking(query, k, state)
+        if lexical is not None:
+            return lexical
+        if state.is_empty:
+            return []
+        query_embedding = self._embed(normalize_query(query), query)
+        return self._fuse(query, query_embedding, k, state, threshold)
+
+    async def hybrid_search_async(self, query: str, k: int = 5,
+                                  threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Асинхронный гибридный поиск (см. hybrid_search)
+        Кодирование запроса выполняется через микро-батчинг в рабочем потоке
+        Args:
+            query: Поисковый запрос
+            k: Количество контекстов
+            threshold: Порог схожести для векторного поиска (см. hybrid_search)
+        Returns:
+            List[Tuple[str, float]]: Список (контекст, RRF оценка) по убыванию оценки
+        """
+        state = self._state
+        lexical = self._lexical_ranking(query, k, state)
+        if lexical is not None:
+            return lexical
+        if state.is_empty:
+            return []
+        query_embedding = await self.embed_async(query)
+        return self._fuse(query, query_embedding, k, state, threshold)
+
+    async def direct_answer(self, query: str) -> Optional[str]:
+        """
+        Поиск ответа на вопрос напрямую в базе знаний
+        Контекст возвращается, только если совпадение уверенное: однозначное
+        совпадение по ключевым словам или векторное с порогом
+        config.FAQ_DIRECT_THRESHOLD (строже обычного порога схожести)
+        Args:
+            query: Вопрос пользователя
+        Returns:
+            Optional[str]: Текст контекста или None, если уверенного совпадения нет
+        """
+        if not self.is_ready or self._state.is_empty:
+            faq_direct_answers.labels(result="not_ready").inc()
+            return None
+        started = time.perf_counter()
+        results = await self.hybrid_search_async(query, k=1, threshold=config.FAQ_DIRECT_THRESHOLD)
+        faq_direct_answer_time.observe(time.perf_counter() - started)
+        if not results:
+            faq_direct_answers.labels(result="miss").inc()
+            return None
+        faq_direct_answers.labels(result="hit").inc()
+        return results[0][0]
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Статистика кэшей запросов
+        Returns:
+            Dict[str, Dict[str, int]]: Попадания, промахи и размер кэшей эмбеддингов и результатов
+        """
+        return {
+            'embedding': self._embedding_cache.stats(),
+            'result': self._result_cache.stats()
+        }
+
+    def _embed(self, key: str, query: str) -> np.ndarray:
+        """
+        Синхронное создание эмбеддинга запроса с использованием LRU кэша
+        Args:
+            key: Нормализованный текст запроса
+            query: Исходный текст запроса
+        Returns:
+            np.ndarray: Эмбеддинг float32
+        """
+        query_embedding = self._embedding_cache.get(key)
+        if query_embedding is None:
+            query_embedding = self.model.encode([query])[0].astype('float32')
+            self._embedding_cache.put(key, query_embedding)
+        return query_embedding
+
+    def _lexical_ranking(self, query: str, k: int, state: IndexState) -> Optional[List[Tuple[str, float]]]:
+        """
+        Ранжирование только по лексическому индексу при однозначном совпадении
+        Args:
+            query: Поисковый запрос
+            k: Количество контекстов
+            state: Снимок индекса
+        Returns:
+            Optional[List[Tuple[str, float]]]: Список (контекст, RRF оценка) или None,
+                если однозначного совпадения нет
+        """
+        doc_id, _ = state.lexical.exact_hit(query)
+        if doc_id is None:
+            return None
+        return [
+            (state.contexts[context_id], 1 / (config.HYBRID_RRF_K + rank))
+            for rank, (context_id, _) in enumerate(state.lexical.search(query, k), start=1)
+        ]
+
+    def _fuse(self, query: str, query_embedding: np.ndarray, k: int,
+              state: IndexState, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Объединение лексического и векторного ранжирования методом Reciprocal Rank Fusion
+        Args:
+            query: Поисковый запрос
+            query_embedding: Эмбеддинг запроса
+            k: Количество контекстов
+            state: Снимок индекса
+            threshold: Порог схожести; если задан, лексическое ранжирование только
+                переупорядочивает контексты, прошедшие его в векторном поиске
+        Returns:
+            List[Tuple[str, float]]: Список (контекст, RRF оценка) по убыванию оценки
+        """
+        candidates = 2 * k
+        vector = self._search_embeddings(query_embedding.reshape(1, -1), candidates, state)[0]
+        if threshold is not None:
+            vector = [(context_id, score) for context_id, score in vector if self._passes(score, threshold)]
+        rankings = [state.lexical.search(query, candidates), vector]
+        allowed = {context_id for context_id, _ in vector} if threshold is not None else None
+        scores: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (context_id, _) in enumerate(ranking, start=1):
+                if allowed is not None and context_id not in allowed:
+                    continue
+                scores[context_id] = scores.get(context_id, 0.0) + 1 / (config.HYBRID_RRF_K + rank)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(state.contexts[context_id], score) for context_id, score in best]
+
+    def _best_match(self, key: str, query_embedding: np.ndarray, state: IndexState) -> Tuple[str, float]:
+        """
+        Поиск ближайшего контекста с проверкой порога схожести
+        Ближайший контекст сохраняется в кэш результатов до проверки порога,
+        поэтому изменение порога не требует очистки кэша
+        Args:
+            key: Нормализованный текст запроса
+            query_embedding: Эмбеддинг запроса
+            state: Снимок индекса
+        Returns:
+            Tuple[str, float]: Найденный контекст и его оценка схожести
+        """
         # Поиск ближайшего соседа
-        distances, indices = self.index.search(query_embedding.astype('float32'), 1)
-        
+        results = self._search_embeddings(query_embedding.reshape(1, -1), 1, state)[0]
+        if not results:
+            return None, 0.0
+        context_id, distance = results[0]
+        context = state.contexts[context_id]
+        # Результат по устаревшему снимку не кэшируется
+        if state is self._state:
+            self._result_cache.put(key, (context, distance))
+        return self._apply_threshold(context, distance)
+
+    def _apply_threshold(self, context: str, distance: float) -> Tuple[str, float]:
+        """
+        Проверка результата поиска на соответствие порогу схожести
+        Args:
+            context: Ближайший контекст
+            distance: Расстояние до него
+        Returns:
+            Tuple[str, float]: Контекст (или None, если порог не пройден) и расстояние
+        """
         # Проверка на соответствие порогу схожести
-        if distances[0][0] > self.threshold:
-            return None, distances[0][0]
-        
+        if not self._passes(distance, self.threshold):
+            return None, distance
+
         # Возврат найденного контекста и его оценки
-        return self.contexts[indices[0][0]], distances[0][0]
+        return context, distance
+
+    def _passes(self, distance: float, threshold: float) -> bool:
+        """
+        Проверка оценки поиска на соответствие порогу
+        Для косинусной метрики оценка - сходство (чем больше, тем лучше),
+        для L2 - расстояние (чем меньше, тем лучше)
+        Args:
+            distance: Оценка найденного контекста
+            threshold: Порог
+        Returns:
+            bool: True, если порог пройден
+        """
+        if self.metric == "cosine":
+            return distance >= threshold
+        return distance <= threshold
+
+    def benchmark(self, contexts: List[str], k: int = 5, num_queries: int = 200,
+                  index_types: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Сравнение типов индекса на корпусе контекстов
+        Запросами служат вопросы (первое предложение) из случайной выборки контекстов,
+        эталоном для recall@k является точный поиск (flat) с той же метрикой
+        Args:
+            contexts: Список текстовых контекстов
+            k: Количество соседей для оценки recall@k
+            num_queries: Количество запросов
+            index_types: Типы индексов для сравнения (по умолчанию все)
+        Returns:
+            List[Dict]: Для каждого типа индекса recall@k, p50/p99 задержки в мс,
+                размер индекса в байтах и время построения в секундах
+        """
+        contexts = list(dict.fromkeys(contexts))
+        embeddings = self._encode_cached(contexts, [content_hash(context) for context in contexts])
+        embeddings = self._prepare_embeddings(embeddings)
+
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(contexts), size=min(num_queries, len(contexts)), replace=False)
+        queries = [contexts[i].split('?')[0][:200] for i in sample]
+        query_embeddings = self._prepare_embeddings(self.model.encode(queries).astype('float32'))
+
+        k = min(k, len(contexts))
+        baseline = create_index("flat", embeddings, self.metric)
+        baseline.add_with_ids(embeddings, np.arange(len(contexts), dtype='int64'))
+        _, expected = baseline.search(query_embeddings, k)
+
+        report = []
+        for index_type in index_types or INDEX_TYPES:
+            started = time.perf_counter()
+            index = create_index(index_type, embeddings, self.metric)
+            index.add_with_ids(embeddings, np.arange(len(contexts), dtype='int64'))
+            build_time = time.perf_counter() - started
+
+            latencies = []
+            found = []
+            for query_embedding in query_embeddings:
+                started = time.perf_counter()
+                _, indices = index.search(query_embedding.reshape(1, -1), k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                found.append(indices[0])
+
+            hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+            report.append({
+                'index_type': index_type,
+                'recall': hits / (len(queries) * k),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'memory_bytes': index_memory_bytes(index),
+                'build_seconds': build_time
+            })
+        return report
+
+    def save(self):
+        """
+        Сохранение FAISS индекса и кэша эмбеддингов на диск
+        Файлы записываются во временные и атомарно заменяют старые,
+        метаданные записываются последними
+        """
+        if not self.index_dir:
+            # Без директории кэш живет только в памяти, эмбеддинги удаленных контекстов не нужны
+            live_hashes = set(self._hashes)
+            self._new_embeddings = {h: e for h, e in self._new_embeddings.items() if h in live_hashes}
+            return
+        if self.index is None:
+            return
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            index_path = os.path.join(self.index_dir, INDEX_FILE)
+            embeddings_path = os.path.join(self.index_dir, EMBEDDINGS_FILE)
+            meta_path = os.path.join(self.index_dir, META_FILE)
+
+            # В кэш попадают эмбеддинги только актуальных контекстов
+            embedding_hashes = list(dict.fromkeys(h for h in self._hashes if h is not None))
+            embeddings = np.stack([self._cached_embedding(h) for h in embedding_hashes])
+
+            faiss.write_index(self.index, index_path + ".tmp")
+            with open(embeddings_path + ".tmp", 'wb') as f:
+                np.save(f, embeddings)
+            with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump({
+                    'model': self.model_name,
+                    'index_type': self.index_type,
+                    'metric': self.metric,
+                    'keys': self._keys,
+                    'hashes': self._hashes,
+                    'embedding_hashes': embedding_hashes
+                }, f)
+
+            # Пока файлы заменяются, метаданных нет и частично записанный индекс не будет загружен
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            os.replace(index_path + ".tmp", index_path)
+            os.replace(embeddings_path + ".tmp", embeddings_path)
+            os.replace(meta_path + ".tmp", meta_path)
+
+            # Новые эмбеддинги теперь лежат на диске, держать их в памяти не нужно
+            self._cache_rows = {h: row for row, h in enumerate(embedding_hashes)}
+            self._cache_matrix = np.load(embeddings_path, mmap_mode='r')
+            self._new_embeddings = {}
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении FAISS индекса: {str(e)}")
+
+    def memory_usage(self) -> Dict[str, Any]:
+        """
+        Отчет о памяти, занимаемой индексом и текстами контекстов
+        Returns:
+            Dict[str, Any]: Тип индекса, способ хранения контекстов, оценка памяти
+                индекса, память под тексты (или таблицы смещений) и размер файла с текстами
+        """
+        if isinstance(self.contexts, ContextStore):
+            contexts_bytes = self.contexts.memory_bytes()
+            contexts_file_bytes = self.contexts.file_bytes()
+        else:
+            contexts_bytes = sys.getsizeof(self.contexts) + sum(
+                sys.getsizeof(context) for context in self.contexts if context is not None
+            )
+            contexts_file_bytes = 0
+        return {
+            'index_type': self.index_type,
+            'context_storage': self.context_storage,
+            'contexts': len(self),
+            'index_bytes': index_memory_bytes(self.index) if self.index is not None else 0,
+            'contexts_bytes': contexts_bytes,
+            'contexts_file_bytes': contexts_file_bytes
+        }
+
+    def _new_context_store(self, contexts: Iterable[Optional[str]] = ()):
+        """
+        Создание хранилища текстов контекстов согласно настройке context_storage
+        Args:
+            contexts: Начальные тексты контекстов
+        Returns:
+            Список в памяти или ContextStore на файле, отображаемом в память
+        """
+        if self.context_storage == "mmap":
+            return ContextStore(contexts, directory=self.index_dir or None)
+        return list(contexts)
+
+    def _reset(self):
+        """Очистка индекса и связанных с ним структур"""
+        self._state = IndexState(self._new_context_store())
+        self._result_cache.clear()
+
+    def _mark_dead(self, context_id: int):
+        """
+        Пометка ID как удаленного для индексов без поддержки удаления
+        Вектор остается в индексе, но отфильтровывается при поиске; ID не переиспользуется
+        Args:
+            context_id: ID удаленного контекста
+        """
+        self.contexts[context_id] = None
+        self._keys[context_id] = None
+        self._hashes[context_id] = None
+        self.lexical.remove(context_id)
+        self._dead_count += 1
+
+    def _prepare_embeddings(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        Подготовка эмбеддингов для индекса и поиска
+        Для косинусной метрики возвращает нормированную копию, исходные
+        эмбеддинги (например, из кэша) не изменяются
+        Args:
+            embeddings: Матрица эмбеддингов
+        Returns:
+            np.ndarray: Непрерывная матрица float32
+        """
+        embeddings = np.array(embeddings, dtype='float32', order='C')
+        if self.metric == "cosine":
+            faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _search_embeddings(self, embeddings: np.ndarray, k: int,
+                           state: IndexState) -> List[List[Tuple[int, float]]]:
+        """
+        Поиск k ближайших живых контекстов для эмбеддингов запросов
+        Запрашивает у FAISS больше соседей, если в индексе есть удаленные векторы
+        Args:
+            embeddings: Матрица эмбеддингов запросов
+            k: Количество соседей
+            state: Снимок индекса
+        Returns:
+            List[List[Tuple[int, float]]]: Для каждого запроса список (ID, расстояние)
+        """
+        fetch = min(state.index.ntotal, k + state.dead_count)
+        distances, indices = state.index.search(self._prepare_embeddings(embeddings), fetch)
+        results = []
+        for row_distances, row_indices in zip(distances, indices):
+            row = [
+                (int(context_id), float(distance))
+                for context_id, distance in zip(row_indices, row_distances)
+                if context_id >= 0 and state.contexts[context_id] is not None
+            ]
+            results.append(row[:k])
+        return results
+
+    def _allocate_id(self) -> int:
+        """
+        Выделение ID для нового контекста
+        Returns:
+            int: Освободившийся ранее ID или следующий по порядку
+        """
+        if self._free_ids:
+            return self._free_ids.pop()
+        self.contexts.append(None)
+        self._keys.append(None)
+        self._hashes.append(None)
+        return len(self.contexts) - 1
+
+    def _cached_embedding(self, context_hash: str) -> Optional[np.ndarray]:
+        """
+        Получение эмбеддинга из кэша
+        Args:
+            context_hash: Хэш содержимого контекста
+        Returns:
+            Optional[np.ndarray]: Эмбеддинг или None, если его нет в кэше
+        """
+        embedding = self._new_embeddings.get(context_hash)
+        if embedding is not None:
+            return embedding
+        if self._cache_rows is None:
+            self._cache_rows, self._cache_matrix = self._load_embedding_cache()
+        row = self._cache_rows.get(context_hash)
+        return self._cache_matrix[row] if row is not None else None
+
+    @contextmanager
+    def _parallel_encoder(self, contexts: List[str], hashes: List[str]):
+        """
+        Параллельное кодирование корпуса в пуле процессов
+        Некэшированные контексты делятся на пачки по config.VECTOR_INGEST_BATCH_SIZE
+        и сразу отправляются воркерам; результаты забираются по порядку по мере
+        добавления в индекс. Пул используется, только если задано больше одного
+        воркера и пачек для кодирования больше одной
+        Args:
+            contexts: Список текстовых контекстов
+            hashes: Хэши содержимого контекстов
+        Returns:
+            Итератор (хэши пачки, эмбеддинги) в порядке корпуса или None
+        """
+        workers = config.VECTOR_ENCODE_WORKERS
+        batch_size = max(1, config.VECTOR_INGEST_BATCH_SIZE)
+        missing: Dict[str, str] = {}
+        if workers > 1:
+            for context, context_hash in zip(contexts, hashes):
+                if context_hash not in missing and self._cached_embedding(context_hash) is None:
+                    missing[context_hash] = context
+        if len(missing) <= batch_size:
+            yield None
+            return
+
+        missing_hashes = list(missing)
+        missing_contexts = list(missing.values())
+        batches = [
+            (missing_hashes[start:start + batch_size], missing_contexts[start:start + batch_size])
+            for start in range(0, len(missing_hashes), batch_size)
+        ]
+        logging.info(f"Параллельное кодирование {len(missing)} контекстов в {workers} процессах")
+        with self._encode_executor(workers) as executor:
+            # map отправляет все пачки сразу и возвращает результаты в исходном порядке
+            results = executor.map(_encode_in_worker, [batch_contexts for _, batch_contexts in batches])
+            yield zip((batch_hashes for batch_hashes, _ in batches), results)
+
+    @contextmanager
+    def _streaming_encoder(self, batches: Iterator[List[str]]):
+        """
+        Параллельное кодирование потока пачек в пуле процессов
+        Воркерам отправляется не больше config.VECTOR_ENCODE_WORKERS пачек вперед,
+        поэтому в памяти одновременно находится ограниченное число фрагментов.
+        Пул используется, только если задано больше одного воркера и пачек больше одной
+        Args:
+            batches: Поток пачек фрагментов
+        Returns:
+            Итератор тех же пачек, эмбеддинги которых уже лежат в кэше
+        """
+        workers = config.VECTOR_ENCODE_WORKERS
+        if workers <= 1:
+            yield batches
+            return
+        head = list(islice(batches, 2))
+        batches = chain(head, batches)
+        if len(head) < 2:
+            yield batches
+            return
+        logging.info(f"Параллельное потоковое кодирование в {workers} процессах")
+        with self._encode_executor(workers) as executor:
+            yield self._prefetch_embeddings(executor, batches, workers)
+
+    def _prefetch_embeddings(self, executor: ProcessPoolExecutor, batches: Iterator[List[str]],
+                             depth: int) -> Iterator[List[str]]:
+        """
+        Отправка пачек воркерам с ограниченным опережением
+        Args:
+            executor: Пул процессов-воркеров
+            batches: Поток пачек фрагментов
+            depth: Сколько пачек может кодироваться одновременно
+        Returns:
+            Iterator[List[str]]: Пачки в исходном порядке после получения их эмбеддингов
+        """
+        pending = deque()
+        for batch in batches:
+            missing: Dict[str, str] = {}
+            for chunk in batch:
+                chunk_hash = content_hash(chunk)
+                if chunk_hash not in missing and self._cached_embedding(chunk_hash) is None:
+                    missing[chunk_hash] = chunk
+            future = executor.submit(_encode_in_worker, list(missing.values())) if missing else None
+            pending.append((batch, list(missing), future))
+            if len(pending) > depth:
+                yield self._collect_embeddings(*pending.popleft())
+        while pending:
+            yield self._collect_embeddings(*pending.popleft())
+
+    def _collect_embeddings(self, batch: List[str], hashes: List[str], future) -> List[str]:
+        """
+        Ожидание эмбеддингов пачки от воркера и сохранение их в кэш
+        Args:
+            batch: Пачка фрагментов
+            hashes: Хэши фрагментов, отправленных на кодирование
+            future: Результат кодирования или None, если все эмбеддинги уже в кэше
+        Returns:
+            List[str]: Та же пачка фрагментов
+        """
+        if future is not None:
+            for chunk_hash, embedding in zip(hashes, future.result()):
+                self._new_embeddings[chunk_hash] = embedding
+        return batch
+
+    @contextmanager
+    def _encode_executor(self, workers: int):
+        """
+        Пул процессов-воркеров для кодирования
+        Args:
+            workers: Количество процессов
+        Returns:
+            ProcessPoolExecutor с загруженной в воркерах моделью
+        """
+        # spawn: воркеры не наследуют потоки torch и FAISS родительского процесса
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_encode_worker,
+            initargs=(self.model_name,)
+        )
+        try:
+            yield executor
+        finally:
+            # При ошибке оставшиеся пачки отменяются (cancel_futures доступен с Python 3.9)
+            if sys.version_info >= (3, 9):
+                executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                executor.shutdown(wait=True)
+
+    def _receive_embeddings(self, embedded: Iterator[Tuple[List[str], np.ndarray]], hashes: List[str]):
+        """
+        Получение эмбеддингов от воркеров, пока в кэше не окажутся все нужные хэши
+        Args:
+            embedded: Итератор результатов параллельного кодирования
+            hashes: Хэши контекстов очередной пачки индекса
+        """
+        for context_hash in hashes:
+            while self._cached_embedding(context_hash) is None:
+                batch_hashes, embeddings = next(embedded)
+                for batch_hash, embedding in zip(batch_hashes, embeddings):
+                    self._new_embeddings[batch_hash] = embedding
+
+    def _encode_cached(self, contexts: List[str], hashes: List[str]) -> np.ndarray:
+        """
+        Создание эмбеддингов с использованием кэша
+        Кодирует моделью только контексты, эмбеддингов которых нет в кэше
+        Args:
+            contexts: Список текстовых контекстов
+            hashes: Хэши содержимого контекстов
+        Returns:
+            np.ndarray: Матрица эмбеддингов float32 в порядке контекстов
+        """
+        # Уникальные тексты, которых нет в кэше (дубликаты кодируются один раз)
+        missing: Dict[str, str] = {}
+        for context, context_hash in zip(contexts, hashes):
+            if context_hash not in missing and self._cached_embedding(context_hash) is None:
+                missing[context_hash] = context
+
+        if missing:
+            new_embeddings = self.model.encode(list(missing.values())).astype('float32')
+            for context_hash, embedding in zip(missing, new_embeddings):
+                self._new_embeddings[context_hash] = embedding
+        logging.info(
+            f"Эмбеддинги: {len(contexts) - len(missing)} из кэша, {len(missing)} закодировано заново"
+        )
+        return np.stack([self._cached_embedding(context_hash) for context_hash in hashes]).astype('float32')
+
+    def _load_meta(self) -> Optional[Dict]:
+        """
+        Чтение метаданных сохраненного индекса
+        Returns:
+            Optional[Dict]: Метаданные или None, если они отсутствуют или созданы другой моделью
+        """
+        if not self.index_dir:
+            return None
+        meta_path = os.path.join(self.index_dir, META_FILE)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать метаданные индекса {meta_path}: {str(e)}")
+            return None
+        if meta.get('model') != self.model_name:
+            return None
+        return meta
+
+    def _load_embedding_cache(self) -> Tuple[Dict[str, int], Optional[np.ndarray]]:
+        """
+        Загрузка кэша эмбеддингов с диска в режиме memory-map
+        Returns:
+            Tuple[Dict[str, int], Optional[np.ndarray]]: Отображение хэш -> строка матрицы и сама матрица
+        """
+        meta = self._load_meta()
+        if meta is None:
+            return {}, None
+        try:
+            embeddings = np.load(os.path.join(self.index_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить кэш эмбеддингов: {str(e)}")
+            return {}, None
+        hashes = meta.get('embedding_hashes', [])
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(hashes):
+            return {}, None
+        return {context_hash: row for row, context_hash in enumerate(hashes)}, embeddings
+
+    def _load_index(self, keys: List[str], hashes: List[str]) -> bool:
+        """
+        Загрузка сохраненного FAISS индекса, если он построен для тех же контекстов
+        Args:
+            keys: Ключи контекстов в порядке ID
+            hashes: Хэши содержимого контекстов в порядке ID
+        Returns:
+            bool: True если индекс загружен, иначе False
+        """
+        meta = self._load_meta()
+        if meta is None or meta.get('index_type', 'flat') != self.index_type:
+            return False
+        if meta.get('metric', 'l2') != self.metric:
+            return False
+        if meta.get('keys') != keys or meta.get('hashes') != hashes:
+            return False
+        index = self._read_index()
+        if index is None or index.ntotal != len(hashes):
+            return False
+        self.index = index
+        return True
+
+    def _restore_index(self) -> bool:
+        """
+        Загрузка сохраненного FAISS индекса с ключами и хэшами контекстов, но без текстов
+        Тексты заполняются при чтении контекстного файла (см. ingest); ID без ключа
+        становятся свободными, а для индексов без удаления - удаленными
+        Returns:
+            bool: True если индекс загружен, иначе False
+        """
+        meta = self._load_meta()
+        if meta is None or meta.get('index_type', 'flat') != self.index_type:
+            return False
+        if meta.get('metric', 'l2') != self.metric:
+            return False
+        keys, hashes = meta.get('keys'), meta.get('hashes')
+        if not keys or not hashes or len(keys) != len(hashes):
+            return False
+        index = self._read_index()
+        if index is None:
+            return False
+        removable = supports_remove(index)
+        live = sum(key is not None for key in keys)
+        if index.ntotal != (live if removable else len(keys)):
+            return False
+
+        self.index = index
+        self.contexts = self._new_context_store([None] * len(keys))
+        self._keys = list(keys)
+        self._hashes = list(hashes)
+        self._key_to_id = {key: context_id for context_id, key in enumerate(keys) if key is not None}
+        for context_id, key in enumerate(keys):
+            if key is not None:
+                continue
+            if removable:
+                self._free_ids.append(context_id)
+            else:
+                self._dead_count += 1
+        return True
+
+    def _read_index(self) -> Optional[faiss.Index]:
+        """
+        Чтение сохраненного FAISS индекса в режиме memory-map
+        Returns:
+            Optional[faiss.Index]: Индекс с параметрами поиска из конфигурации или None
+        """
+        try:
+            index = faiss.read_index(os.path.join(self.index_dir, INDEX_FILE), faiss.IO_FLAG_MMAP)
+        except Exception as e:
+            logging.warning(f"Не удалось загрузить FAISS индекс: {str(e)}")
+            return None
+        apply_search_params(index)
+        return index
 
 # Создание глобального экземпляра сервиса
-vector_search = VectorSearch() 
\ No newline at end of file
+vector_search = VectorSearch()
+# Значение метрики готовности вычисляется при каждом чтении метрик
+vector_search_ready.set_function(lambda: float(vector_search.is_ready))
+
+if __name__ == '__main__':
+    # Сравнение типов индекса на контекстном файле:
+    # python -m services.vector_search benchmark --k 5 --queries 200
+    parser = argparse.ArgumentParser(description="Инструменты векторного поиска")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    benchmark_parser = subparsers.add_parser('benchmark', help="Сравнение recall@k, задержки и памяти индексов")
+    benchmark_parser.add_argument('--context-file', default=config.CONTEXT_FILE, help="Контекстный файл или директория")
+    benchmark_parser.add_argument('--k', type=int, default=5, help="Количество соседей для recall@k")
+    benchmark_parser.add_argument('--queries', type=int, default=200, help="Количество запросов")
+    benchmark_parser.add_argument('--index-types', nargs='+', choices=INDEX_TYPES, help="Типы индексов")
+    args = parser.parse_args()
+
+    corpus = list(vector_search.iter_chunks(args.context_file))
+    rows = vector_search.benchmark(corpus, k=args.k, num_queries=args.queries, index_types=args.index_types)
+    print(f"Контекстов: {len(corpus)}, k={args.k}")
+    print(f"{'индекс':<8} {'recall@k':>9} {'p50, мс':>9} {'p99, мс':>9} {'память, МБ':>11} {'построение, с':>14}")
+    for row in rows:
+        print(
+            f"{row['index_type']:<8} {row['recall']:>9.3f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} "
+            f"{row['memory_bytes'] / 1024 / 1024:>11.2f} {row['build_seconds']:>14.2f}"
+        )
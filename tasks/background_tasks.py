@@ -1,11 +1,13 @@
 from typing import Any
 import asyncio
 from datetime import datetime, timedelta
-from database.queries import get_session
+from database.queries import get_session, last_message_tracker
 from database.models import ChatHistory, User
 from sqlalchemy import delete, update
 import logging
 from services.cloud_storage import cloud_storage
+from services.openai_service import openai_service
+from config import config
 import os
 
 async def cleanup_old_data() -> None:
@@ -15,6 +17,9 @@ async def cleanup_old_data() -> None:
     """
     while True:
         try:
+            # Запись отложенного времени последних сообщений, чтобы не деактивировать активных пользователей
+            await last_message_tracker.flush()
+
             async with get_session() as session:
                 # Удаление старых сообщений (старше 30 дней)
                 thirty_days_ago = datetime.now() - timedelta(days=30)
@@ -54,6 +59,20 @@ async def cleanup_old_data() -> None:
             logging.error(f"Ошибка при выполнении задачи очистки: {e}")
             await asyncio.sleep(300)  # При ошибке ждем 5 минут перед повторной попыткой
 
+async def flush_last_message_dates() -> None:
+    """
+    Периодическая запись времени последних сообщений пользователей
+    Накопленные в памяти значения записываются одним пакетным UPDATE
+    """
+    while True:
+        await asyncio.sleep(config.LAST_MESSAGE_FLUSH_INTERVAL)
+        try:
+            updated = await last_message_tracker.flush()
+            if updated:
+                logging.debug(f"Записано время последних сообщений {updated} пользователей")
+        except Exception as e:
+            logging.error(f"Ошибка при записи времени последних сообщений: {e}")
+
 async def start_background_tasks() -> None:
     """
     Запуск всех фоновых задач
@@ -61,6 +80,8 @@ async def start_background_tasks() -> None:
     """
     tasks = [
         cleanup_old_data(),
+        flush_last_message_dates(),
+        openai_service.process_deferred(),  # Ответы на вопросы, отложенные при недоступности OpenAI
         # Здесь можно добавить другие фоновые задачи:
         # - Проверка состояния сервисов
         # - Синхронизация данных
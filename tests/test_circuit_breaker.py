@@ -0,0 +1,88 @@
+import time
+from services.circuit_breaker import CircuitBreaker, breaker_state
+
+def make_breaker(**kwargs):
+    """Выключатель с маленьким окном для тестов"""
+    params = dict(error_rate=0.5, slow_call_seconds=1.0, window=4, min_calls=4, open_seconds=0.05, trial_calls=2)
+    params.update(kwargs)
+    return CircuitBreaker("test", **params)
+
+def state_metric() -> float:
+    """Значение метрики состояния тестового выключателя"""
+    return breaker_state.labels(name="test")._value.get()
+
+def test_opens_on_error_rate():
+    """Тест: выключатель размыкается при доле ошибок выше порога"""
+    breaker = make_breaker()
+    breaker.record(0.1)
+    breaker.record(None)
+    breaker.record(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(None)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert state_metric() == 2
+    assert not breaker.allow()
+    assert breaker.retry_after() > 0
+
+def test_slow_calls_count_as_errors():
+    """Тест: медленные ответы учитываются как ошибки"""
+    breaker = make_breaker()
+    for _ in range(4):
+        assert breaker.allow()
+        breaker.record(5.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+def test_half_open_closes_after_trials():
+    """Тест: после паузы пропускаются пробные запросы, успешные замыкают выключатель"""
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(None)
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert state_metric() == 1
+    assert breaker.allow()
+    assert breaker.allow()
+    assert not breaker.allow()  # Пробных запросов не больше trial_calls
+    breaker.record(0.1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert state_metric() == 0
+
+def test_half_open_failure_reopens():
+    """Тест: ошибка пробного запроса снова размыкает выключатель"""
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(None)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(None)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+def test_release_frees_trial():
+    """Тест: отмененный пробный запрос освобождает место для следующего"""
+    breaker = make_breaker(trial_calls=1)
+    for _ in range(4):
+        breaker.record(None)
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+def test_call_started_closed_not_counted_as_trial():
+    """Тест: успешный ответ на запрос, начатый до размыкания, не считается пробным"""
+    breaker = make_breaker(trial_calls=1)
+    slow_permit = breaker.allow()
+    for _ in range(4):
+        breaker.record(None, breaker.allow())
+    time.sleep(0.06)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    trial_permit = breaker.allow()
+    breaker.record(0.1, slow_permit)
+    breaker.release(slow_permit)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # Место пробного запроса все еще занято
+    breaker.record(0.1, trial_permit)
+    assert breaker.state == CircuitBreaker.CLOSED
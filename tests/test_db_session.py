@@ -0,0 +1,179 @@
+import pytest
+import pytest_asyncio
+import asyncio
+from sqlalchemy import event, select
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from config import config
+from database import db
+from database.models import Base, ChatHistory
+from database.queries import (
+    ChatHistoryBuffer,
+    add_chat_message,
+    chat_history_buffer,
+    create_user,
+    get_last_messages,
+    get_messages_after,
+    get_user_by_telegram_id,
+    last_message_tracker,
+    update_user_last_message
+)
+from middlewares.db_session_middleware import DbSessionMiddleware
+
+@pytest_asyncio.fixture
+async def database(tmp_path, monkeypatch):
+    """Отдельная база SQLite со счетчиками подключений и коммитов"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(db, "async_session_factory", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    monkeypatch.setattr(config, "CHAT_HISTORY_WRITE_BEHIND", False)
+    monkeypatch.setattr(config, "LAST_MESSAGE_DEBOUNCE", False)
+
+    counters = {'connect': 0, 'commit': 0}
+    event.listen(engine.sync_engine, "connect", lambda *args: counters.__setitem__('connect', counters['connect'] + 1))
+    event.listen(engine.sync_engine, "commit", lambda *args: counters.__setitem__('commit', counters['commit'] + 1))
+    yield counters
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_update_uses_one_session(database):
+    """Тест: обработка сообщения выполняется в одном соединении с одним коммитом"""
+    user = await create_user(100, "79990000000")
+    database['connect'] = database['commit'] = 0
+
+    async def handler(event, data):
+        session = data['session']
+        found = await get_user_by_telegram_id(100, session)
+        await update_user_last_message(found.telegram_id, session)
+        await add_chat_message(found.id, "Как открыть вклад?", True, session=session)
+        history = await get_last_messages(found.id, session=session)
+        # Сообщение еще не записано, но видно в истории этой сессии
+        assert [msg.message for msg in history] == ["Как открыть вклад?"]
+        await add_chat_message(found.id, "В отделении банка.", False, session=session)
+
+    await DbSessionMiddleware()(handler, object(), {})
+    assert database['connect'] == 1
+    assert database['commit'] == 1
+
+    history = await get_last_messages(user.id)
+    assert [msg.message for msg in history] == ["Как открыть вклад?", "В отделении банка."]
+
+@pytest.mark.asyncio
+async def test_failed_update_rolled_back(database):
+    """Тест: при ошибке обработчика изменения обновления не сохраняются"""
+    user = await create_user(101, "79990000001")
+
+    async def handler(event, data):
+        await add_chat_message(user.id, "Сообщение", True, session=data['session'])
+        raise RuntimeError("ошибка")
+
+    with pytest.raises(RuntimeError):
+        await DbSessionMiddleware()(handler, object(), {})
+    assert await get_last_messages(user.id) == []
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_full_batch(database):
+    """Тест: пачка записывается одним коммитом при накоплении batch_size сообщений"""
+    user = await create_user(102, "79990000002")
+    buffer = ChatHistoryBuffer(batch_size=3, flush_ms=60000)
+    database['commit'] = 0
+    for text in ["Первое", "Второе"]:
+        await buffer.add(ChatHistory(user_id=user.id, message=text, is_from_user=True, is_moderator_chat=False))
+    assert database['commit'] == 0
+    assert len(buffer) == 2
+    await buffer.add(ChatHistory(user_id=user.id, message="Третье", is_from_user=True, is_moderator_chat=False))
+    assert database['commit'] == 1
+    assert len(buffer) == 0
+    assert [msg.message for msg in await get_last_messages(user.id)] == ["Первое", "Второе", "Третье"]
+    await buffer.close()
+
+@pytest.mark.asyncio
+async def test_buffer_read_your_writes_and_timer(database, monkeypatch):
+    """Тест: незаписанные сообщения видны в истории, пачка записывается по таймеру"""
+    monkeypatch.setattr(config, "CHAT_HISTORY_WRITE_BEHIND", True)
+    monkeypatch.setattr(chat_history_buffer, "flush_ms", 50)
+    user = await create_user(103, "79990000003")
+    await add_chat_message(user.id, "Как открыть вклад?", True)
+    await add_chat_message(user.id, "В отделении банка.", False)
+    assert len(chat_history_buffer) == 2
+    assert [msg.message for msg in await get_last_messages(user.id)] == ["Как открыть вклад?", "В отделении банка."]
+
+    await asyncio.sleep(0.2)
+    assert len(chat_history_buffer) == 0
+    history = await get_last_messages(user.id)
+    assert [msg.message for msg in history] == ["Как открыть вклад?", "В отделении банка."]
+    assert all(msg.id is not None for msg in history)
+
+@pytest.mark.asyncio
+async def test_messages_after_include_buffered(database, monkeypatch):
+    """Тест: выборка для сводки диалога видит сообщения, еще не записанные буфером"""
+    monkeypatch.setattr(config, "CHAT_HISTORY_WRITE_BEHIND", True)
+    monkeypatch.setattr(chat_history_buffer, "flush_ms", 60000)
+    user = await create_user(105, "79990000005")
+    await add_chat_message(user.id, "Как открыть вклад?", True)
+    await add_chat_message(user.id, "В отделении банка.", False)
+    messages = await get_messages_after(user.id)
+    assert [msg.message for msg in messages] == ["Как открыть вклад?", "В отделении банка."]
+    assert all(msg.id is not None for msg in messages)
+    assert len(chat_history_buffer) == 0
+    await chat_history_buffer.close()
+
+@pytest.mark.asyncio
+async def test_buffer_flushed_on_close(database):
+    """Тест: при остановке оставшиеся сообщения записываются"""
+    user = await create_user(104, "79990000004")
+    buffer = ChatHistoryBuffer(batch_size=100, flush_ms=60000)
+    await buffer.add(ChatHistory(user_id=user.id, message="Сообщение", is_from_user=True, is_moderator_chat=False))
+    await buffer.close()
+    assert len(buffer) == 0
+    async with db.get_session() as session:
+        assert (await session.execute(select(ChatHistory))).scalars().one().message == "Сообщение"
+
+@pytest.mark.asyncio
+async def test_last_message_dates_debounced(database, monkeypatch):
+    """Тест: время последнего сообщения копится в памяти и записывается одним коммитом"""
+    monkeypatch.setattr(config, "LAST_MESSAGE_DEBOUNCE", True)
+    await create_user(105, "79990000005")
+    await create_user(106, "79990000006")
+    database['commit'] = 0
+    for telegram_id in [105, 106, 105]:
+        await update_user_last_message(telegram_id)
+    assert database['commit'] == 0
+    assert len(last_message_tracker) == 2
+
+    last_message_tracker.touch(106, datetime(2030, 1, 1))
+    assert await last_message_tracker.flush() == 2
+    assert database['commit'] == 1
+    assert len(last_message_tracker) == 0
+    assert (await get_user_by_telegram_id(106)).last_message_date == datetime(2030, 1, 1)
+    assert await last_message_tracker.flush() == 0
+
+@pytest.mark.asyncio
+async def test_slow_handlers_release_connections(tmp_path, monkeypatch):
+    """Тест: обновлений, ждущих OpenAI, больше размера пула, но соединений хватает всем"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.5
+    )
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(db, "async_session_factory", async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    monkeypatch.setattr(config, "CHAT_HISTORY_WRITE_BEHIND", False)
+    monkeypatch.setattr(config, "LAST_MESSAGE_DEBOUNCE", False)
+    users = [await create_user(200 + i, f"7999000010{i}") for i in range(4)]
+
+    async def handler(event, data):
+        session = data['session']
+        user = await get_user_by_telegram_id(event.telegram_id, session)
+        await add_chat_message(user.id, "Вопрос", True, session=session)
+        await get_last_messages(user.id, session=session)
+        await db.release_session(session)
+        await asyncio.sleep(0.3)  # Ожидание ответа OpenAI
+        await add_chat_message(user.id, "Ответ", False, session=session)
+
+    await asyncio.gather(*(DbSessionMiddleware()(handler, user, {}) for user in users))
+    for user in users:
+        assert [msg.message for msg in await get_last_messages(user.id)] == ["Вопрос", "Ответ"]
+    await engine.dispose()
@@ -0,0 +1,53 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from aiogram import Bot, Dispatcher
+from aiogram.types import Chat, Message, Update, User
+from handlers import moderator_handlers, user_handlers
+from services.vector_search import vector_search
+
+@pytest.fixture(scope="module")
+def dispatcher():
+    """Диспетчер с роутерами в том же порядке, что и в bot.py"""
+    dp = Dispatcher()
+    dp.include_router(user_handlers.router)
+    dp.include_router(moderator_handlers.router)
+    return dp
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Ответы бота, перехваченные вместо отправки в Telegram"""
+    sent = []
+
+    async def answer(self, text, **kwargs):
+        sent.append(text)
+
+    monkeypatch.setattr(Message, "answer", answer)
+    return sent
+
+def make_update(text: str) -> Update:
+    """Обновление с текстовым сообщением"""
+    return Update(
+        update_id=1,
+        message=Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=Chat(id=1, type="private"),
+            from_user=User(id=1, is_bot=False, first_name="Модератор"),
+            text=text
+        )
+    )
+
+@pytest.mark.asyncio
+async def test_reload_kb_reaches_moderator_router(dispatcher, answers, monkeypatch):
+    """Тест: команда /reload_kb не перехватывается обработчиком вопросов пользователей"""
+    async def get_moderator(telegram_id, session=None):
+        return SimpleNamespace(role="MODERATOR")
+
+    async def reload(context_path):
+        return 3
+
+    monkeypatch.setattr(moderator_handlers, "get_user_by_telegram_id", get_moderator)
+    monkeypatch.setattr(vector_search, "reload", reload)
+    await dispatcher.feed_update(Bot(token="42:TEST"), make_update("/reload_kb"))
+    assert answers == ["Перезагрузка базы знаний...", "База знаний перезагружена: 3 контекстов"]
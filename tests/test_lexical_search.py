@@ -0,0 +1,65 @@
+import pytest
+from services.lexical_search import LexicalIndex, tokenize
+
+@pytest.fixture
+def test_contexts():
+    """Фикстура с тестовыми контекстами"""
+    return [
+        "Как открыть вклад в банке? Для открытия вклада нужно прийти в отделение с паспортом.",
+        "Как пополнить карту? Пополнение возможно через банкомат или мобильное приложение.",
+        "Как получить кредит? Для получения кредита нужна справка о доходах и паспорт."
+    ]
+
+@pytest.fixture
+def lexical_index(test_contexts):
+    """Фикстура с заполненным лексическим индексом"""
+    index = LexicalIndex()
+    for doc_id, context in enumerate(test_contexts):
+        index.add(doc_id, context)
+    return index
+
+def test_tokenize():
+    """Тест токенизации: регистр, стоп-слова и основы слов"""
+    assert tokenize("Как пополнить КАРТУ?") == tokenize("пополнить карты")
+    assert "как" not in tokenize("Как открыть вклад")
+    assert tokenize("Ёлка") == tokenize("елка")
+
+def test_search(lexical_index):
+    """Тест поиска по BM25"""
+    results = lexical_index.search("кредит справка", k=2)
+    assert results[0][0] == 2
+    assert len(results) == 1
+
+def test_search_ranking(lexical_index):
+    """Тест ранжирования: документ с большим числом совпадений выше"""
+    results = lexical_index.search("паспорт кредит")
+    assert [doc_id for doc_id, _ in results] == [2, 0]
+    assert results[0][1] > results[1][1]
+
+def test_search_no_match(lexical_index):
+    """Тест поиска без совпадений"""
+    assert lexical_index.search("акции биржа") == []
+    assert lexical_index.search("как и в") == []
+
+def test_exact_hit(lexical_index):
+    """Тест однозначного совпадения по ключевым словам"""
+    assert lexical_index.exact_hit("Как пополнить карту?")[0] == 1
+    # Не все термы запроса есть в документе
+    assert lexical_index.exact_hit("пополнить карту валютой")[0] is None
+    # Терм встречается в нескольких документах с близкими оценками
+    assert lexical_index.exact_hit("паспорт")[0] is None
+
+def test_add_replaces_document(lexical_index):
+    """Тест замены документа с тем же ID"""
+    lexical_index.add(1, "Как закрыть счет? Подайте заявление в отделении.")
+    assert lexical_index.search("пополнить карту") == []
+    assert lexical_index.search("закрыть счет")[0][0] == 1
+    assert len(lexical_index) == 3
+
+def test_remove(lexical_index):
+    """Тест удаления документа"""
+    lexical_index.remove(2)
+    lexical_index.remove(42)
+    assert len(lexical_index) == 2
+    assert lexical_index.search("кредит") == []
+    assert "кредит" not in lexical_index.postings
@@ -0,0 +1,98 @@
+import pytest
+import asyncio
+from types import SimpleNamespace
+from services.model_router import ModelRouter, Route
+from config import config
+
+def make_route(name, create, max_prompt_tokens=0):
+    """Маршрут с подмененным методом chat.completions.create"""
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return Route(name, f"model-{name}", client, max_prompt_tokens)
+
+def delayed(answer, delay):
+    """Фабрика ответа API с задержкой"""
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(delay)
+        return answer
+
+    create.calls = calls
+    return create
+
+@pytest.fixture(autouse=True)
+def hedge_settings(monkeypatch):
+    """Дублирование с короткой задержкой для тестов"""
+    monkeypatch.setattr(config, "OPENAI_HEDGE_ENABLED", True)
+    monkeypatch.setattr(config, "OPENAI_HEDGE_MIN_DELAY", 0.05)
+
+def test_choose_by_prompt_length():
+    """Тест: длинный промпт не отправляется на маршрут с маленьким контекстом"""
+    short = make_route("short", delayed("a", 0), max_prompt_tokens=100)
+    long = make_route("long", delayed("b", 0))
+    router = ModelRouter([short, long])
+    assert router.choose(50)[0] is short
+    assert router.choose(500) == [long]
+
+def test_choose_by_latency_and_errors():
+    """Тест: предпочтение маршрута с меньшей задержкой и без ошибок"""
+    slow = make_route("slow", delayed("a", 0))
+    fast = make_route("fast", delayed("b", 0))
+    for _ in range(5):
+        slow.record(2.0)
+        fast.record(0.5)
+    router = ModelRouter([slow, fast])
+    assert router.choose(10)[0] is fast
+    for _ in range(10):
+        fast.record(None)
+    assert router.choose(10)[0] is slow
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_primary_slow():
+    """Тест: дублирующий запрос отвечает, медленный основной отменяется"""
+    primary_create = delayed("медленный", 1.0)
+    hedge_create = delayed("быстрый", 0)
+    router = ModelRouter([make_route("primary", primary_create), make_route("hedge", hedge_create)])
+    assert await router.create(10, 100, messages=[]) == "быстрый"
+    assert hedge_create.calls[0]["model"] == "model-hedge"
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_primary_fast():
+    """Тест: быстрый основной запрос не дублируется"""
+    hedge_create = delayed("дубль", 0)
+    router = ModelRouter([make_route("primary", delayed("основной", 0)), make_route("hedge", hedge_create)])
+    assert await router.create(10, 100, messages=[]) == "основной"
+    assert hedge_create.calls == []
+
+@pytest.mark.asyncio
+async def test_hedge_used_when_primary_fails():
+    """Тест: ошибка основного запроса после отправки дубля не теряет ответ"""
+    async def failing(**kwargs):
+        await asyncio.sleep(0.1)
+        raise ValueError("ошибка")
+
+    router = ModelRouter([make_route("primary", failing), make_route("hedge", delayed("дубль", 0.2))])
+    assert await router.create(10, 100, messages=[]) == "дубль"
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_cancels_primary():
+    """Тест: отмена вызывающего во время ожидания основного запроса отменяет и его"""
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow(**kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    router = ModelRouter([make_route("primary", slow)])
+    caller = asyncio.create_task(router.create(10, 100, messages=[]))
+    await started.wait()
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    await asyncio.wait_for(cancelled.wait(), 1)
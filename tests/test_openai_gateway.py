@@ -0,0 +1,125 @@
+import pytest
+import asyncio
+import time
+import httpx
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from openai import BadRequestError, RateLimitError
+from services.openai_gateway import OpenAIGateway, TokenBucket, DeadlineExceeded
+from config import config
+
+def make_client(create):
+    """Клиент с подмененным методом chat.completions.create"""
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+def api_error(error_class, status_code):
+    """Ошибка API с заданным HTTP статусом"""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return error_class("Ошибка", response=response, body=None)
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    """Короткие задержки повторов для тестов"""
+    monkeypatch.setattr(config, "OPENAI_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(config, "OPENAI_RETRY_MAX_DELAY", 0.02)
+
+@pytest.mark.asyncio
+async def test_retries_rate_limit():
+    """Тест повтора запроса после ответа 429"""
+    create = AsyncMock(side_effect=[api_error(RateLimitError, 429), "ответ"])
+    gateway = OpenAIGateway(make_client(create), rpm=0, tpm=0, max_retries=2, timeout=5)
+    assert await gateway.create(10, model="m") == "ответ"
+    assert create.call_count == 2
+
+@pytest.mark.asyncio
+async def test_no_retry_on_bad_request():
+    """Тест: ошибки запроса (4xx кроме 429) не повторяются"""
+    create = AsyncMock(side_effect=api_error(BadRequestError, 400))
+    gateway = OpenAIGateway(make_client(create), rpm=0, tpm=0, max_retries=3, timeout=5)
+    with pytest.raises(BadRequestError):
+        await gateway.create(10, model="m")
+    assert create.call_count == 1
+
+@pytest.mark.asyncio
+async def test_retries_exhausted():
+    """Тест: после исчерпания повторов ошибка пробрасывается"""
+    create = AsyncMock(side_effect=api_error(RateLimitError, 429))
+    gateway = OpenAIGateway(make_client(create), rpm=0, tpm=0, max_retries=2, timeout=5)
+    with pytest.raises(RateLimitError):
+        await gateway.create(10, model="m")
+    assert create.call_count == 3
+
+@pytest.mark.asyncio
+async def test_deadline():
+    """Тест прерывания зависшего запроса по сроку"""
+    async def hang(**kwargs):
+        await asyncio.sleep(10)
+    gateway = OpenAIGateway(make_client(hang), rpm=0, tpm=0, max_retries=3, timeout=0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        await gateway.create(10, model="m")
+    assert time.monotonic() - started < 1
+
+@pytest.mark.asyncio
+async def test_concurrency_limit():
+    """Тест ограничения числа одновременных запросов"""
+    active = 0
+    peak = 0
+
+    async def create(**kwargs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return "ответ"
+
+    gateway = OpenAIGateway(make_client(create), max_concurrency=2, rpm=0, tpm=0, timeout=5)
+    await asyncio.gather(*[gateway.create(10, model="m") for _ in range(6)])
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_releases_slot():
+    """Тест: отмена запроса, ожидающего квоту токенов, освобождает слот конкурентности"""
+    gateway = OpenAIGateway(make_client(AsyncMock(return_value="ответ")), max_concurrency=2, rpm=0, tpm=60, timeout=5)
+    await gateway.create(60, model="m")  # Квота токенов исчерпана
+    waiter = asyncio.ensure_future(gateway.create(60, model="m"))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert gateway._semaphore._value == 2
+
+@pytest.mark.asyncio
+async def test_stream():
+    """Тест потокового запроса через шлюз"""
+    async def chunks():
+        for chunk in ["а", "б", "в"]:
+            yield chunk
+
+    create = AsyncMock(return_value=chunks())
+    gateway = OpenAIGateway(make_client(create), rpm=0, tpm=0, timeout=5)
+    assert [chunk async for chunk in gateway.stream(10, model="m")] == ["а", "б", "в"]
+    assert create.call_args.kwargs["stream"] is True
+
+@pytest.mark.asyncio
+async def test_stream_refunds_unused_tokens():
+    """Тест: после потокового ответа неизрасходованная квота токенов возвращается"""
+    async def chunks():
+        for text in ["Короткий ", "ответ"]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    gateway = OpenAIGateway(make_client(AsyncMock(return_value=chunks())), rpm=0, tpm=6000, timeout=5)
+    messages = [{"role": "user", "content": "Вопрос"}]
+    [chunk async for chunk in gateway.stream(1000, model="m", messages=messages)]
+    assert gateway.tokens_bucket.tokens > 6000 - 50
+
+@pytest.mark.asyncio
+async def test_token_bucket_paces_requests():
+    """Тест: ведро токенов выдерживает паузу при исчерпании квоты"""
+    bucket = TokenBucket(per_minute=600, capacity=1)  # 10 единиц в секунду
+    started = time.monotonic()
+    for _ in range(3):
+        await bucket.acquire(1)
+    assert time.monotonic() - started >= 0.15
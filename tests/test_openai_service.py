@@ -1,6 +1,8 @@
 import pytest
-from unittest.mock import AsyncMock, patch
-from services.openai_service import OpenAIService
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+from services.openai_service import OpenAIService, ERROR_MESSAGE
+from services.circuit_breaker import CircuitBreaker
 from config import config
 
 @pytest.fixture
@@ -82,4 +84,153 @@ async def test_get_chat_completion_invalid_messages(openai_service):
     """Тест получения ответа с некорректными сообщениями"""
     invalid_messages = [{"invalid_key": "value"}]
     with pytest.raises(ValueError):
-        await openai_service.get_chat_completion(invalid_messages) 
\ No newline at end of file
+        await openai_service.get_chat_completion(invalid_messages) 
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion(openai_service):
+    """Тест потокового получения ответа по фрагментам"""
+    async def chunks():
+        for text in ["Для открытия ", "вклада ", None, "нужен паспорт."]:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            yield chunk
+
+    with patch.object(openai_service.client.chat.completions, 'create', AsyncMock(return_value=chunks())):
+        deltas = [delta async for delta in openai_service.stream_chat_completion([{"role": "user", "content": "Тест"}])]
+    assert deltas == ["Для открытия ", "вклада ", "нужен паспорт."]
+
+@pytest.mark.asyncio
+async def test_stream_chat_completion_error(openai_service):
+    """Тест потокового ответа при ошибке до первого фрагмента"""
+    with patch.object(openai_service.client.chat.completions, 'create', AsyncMock(side_effect=Exception("API Error"))):
+        deltas = [delta async for delta in openai_service.stream_chat_completion([{"role": "user", "content": "Тест"}])]
+    assert deltas == ["Извините, произошла ошибка при обработке запроса."]
+
+@pytest.mark.asyncio
+async def test_identical_requests_coalesced(openai_service):
+    """Тест: одинаковые одновременные запросы выполняют один вызов API"""
+    async def create(**kwargs):
+        await asyncio.sleep(0.01)
+        response = MagicMock()
+        response.choices[0].message.content = "Общий ответ"
+        response.usage = None
+        return response
+
+    mock_create = AsyncMock(side_effect=create)
+    with patch.object(openai_service.client.chat.completions, 'create', mock_create):
+        responses = await asyncio.gather(*[
+            openai_service.get_chat_completion([{"role": "user", "content": "Как  открыть вклад?"}]),
+            openai_service.get_chat_completion([{"role": "user", "content": "как открыть вклад?"}]),
+            openai_service.get_chat_completion([{"role": "user", "content": "Как открыть вклад? "}])
+        ])
+    assert responses == ["Общий ответ"] * 3
+    assert mock_create.call_count == 1
+
+@pytest.mark.asyncio
+async def test_aborted_stream_not_shared(openai_service):
+    """Тест: прерванный поток не отдается объединенным запросам и не попадает в кэш"""
+    async def create(**kwargs):
+        async def chunks():
+            for text in ["Для открытия ", "вклада ", "нужен паспорт."]:
+                await asyncio.sleep(0.01)
+                chunk = MagicMock()
+                chunk.choices = [MagicMock()]
+                chunk.choices[0].delta.content = text
+                yield chunk
+        return chunks()
+
+    async def collect(stream):
+        return "".join([delta async for delta in stream])
+
+    messages = [{"role": "user", "content": "Как открыть вклад?"}]
+    mock_create = AsyncMock(side_effect=create)
+    cache_put = MagicMock()
+    with patch.object(openai_service.client.chat.completions, 'create', mock_create), \
+            patch.object(openai_service, '_cache_key', AsyncMock(return_value=("эмбеддинг", "история"))), \
+            patch('services.openai_service.response_cache.get', return_value=None), \
+            patch('services.openai_service.response_cache.put', cache_put):
+        leader = openai_service.stream_chat_completion(messages)
+        assert await leader.__anext__() == "Для открытия "
+        follower = asyncio.ensure_future(collect(openai_service.stream_chat_completion(messages)))
+        await asyncio.sleep(0.005)
+        await leader.aclose()  # Например, ошибка Telegram при редактировании сообщения
+        assert await follower == "Для открытия вклада нужен паспорт."
+    assert mock_create.call_count == 2
+    cache_put.assert_called_once_with("эмбеддинг", "история", "Для открытия вклада нужен паспорт.")
+
+@pytest.fixture
+def open_breaker(openai_service):
+    """Разомкнутый выключатель OpenAI"""
+    openai_service.breaker = CircuitBreaker("test_openai", min_calls=1, open_seconds=60)
+    openai_service.breaker.record(None)
+    return openai_service.breaker
+
+@pytest.mark.asyncio
+async def test_open_breaker_fails_fast(openai_service, open_breaker):
+    """Тест: при разомкнутом выключателе API не вызывается"""
+    mock_create = AsyncMock()
+    with patch.object(openai_service.client.chat.completions, 'create', mock_create):
+        response = await openai_service.get_chat_completion([{"role": "user", "content": "Тест"}])
+        deltas = [delta async for delta in openai_service.stream_chat_completion([{"role": "user", "content": "Тест"}])]
+    assert response == ERROR_MESSAGE
+    assert deltas == [ERROR_MESSAGE]
+    mock_create.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_fallback_knowledge_base(openai_service, open_breaker):
+    """Тест: локальный ответ из базы знаний при разомкнутом выключателе"""
+    with patch('services.openai_service.vector_search') as mock_search:
+        mock_search.is_ready = True
+        mock_search.hybrid_search_async = AsyncMock(return_value=[("Вклад открывается в отделении.", 0.02)])
+        response = await openai_service.get_chat_completion([{"role": "user", "content": "Как открыть вклад?"}])
+    assert "Вклад открывается в отделении." in response
+
+@pytest.mark.asyncio
+async def test_deferred_answer_delivered(openai_service, open_breaker):
+    """Тест: отложенный вопрос получает ответ после восстановления API"""
+    delivered = asyncio.Queue()
+    response = await openai_service.get_chat_completion([{"role": "user", "content": "Тест"}], delivered.put)
+    assert response == config.MESSAGES["ANSWER_DEFERRED"]
+
+    openai_service.breaker = CircuitBreaker("test_openai")
+    answer = MagicMock()
+    answer.choices[0].message.content = "Отложенный ответ"
+    answer.usage = None
+    with patch.object(openai_service.client.chat.completions, 'create', AsyncMock(return_value=answer)):
+        worker = asyncio.create_task(openai_service.process_deferred())
+        try:
+            assert await asyncio.wait_for(delivered.get(), 1) == "Отложенный ответ"
+        finally:
+            worker.cancel()
+
+@pytest.mark.asyncio
+async def test_coalesced_stream_error_deferred_per_caller(openai_service):
+    """Тест: при ошибке до первого фрагмента каждый объединенный запрос откладывается со своей доставкой"""
+    async def create(**kwargs):
+        await asyncio.sleep(0.01)
+        raise Exception("API Error")
+
+    async def collect(deliver):
+        messages = [{"role": "user", "content": "Как открыть вклад?"}]
+        return "".join([delta async for delta in openai_service.stream_chat_completion(messages, deliver)])
+
+    first, second = AsyncMock(), AsyncMock()
+    mock_create = AsyncMock(side_effect=create)
+    with patch.object(openai_service.client.chat.completions, 'create', mock_create):
+        answers = await asyncio.gather(collect(first), collect(second))
+    assert answers == [config.MESSAGES["ANSWER_DEFERRED"]] * 2
+    assert mock_create.call_count == 1
+    queued = [openai_service._deferred.get_nowait()[2] for _ in range(openai_service._deferred.qsize())]
+    assert sorted(map(id, queued)) == sorted([id(first), id(second)])
+
+@pytest.mark.asyncio
+async def test_errors_open_breaker(openai_service):
+    """Тест: повторяющиеся ошибки API размыкают выключатель"""
+    openai_service.breaker = CircuitBreaker("test_openai", min_calls=2, open_seconds=60)
+    mock_create = AsyncMock(side_effect=Exception("API Error"))
+    with patch.object(openai_service.client.chat.completions, 'create', mock_create):
+        for question in ["Первый", "Второй", "Третий"]:
+            await openai_service.get_chat_completion([{"role": "user", "content": question}])
+    assert openai_service.breaker.state == CircuitBreaker.OPEN
+    assert mock_create.call_count == 2
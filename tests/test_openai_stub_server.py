@@ -0,0 +1,79 @@
+import pytest
+from aiohttp.test_utils import TestServer
+from openai import AsyncOpenAI, InternalServerError, RateLimitError
+from services.openai_gateway import OpenAIGateway
+from services.openai_stub_server import OpenAIStubServer
+
+MESSAGES = [{"role": "user", "content": "Как открыть вклад?"}]
+
+async def start(stub: OpenAIStubServer):
+    """Запуск заглушки и создание клиента, направленного на нее"""
+    server = TestServer(stub.create_app())
+    await server.start_server()
+    client = AsyncOpenAI(api_key="stub", base_url=str(server.make_url("/v1")), max_retries=0)
+    return server, client
+
+@pytest.mark.asyncio
+async def test_chat_completion():
+    """Тест ответа в формате OpenAI с подсчетом токенов"""
+    stub = OpenAIStubServer(latency_mean=0, completion_tokens=20, seed=1)
+    server, client = await start(stub)
+    try:
+        response = await client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES, max_tokens=100)
+        assert response.choices[0].message.content
+        assert response.usage.prompt_tokens > 0
+        assert response.usage.completion_tokens >= 20
+        assert stub.stats['prompt_tokens'] == response.usage.prompt_tokens
+        assert stub.stats['completion_tokens'] == response.usage.completion_tokens
+
+        # Одинаковый запрос дает одинаковый ответ
+        again = await client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES, max_tokens=100)
+        assert again.choices[0].message.content == response.choices[0].message.content
+    finally:
+        await server.close()
+
+@pytest.mark.asyncio
+async def test_streaming():
+    """Тест потокового ответа"""
+    stub = OpenAIStubServer(latency_mean=0, chunk_delay=0, completion_tokens=10, seed=1)
+    server, client = await start(stub)
+    try:
+        stream = await client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES, stream=True)
+        parts = [chunk.choices[0].delta.content async for chunk in stream if chunk.choices[0].delta.content]
+        assert len(parts) > 1
+        assert stub.stats['streams'] == 1
+        assert stub.stats['completion_tokens'] > 0
+    finally:
+        await server.close()
+
+@pytest.mark.asyncio
+async def test_error_injection():
+    """Тест внедрения ошибок 429 и 500"""
+    stub = OpenAIStubServer(latency_mean=0, error_429_rate=1.0)
+    server, client = await start(stub)
+    try:
+        with pytest.raises(RateLimitError):
+            await client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES)
+        stub.error_429_rate = 0.0
+        stub.error_500_rate = 1.0
+        with pytest.raises(InternalServerError):
+            await client.chat.completions.create(model="gpt-3.5-turbo", messages=MESSAGES)
+        assert stub.stats['errors'] == {'429': 1, '500': 1, 'timeout': 0}
+    finally:
+        await server.close()
+
+@pytest.mark.asyncio
+async def test_gateway_retries_against_stub(monkeypatch):
+    """Тест повторов шлюза на заглушке с частыми ошибками"""
+    stub = OpenAIStubServer(latency_mean=0, error_500_rate=0.5, seed=3)
+    server, client = await start(stub)
+    try:
+        gateway = OpenAIGateway(client, rpm=0, tpm=0, max_retries=10, timeout=10)
+        monkeypatch.setattr("services.openai_gateway.config.OPENAI_RETRY_BASE_DELAY", 0.001)
+        for _ in range(5):
+            response = await gateway.create(100, model="gpt-3.5-turbo", messages=MESSAGES)
+            assert response.choices[0].message.content
+        assert stub.stats['responses'] == 5
+        assert stub.stats['errors']['500'] > 0
+    finally:
+        await server.close()
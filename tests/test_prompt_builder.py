@@ -0,0 +1,61 @@
+import pytest
+from services.prompt_builder import PromptBuilder, count_message_tokens, count_tokens, truncate_tokens
+
+@pytest.fixture
+def history():
+    """Фикстура с историей диалога от старых сообщений к новым"""
+    return [
+        {"role": "user", "content": "Старый вопрос " * 50},
+        {"role": "assistant", "content": "Старый ответ " * 50},
+        {"role": "user", "content": "Как открыть вклад?"}
+    ]
+
+def test_everything_fits(history):
+    """Тест: при достаточном бюджете промпт содержит все сообщения"""
+    builder = PromptBuilder(budget=5000, system_prompt="Системный промпт")
+    messages, tokens = builder.build(history, context="Вклад открывается в отделении")
+    assert messages[0] == {"role": "system", "content": "Системный промпт"}
+    assert "Вклад открывается в отделении" in messages[1]["content"]
+    assert messages[2:] == history
+    assert tokens == count_message_tokens(messages)
+
+def test_oldest_turns_dropped_first(history):
+    """Тест: при нехватке бюджета отбрасываются самые старые сообщения"""
+    budget = count_message_tokens([{"role": "system", "content": "Системный промпт"}] + history[1:]) + 5
+    builder = PromptBuilder(budget=budget, system_prompt="Системный промпт")
+    messages, tokens = builder.build(history)
+    assert tokens <= budget
+    assert messages[-1] == history[-1]
+    assert messages[-2] == history[-2]
+    assert all(msg["content"] != history[0]["content"] for msg in messages)
+
+def test_long_turn_trimmed(history):
+    """Тест: не помещающееся сообщение обрезается, сохраняя окончание"""
+    builder = PromptBuilder(budget=60, system_prompt="")
+    messages, tokens = builder.build(history)
+    assert tokens <= 60
+    assert messages[-1] == history[-1]
+    assert history[-2]["content"].endswith(messages[0]["content"])
+    assert len(messages[0]["content"]) < len(history[-2]["content"])
+
+def test_context_budget(history):
+    """Тест ограничения токенов на контекст из базы знаний"""
+    builder = PromptBuilder(budget=5000, context_budget=20, system_prompt="")
+    messages, _ = builder.build(history[-1:], context="Очень длинный контекст " * 100)
+    assert count_tokens(messages[0]["content"]) <= 20 + 1
+
+def test_summary_before_history(history):
+    """Тест: сводка диалога добавляется после системного промпта и перед историей"""
+    builder = PromptBuilder(budget=5000, system_prompt="Системный промпт")
+    messages, _ = builder.build(history[-2:], summary="Клиент спрашивал о вкладах")
+    assert messages[0]["content"] == "Системный промпт"
+    assert messages[1]["role"] == "system"
+    assert messages[1]["content"].endswith("Клиент спрашивал о вкладах")
+    assert messages[2:] == history[-2:]
+
+def test_truncate_tokens():
+    """Тест обрезки текста по токенам"""
+    text = "слово " * 100
+    assert truncate_tokens(text, 1000) == text
+    assert count_tokens(truncate_tokens(text, 10)) <= 11
+    assert truncate_tokens(text, 0) == ""
@@ -0,0 +1,77 @@
+import pytest
+import numpy as np
+from services.response_cache import SemanticResponseCache, history_hash
+from config import config
+
+@pytest.fixture
+def embedding():
+    """Фикстура с эмбеддингом реплики пользователя"""
+    return np.array([1.0, 0.0, 0.0, 0.0], dtype='float32')
+
+def test_semantic_hit(embedding):
+    """Тест ответа из кэша на близкую по смыслу реплику"""
+    cache = SemanticResponseCache(maxsize=10, ttl=0, threshold=0.95)
+    cache.put(embedding, "h", "Ответ")
+    close = np.array([0.99, 0.05, 0.0, 0.0], dtype='float32')
+    assert cache.get(close, "h") == "Ответ"
+    assert cache.get(np.array([0.0, 1.0, 0.0, 0.0], dtype='float32'), "h") is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_history_hash_separates_entries(embedding):
+    """Тест: одинаковая реплика с другой историей диалога не попадает в кэш"""
+    cache = SemanticResponseCache(maxsize=10, ttl=0, threshold=0.95)
+    cache.put(embedding, "h1", "Ответ")
+    assert cache.get(embedding, "h2") is None
+
+def test_history_hash(monkeypatch):
+    """Тест хэша истории: учитываются только последние сообщения перед репликой"""
+    monkeypatch.setattr(config, "RESPONSE_CACHE_HISTORY_MESSAGES", 1)
+    first = [
+        {"role": "user", "content": "Привет"},
+        {"role": "assistant", "content": "Здравствуйте"},
+        {"role": "user", "content": "Как открыть вклад?"}
+    ]
+    second = [{"role": "user", "content": "Другое начало"}] + first[1:]
+    assert history_hash(first) == history_hash(second)
+    assert history_hash(first) != history_hash([first[0], {"role": "assistant", "content": "Добрый день"}, first[2]])
+
+def test_ttl_and_lru_eviction(embedding):
+    """Тест устаревания и вытеснения записей"""
+    cache = SemanticResponseCache(maxsize=2, ttl=10, threshold=0.95)
+    cache.put(embedding, "old", "Устаревший ответ", created=0.0)
+    assert cache.get(embedding, "old") is None
+    assert len(cache) == 0
+
+    cache.put(embedding, "a", "A")
+    cache.put(embedding, "b", "B")
+    assert cache.get(embedding, "a") == "A"  # "a" становится недавно использованной
+    cache.put(embedding, "c", "C")
+    assert cache.get(embedding, "b") is None
+    assert cache.get(embedding, "a") == "A"
+    assert cache.get(embedding, "c") == "C"
+
+def test_expired_best_match_skipped(embedding):
+    """Тест: устаревшая лучшая запись не скрывает действующую запись выше порога"""
+    cache = SemanticResponseCache(maxsize=10, ttl=10, threshold=0.95)
+    cache.put(embedding, "h", "Устаревший ответ", created=-100.0)
+    cache.put(np.array([0.99, 0.05, 0.0, 0.0], dtype='float32'), "h", "Действующий ответ")
+    assert cache.get(embedding, "h") == "Действующий ответ"
+    assert len(cache) == 1
+
+def test_disk_backend(tmp_path, embedding):
+    """Тест сохранения кэша в SQLite между перезапусками"""
+    path = str(tmp_path / "responses.db")
+    cache = SemanticResponseCache(maxsize=10, ttl=0, threshold=0.95, path=path)
+    cache.put(embedding, "h", "Сохраненный ответ")
+    reloaded = SemanticResponseCache(maxsize=10, ttl=0, threshold=0.95, path=path)
+    assert reloaded.get(embedding, "h") == "Сохраненный ответ"
+
+def test_saved_latency(embedding):
+    """Тест учета сэкономленного времени по средней задержке OpenAI"""
+    cache = SemanticResponseCache(maxsize=10, ttl=0, threshold=0.95)
+    cache.record_latency(2.0)
+    cache.put(embedding, "h", "Ответ")
+    cache.get(embedding, "h")
+    assert cache.stats()['saved_seconds'] == pytest.approx(2.0)
+    assert cache.stats()['hit_ratio'] == 1.0
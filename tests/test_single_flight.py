@@ -0,0 +1,77 @@
+import pytest
+import asyncio
+from services.single_flight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_identical_calls_coalesced():
+    """Тест: одновременные вызовы с одним ключом выполняют операцию один раз"""
+    flight = SingleFlight("test")
+    calls = 0
+
+    async def operation():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "результат"
+
+    results = await asyncio.gather(*[flight.do("ключ", operation) for _ in range(5)])
+    assert results == ["результат"] * 5
+    assert calls == 1
+    assert len(flight) == 0
+
+    # После завершения операция выполняется заново
+    assert await flight.do("ключ", operation) == "результат"
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_different_keys_not_coalesced():
+    """Тест: вызовы с разными ключами выполняются независимо"""
+    flight = SingleFlight("test")
+    calls = []
+
+    async def operation(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    assert await asyncio.gather(flight.do("a", lambda: operation(1)), flight.do("b", lambda: operation(2))) == [1, 2]
+    assert sorted(calls) == [1, 2]
+
+@pytest.mark.asyncio
+async def test_error_fanned_out():
+    """Тест: ошибка операции получают все ожидающие"""
+    flight = SingleFlight("test")
+
+    async def operation():
+        await asyncio.sleep(0.01)
+        raise ValueError("ошибка")
+
+    results = await asyncio.gather(*[flight.do("ключ", operation) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_operation():
+    """Тест: отмена одного ожидающего не прерывает операцию для остальных"""
+    flight = SingleFlight("test")
+
+    async def operation():
+        await asyncio.sleep(0.05)
+        return "результат"
+
+    first = asyncio.ensure_future(flight.do("ключ", operation))
+    second = asyncio.ensure_future(flight.do("ключ", operation))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "результат"
+
+@pytest.mark.asyncio
+async def test_lead_and_wait():
+    """Тест ручного выставления результата ведущим вызовом"""
+    flight = SingleFlight("test")
+    future = flight.lead("ключ")
+    assert "ключ" in flight
+    waiter = asyncio.ensure_future(flight.wait("ключ"))
+    await asyncio.sleep(0)
+    future.set_result("ответ")
+    assert await waiter == "ответ"
+    assert "ключ" not in flight
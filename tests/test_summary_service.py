@@ -0,0 +1,108 @@
+import pytest
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from config import config
+from services import summary_service
+from services.summary_service import ConversationSummarizer
+
+def make_history(turns):
+    """История чата: пары реплик пользователя и ассистента с последовательными ID"""
+    history = []
+    for turn in range(turns):
+        history.append(SimpleNamespace(id=2 * turn + 1, message=f"Вопрос {turn}", is_from_user=True))
+        history.append(SimpleNamespace(id=2 * turn + 2, message=f"Ответ {turn}", is_from_user=False))
+    return history
+
+@pytest.fixture
+def storage(monkeypatch):
+    """Хранилище истории и сводки в памяти вместо базы данных"""
+    state = SimpleNamespace(history=[], summary=None)
+
+    async def get_summary(user_id, session=None):
+        return state.summary
+
+    async def get_after(user_id, after_id=0):
+        return [msg for msg in state.history if msg.id > after_id]
+
+    async def get_last(user_id, limit=5, after_id=0, session=None):
+        return [msg for msg in state.history if msg.id > after_id][-limit:]
+
+    async def save(user_id, summary, last_message_id):
+        state.summary = SimpleNamespace(summary=summary, last_message_id=last_message_id)
+
+    monkeypatch.setattr(summary_service, "get_conversation_summary", get_summary)
+    monkeypatch.setattr(summary_service, "get_messages_after", get_after)
+    monkeypatch.setattr(summary_service, "get_last_messages", get_last)
+    monkeypatch.setattr(summary_service, "save_conversation_summary", save)
+    monkeypatch.setattr(config, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(config, "SUMMARY_EVERY_TURNS", 2)
+    monkeypatch.setattr(config, "SUMMARY_RECENT_MESSAGES", 2)
+    return state
+
+@pytest.fixture
+def completion(monkeypatch):
+    """Подмена запроса сводки к OpenAI"""
+    mock = AsyncMock(return_value="Клиент спрашивал о вкладах")
+    monkeypatch.setattr(summary_service.openai_service, "get_service_completion", mock)
+    return mock
+
+@pytest.mark.asyncio
+async def test_refresh_skipped_for_short_dialog(storage, completion):
+    """Тест: сводка не обновляется, пока не накопилось достаточно реплик"""
+    storage.history = make_history(2)
+    assert not await ConversationSummarizer().refresh(1)
+    completion.assert_not_called()
+    assert storage.summary is None
+
+@pytest.mark.asyncio
+async def test_refresh_folds_old_messages(storage, completion):
+    """Тест: старые сообщения сворачиваются в сводку, последние остаются как есть"""
+    storage.history = make_history(3)
+    summarizer = ConversationSummarizer()
+    assert await summarizer.refresh(1)
+    assert storage.summary.last_message_id == 4
+
+    prompt = completion.call_args.args[0]
+    assert "Вопрос 0" in prompt[-1]["content"]
+    assert "Вопрос 2" not in prompt[-1]["content"]
+
+    summary, messages = await summarizer.load(1)
+    assert summary == "Клиент спрашивал о вкладах"
+    assert [msg.id for msg in messages] == [5, 6]
+
+@pytest.mark.asyncio
+async def test_refresh_extends_previous_summary(storage, completion):
+    """Тест: новая сводка строится из предыдущей и новых сообщений"""
+    storage.history = make_history(5)
+    storage.summary = SimpleNamespace(summary="Ранняя сводка", last_message_id=2)
+    assert await ConversationSummarizer().refresh(1)
+    prompt = completion.call_args.args[0][-1]["content"]
+    assert "Ранняя сводка" in prompt
+    assert "Вопрос 0" not in prompt
+    assert storage.summary.last_message_id == 8
+
+@pytest.mark.asyncio
+async def test_refresh_error_keeps_summary(storage, completion):
+    """Тест: ошибка OpenAI не портит сохраненную сводку"""
+    storage.history = make_history(4)
+    completion.side_effect = RuntimeError("ошибка")
+    assert not await ConversationSummarizer().refresh(1)
+    assert storage.summary is None
+
+@pytest.mark.asyncio
+async def test_schedule_runs_once_per_user(storage, completion):
+    """Тест: одновременные обновления сводки одного пользователя не дублируются"""
+    storage.history = make_history(3)
+
+    async def slow(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return "Сводка"
+
+    completion.side_effect = slow
+    summarizer = ConversationSummarizer()
+    summarizer.schedule(1)
+    summarizer.schedule(1)
+    await summarizer.wait()
+    assert completion.call_count == 1
+    assert storage.summary.summary == "Сводка"
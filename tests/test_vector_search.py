@@ -1,11 +1,23 @@
 import pytest
-from services.vector_search import VectorSearch
+import asyncio
+import os
+import time
+from services.vector_search import (
+    VectorSearch, ContextStore, LRUCache, normalize_query, iter_paragraphs,
+    INDEX_FILE, EMBEDDINGS_FILE, META_FILE, INDEX_TYPES, vector_search as global_vector_search
+)
 from config import config
+from prometheus_client import REGISTRY
 
 @pytest.fixture
-def vector_search():
+def index_dir(tmp_path):
+    """Фикстура с временной директорией для сохранения индекса"""
+    return str(tmp_path / "vector_index")
+
+@pytest.fixture
+def vector_search(index_dir):
     """Фикстура для создания экземпляра VectorSearch"""
-    return VectorSearch()
+    return VectorSearch(index_dir=index_dir)
 
 @pytest.fixture
 def test_contexts():
@@ -71,4 +83,560 @@ def test_search_threshold(vector_search, test_contexts):
     query = "Как купить акции?"
     result, distance = vector_search.search(query)
     assert result is None
-    assert distance > vector_search.threshold 
\ No newline at end of file
+    assert distance > vector_search.threshold 
+
+def test_build_index_saves_to_disk(vector_search, test_contexts, index_dir):
+    """Тест сохранения индекса и кэша эмбеддингов на диск"""
+    vector_search.build_index(test_contexts)
+    for filename in (INDEX_FILE, EMBEDDINGS_FILE, META_FILE):
+        assert os.path.exists(os.path.join(index_dir, filename))
+
+def test_build_index_loads_from_disk(vector_search, test_contexts, index_dir, monkeypatch):
+    """Тест загрузки сохраненного индекса без повторного кодирования"""
+    vector_search.build_index(test_contexts)
+
+    restarted = VectorSearch(index_dir=index_dir)
+    monkeypatch.setattr(restarted.model, "encode", lambda *args, **kwargs: pytest.fail("encode не должен вызываться"))
+    restarted.build_index(test_contexts)
+    assert restarted.index.ntotal == len(test_contexts)
+    assert restarted.contexts == test_contexts
+
+def test_build_index_encodes_only_changed(vector_search, test_contexts, index_dir):
+    """Тест кодирования только новых и измененных контекстов"""
+    vector_search.build_index(test_contexts)
+
+    restarted = VectorSearch(index_dir=index_dir)
+    encoded = []
+    original_encode = restarted.model.encode
+
+    def tracking_encode(texts, *args, **kwargs):
+        encoded.extend(texts)
+        return original_encode(texts, *args, **kwargs)
+
+    restarted.model.encode = tracking_encode
+    changed = test_contexts[:2] + ["Как закрыть счет? Для закрытия счета подайте заявление в отделении."]
+    restarted.build_index(changed)
+    assert encoded == [changed[2]]
+    assert restarted.index.ntotal == len(changed)
+
+    query = "Как открыть вклад в банке?"
+    result, _ = restarted.search(query)
+    assert result == test_contexts[0]
+
+
+def test_add_contexts(vector_search, test_contexts):
+    """Тест добавления контекстов без перестроения индекса"""
+    vector_search.build_index(test_contexts[:2])
+    index = vector_search.index
+    keys = vector_search.add_contexts(test_contexts[2:], keys=["credit"])
+    assert keys == ["credit"]
+    assert vector_search.index is index
+    assert len(vector_search) == len(test_contexts)
+    assert vector_search.index.ntotal == len(test_contexts)
+    assert vector_search.contexts == test_contexts
+
+def test_remove_contexts(vector_search, test_contexts):
+    """Тест удаления контекстов по ключу"""
+    vector_search.build_index(test_contexts, keys=["deposit", "card", "credit"])
+    assert vector_search.remove_contexts(["deposit", "unknown"]) == 1
+    assert len(vector_search) == 2
+    assert vector_search.index.ntotal == 2
+    assert test_contexts[0] not in vector_search.contexts
+
+    result, _ = vector_search.search("Как открыть вклад в банке?")
+    assert result != test_contexts[0]
+
+    # Освободившийся ID используется повторно
+    vector_search.add_contexts([test_contexts[0]], keys=["deposit"])
+    assert vector_search.contexts == test_contexts
+
+def test_upsert_contexts(vector_search, test_contexts):
+    """Тест обновления контекста по стабильному ключу"""
+    vector_search.build_index(test_contexts, keys=["deposit", "card", "credit"])
+    updated = "Как пополнить карту? Пополнение доступно в банкомате, приложении и по номеру телефона."
+    vector_search.upsert_contexts({"card": updated})
+    assert len(vector_search) == len(test_contexts)
+    assert vector_search.index.ntotal == len(test_contexts)
+    assert vector_search.contexts[1] == updated
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_index_types(index_dir, test_contexts, index_type):
+    """Тест построения индекса и поиска для всех типов индекса"""
+    vector_search = VectorSearch(index_dir=index_dir, index_type=index_type)
+    vector_search.build_index(test_contexts)
+    assert vector_search.index.ntotal == len(test_contexts)
+    result, _ = vector_search.search("Как открыть вклад в банке?")
+    assert result == test_contexts[0]
+
+def test_unknown_index_type(index_dir):
+    """Тест ошибки при неизвестном типе индекса"""
+    with pytest.raises(ValueError):
+        VectorSearch(index_dir=index_dir, index_type="unknown")
+
+def test_hnsw_remove_contexts(index_dir, test_contexts):
+    """Тест удаления контекстов из HNSW индекса, не поддерживающего удаление векторов"""
+    vector_search = VectorSearch(index_dir=index_dir, index_type="hnsw")
+    vector_search.build_index(test_contexts, keys=["deposit", "card", "credit"])
+    assert vector_search.remove_contexts(["deposit"]) == 1
+    assert len(vector_search) == 2
+    result, _ = vector_search.search("Как открыть вклад в банке?")
+    assert result != test_contexts[0]
+
+def test_benchmark(vector_search, test_contexts):
+    """Тест сравнения типов индекса"""
+    report = vector_search.benchmark(test_contexts, k=2, num_queries=3)
+    assert [row["index_type"] for row in report] == list(INDEX_TYPES)
+    flat = report[0]
+    assert flat["recall"] == 1.0
+    for row in report:
+        assert 0.0 <= row["recall"] <= 1.0
+        assert row["p99_ms"] >= row["p50_ms"] >= 0.0
+        assert row["memory_bytes"] > 0
+
+
+@pytest.mark.asyncio
+async def test_search_async(vector_search, test_contexts):
+    """Тест асинхронного поиска"""
+    vector_search.build_index(test_contexts)
+    query = "Как открыть вклад в банке?"
+    result, distance = await vector_search.search_async(query)
+    expected_result, expected_distance = vector_search.search(query)
+    assert result == expected_result == test_contexts[0]
+    assert distance == pytest.approx(expected_distance, abs=1e-4)
+
+@pytest.mark.asyncio
+async def test_search_async_batches_concurrent_queries(vector_search, test_contexts):
+    """Тест объединения одновременных запросов в один вызов encode"""
+    vector_search.build_index(test_contexts)
+    queries = ["Как открыть вклад в банке?", "Как пополнить карту?", "Как получить кредит?"]
+    batches = []
+    original_encode = vector_search.model.encode
+
+    def tracking_encode(texts, *args, **kwargs):
+        batches.append(list(texts))
+        return original_encode(texts, *args, **kwargs)
+
+    vector_search.model.encode = tracking_encode
+    results = await asyncio.gather(*(vector_search.search_async(query) for query in queries))
+    assert batches == [queries]
+    assert results == [vector_search.search(query) for query in queries]
+
+@pytest.mark.asyncio
+async def test_search_async_empty_index(vector_search):
+    """Тест асинхронного поиска с пустым индексом"""
+    result, distance = await vector_search.search_async("Как открыть вклад?")
+    assert result is None
+    assert distance == 0.0
+
+
+def test_normalize_query():
+    """Тест нормализации текста запроса"""
+    assert normalize_query("  Как   ПОПОЛНИТЬ карту?! ") == "как пополнить карту"
+    assert normalize_query("Ещё, вопрос...") == "еще вопрос"
+
+def test_search_query_cache(vector_search, test_contexts):
+    """Тест кэширования повторных запросов без обращения к модели"""
+    vector_search.build_index(test_contexts)
+    first = vector_search.search("Как пополнить карту?")
+    vector_search.model.encode = lambda *args, **kwargs: pytest.fail("encode не должен вызываться")
+    assert vector_search.search("как пополнить  КАРТУ") == first
+    stats = vector_search.cache_stats()
+    assert stats["result"]["hits"] == 1
+    assert stats["result"]["misses"] == 1
+    assert stats["embedding"]["misses"] == 1
+
+def test_search_query_cache_invalidated(vector_search, test_contexts):
+    """Тест сброса кэша результатов при изменении индекса"""
+    vector_search.build_index(test_contexts, keys=["deposit", "card", "credit"])
+    query = "Как открыть вклад в банке?"
+    assert vector_search.search(query)[0] == test_contexts[0]
+    vector_search.remove_contexts(["deposit"])
+    assert vector_search.search(query)[0] != test_contexts[0]
+    assert vector_search.cache_stats()["embedding"]["hits"] == 1
+
+def test_lru_cache_eviction_and_ttl(monkeypatch):
+    """Тест вытеснения и устаревания записей LRU кэша"""
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+
+
+def test_search_many(vector_search, test_contexts):
+    """Тест пакетного поиска k ближайших контекстов"""
+    vector_search.build_index(test_contexts)
+    queries = ["Как открыть вклад в банке?", "Как получить кредит?"]
+    results = vector_search.search_many(queries, k=2)
+    assert len(results) == len(queries)
+    for query, row in zip(queries, results):
+        assert len(row) == 2
+        assert row[0][1] <= row[1][1]
+        assert row[0] == vector_search.search(query)
+
+def test_search_many_empty(vector_search, test_contexts):
+    """Тест пакетного поиска с пустым индексом и пустым списком запросов"""
+    assert vector_search.search_many(["Как открыть вклад?"]) == [[]]
+    vector_search.build_index(test_contexts)
+    assert vector_search.search_many([]) == []
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_cosine_metric(index_dir, test_contexts, index_type):
+    """Тест косинусной метрики: оценка - сходство в диапазоне [-1, 1], чем больше, тем лучше"""
+    vector_search = VectorSearch(index_dir=index_dir, index_type=index_type, metric="cosine")
+    vector_search.build_index(test_contexts)
+    results = vector_search.search_many([test_contexts[0]], k=3)[0]
+    assert results[0][0] == test_contexts[0]
+    # Квантованные индексы дают приближенные оценки
+    tolerance = 1e-2 if index_type in ("sq8", "pq", "ivfpq") else 1e-3
+    assert results[0][1] == pytest.approx(1.0, abs=tolerance)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert all(-1.0 - tolerance <= score <= 1.0 + tolerance for score in scores)
+
+    vector_search.threshold = 0.98
+    result, score = vector_search.search(test_contexts[0])
+    assert result == test_contexts[0]
+    assert score >= vector_search.threshold
+
+
+def test_hybrid_search_exact_keyword_hit(vector_search, test_contexts):
+    """Тест ответа из лексического индекса без кодирования запроса"""
+    vector_search.build_index(test_contexts)
+    vector_search.model.encode = lambda *args, **kwargs: pytest.fail("encode не должен вызываться")
+    results = vector_search.hybrid_search("Как пополнить карту?", k=2)
+    assert results[0][0] == test_contexts[1]
+
+def test_hybrid_search_fused(vector_search, test_contexts):
+    """Тест объединенного ранжирования при неоднозначном лексическом совпадении"""
+    vector_search.build_index(test_contexts)
+    results = vector_search.hybrid_search("Какие документы нужны, паспорт?", k=3)
+    assert 1 <= len(results) <= 3
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+    assert {context for context, _ in results} <= set(test_contexts)
+
+def test_hybrid_search_follows_index_updates(vector_search, test_contexts):
+    """Тест синхронизации лексического индекса с изменениями контекстов"""
+    vector_search.build_index(test_contexts, keys=["deposit", "card", "credit"])
+    vector_search.remove_contexts(["card"])
+    assert all(context != test_contexts[1] for context, _ in vector_search.hybrid_search("пополнить карту"))
+    vector_search.upsert_contexts({"card": test_contexts[1]})
+    assert vector_search.hybrid_search("пополнить карту")[0][0] == test_contexts[1]
+
+def test_hybrid_search_threshold(vector_search, test_contexts):
+    """Тест порога схожести: лексические совпадения без векторного не попадают в результат"""
+    vector_search.build_index(test_contexts)
+    query = "Какие документы нужны, паспорт?"
+    assert vector_search.hybrid_search(query, k=3, threshold=1e-3) == []
+    assert vector_search.hybrid_search(query, k=3, threshold=float("inf")) == vector_search.hybrid_search(query, k=3)
+
+@pytest.mark.asyncio
+async def test_hybrid_search_async(vector_search, test_contexts):
+    """Тест асинхронного гибридного поиска"""
+    vector_search.build_index(test_contexts)
+    query = "Какие документы нужны, паспорт?"
+    assert await vector_search.hybrid_search_async(query) == vector_search.hybrid_search(query)
+
+
+def test_iter_paragraphs(tmp_path, test_contexts):
+    """Тест потокового чтения абзацев из файла и директории"""
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text(
+        "\n" + test_contexts[0] + "\n\n\n" + test_contexts[1] + "\n  \n" + test_contexts[2],
+        encoding="utf-8"
+    )
+    assert list(iter_paragraphs(str(context_file))) == test_contexts
+
+    (tmp_path / "extra.md").write_text("Как закрыть счет?\nПодайте заявление.", encoding="utf-8")
+    (tmp_path / "ignored.json").write_text("{}", encoding="utf-8")
+    assert list(iter_paragraphs(str(tmp_path))) == ["Как закрыть счет?\nПодайте заявление."] + test_contexts
+
+def test_chunk_text(vector_search, monkeypatch):
+    """Тест нарезки длинного текста на фрагменты по токенам с перекрытием"""
+    monkeypatch.setattr(config, "VECTOR_CHUNK_TOKENS", 20)
+    monkeypatch.setattr(config, "VECTOR_CHUNK_OVERLAP", 5)
+    short_text = "Как пополнить карту?"
+    assert vector_search.chunk_text(short_text) == [short_text]
+
+    long_text = " ".join(f"слово{i}" for i in range(100))
+    chunks = vector_search.chunk_text(long_text)
+    assert len(chunks) > 1
+    tokenizer = vector_search.model.tokenizer
+    for chunk in chunks:
+        assert chunk in long_text
+        assert len(tokenizer(chunk, add_special_tokens=False)["input_ids"]) <= 20
+    assert chunks[0].startswith("слово0 ")
+    assert chunks[-1].endswith("слово99")
+    # Соседние фрагменты перекрываются
+    assert chunks[0].split()[-1] in chunks[1]
+
+def test_ingest(vector_search, tmp_path, test_contexts):
+    """Тест загрузки базы знаний с удалением повторяющихся фрагментов"""
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(test_contexts + [test_contexts[0]]), encoding="utf-8")
+    assert vector_search.ingest(str(context_file)) == len(test_contexts)
+    assert vector_search.contexts == test_contexts
+
+def test_ingest_in_batches(vector_search, tmp_path, test_contexts, monkeypatch):
+    """Тест построения индекса пачками фиксированного размера"""
+    monkeypatch.setattr(config, "VECTOR_INGEST_BATCH_SIZE", 2)
+    batches = []
+    original_encode = vector_search.model.encode
+
+    def tracking_encode(texts, *args, **kwargs):
+        batches.append(len(texts))
+        return original_encode(texts, *args, **kwargs)
+
+    vector_search.model.encode = tracking_encode
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(test_contexts), encoding="utf-8")
+    vector_search.ingest(str(context_file))
+    assert batches == [2, 1]
+    assert vector_search.index.ntotal == len(test_contexts)
+
+def test_ingest_streams_batches(vector_search, tmp_path, monkeypatch):
+    """Тест потоковой загрузки: фрагменты читаются не дальше текущей пачки"""
+    monkeypatch.setattr(config, "VECTOR_INGEST_BATCH_SIZE", 2)
+    contexts = [f"Потоковый контекст {i} о платеже {i * 5}" for i in range(7)]
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(contexts), encoding="utf-8")
+
+    read = []
+    iter_chunks = vector_search.iter_chunks
+
+    def tracking_iter_chunks(path):
+        for chunk in iter_chunks(path):
+            read.append(chunk)
+            yield chunk
+
+    lookahead = []
+    upsert_contexts = vector_search.upsert_contexts
+
+    def tracking_upsert(items):
+        upsert_contexts(items)
+        lookahead.append(len(read) - len(vector_search))
+
+    monkeypatch.setattr(vector_search, "iter_chunks", tracking_iter_chunks)
+    monkeypatch.setattr(vector_search, "upsert_contexts", tracking_upsert)
+    assert vector_search.ingest(str(context_file)) == len(contexts)
+    assert list(vector_search.contexts) == contexts
+    assert max(lookahead) == 0
+
+def test_parallel_ingest(index_dir, tmp_path, monkeypatch):
+    """Тест потоковой загрузки с кодированием в пуле процессов"""
+    contexts = [f"Параллельный фрагмент {i} о переводе {i * 11}" for i in range(30)]
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(contexts), encoding="utf-8")
+
+    monkeypatch.setattr(config, "VECTOR_ENCODE_WORKERS", 2)
+    monkeypatch.setattr(config, "VECTOR_INGEST_BATCH_SIZE", 4)
+    vector_search = VectorSearch(index_dir=index_dir)
+    encode = vector_search.model.encode
+    vector_search.model.encode = lambda *args, **kwargs: pytest.fail("кодирование должно идти в воркерах")
+    assert vector_search.ingest(str(context_file)) == len(contexts)
+    vector_search.model.encode = encode
+    assert list(vector_search.contexts) == contexts
+    assert vector_search.search(contexts[9])[0] == contexts[9]
+
+def test_ingest_loads_saved_index(vector_search, index_dir, tmp_path, test_contexts):
+    """Тест повторной загрузки: индекс читается с диска, эмбеддинги не пересчитываются"""
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(test_contexts), encoding="utf-8")
+    vector_search.ingest(str(context_file))
+
+    restarted = VectorSearch(index_dir=index_dir)
+    restarted.model.encode = lambda *args, **kwargs: pytest.fail("индекс должен загружаться с диска")
+    assert restarted.ingest(str(context_file)) == len(test_contexts)
+    assert list(restarted.contexts) == test_contexts
+    assert restarted.hybrid_search("Как пополнить карту?", k=2)[0][0] == test_contexts[1]
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_ingest_upserts_only_changed(index_dir, tmp_path, test_contexts, index_type):
+    """Тест повторной загрузки измененного файла: кодируются только новые фрагменты"""
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(test_contexts), encoding="utf-8")
+    VectorSearch(index_dir=index_dir, index_type=index_type).ingest(str(context_file))
+
+    updated = test_contexts[1:] + ["Новый контекст о возврате средств"]
+    context_file.write_text("\n\n".join(updated), encoding="utf-8")
+    restarted = VectorSearch(index_dir=index_dir, index_type=index_type)
+    encoded = []
+    original_encode = restarted.model.encode
+
+    def tracking_encode(texts, *args, **kwargs):
+        encoded.extend(texts)
+        return original_encode(texts, *args, **kwargs)
+
+    restarted.model.encode = tracking_encode
+    assert restarted.ingest(str(context_file)) == len(updated)
+    assert encoded == [updated[-1]]
+    assert sorted(context for context in restarted.contexts if context is not None) == sorted(updated)
+    assert restarted.search(updated[-1])[0] == updated[-1]
+    assert test_contexts[0] not in restarted.search(test_contexts[0])
+
+def test_ingest_missing_file(vector_search, tmp_path):
+    """Тест загрузки несуществующего контекстного файла"""
+    with pytest.raises(FileNotFoundError):
+        vector_search.ingest(str(tmp_path / "missing.txt"))
+
+
+def test_model_loaded_lazily(index_dir):
+    """Тест ленивой загрузки модели"""
+    vector_search = VectorSearch(index_dir=index_dir)
+    assert not vector_search.is_loaded
+    assert not vector_search.is_ready
+    assert vector_search.search("Как открыть вклад?") == (None, 0.0)
+    assert not vector_search.is_loaded
+    assert vector_search.model is vector_search.model
+    assert vector_search.is_loaded
+
+@pytest.mark.asyncio
+async def test_warm_up(index_dir, tmp_path, test_contexts):
+    """Тест фонового прогрева: загрузка модели и базы знаний"""
+    context_file = tmp_path / "faq.txt"
+    context_file.write_text("\n\n".join(test_contexts), encoding="utf-8")
+    vector_search = VectorSearch(index_dir=index_dir)
+    await vector_search.warm_up(str(context_file))
+    assert vector_search.is_ready
+    assert vector_search.contexts == test_contexts
+
+@pytest.mark.asyncio
+async def test_warm_up_missing_context_file(index_dir, tmp_path):
+    """Тест прогрева без контекстного файла: сервис готов, индекс пуст"""
+    vector_search = VectorSearch(index_dir=index_dir)
+    await vector_search.warm_up(str(tmp_path / "missing.txt"))
+    assert vector_search.is_ready
+    assert vector_search.index is None
+
+
+@pytest.mark.parametrize("index_type", ["sq8", "pq"])
+def test_quantized_index_memory(index_dir, index_type):
+    """Тест сжатых индексов: поиск работает, индекс меньше несжатого"""
+    contexts = [f"Контекст номер {i} про вклад {i * 7} и карту {i * 13}" for i in range(300)]
+    flat = VectorSearch(index_dir="", index_type="flat")
+    flat.build_index(contexts)
+    quantized = VectorSearch(index_dir=index_dir, index_type=index_type)
+    quantized.build_index(contexts)
+    assert quantized.search_many([contexts[5]], k=1)[0][0][0] == contexts[5]
+    assert quantized.memory_usage()['index_bytes'] < flat.memory_usage()['index_bytes']
+
+    reloaded = VectorSearch(index_dir=index_dir, index_type=index_type)
+    reloaded.build_index(contexts)
+    assert reloaded.search_many([contexts[5]], k=1)[0][0][0] == contexts[5]
+
+
+def test_mmap_context_storage(index_dir, test_contexts):
+    """Тест хранения текстов контекстов в файле, отображаемом в память"""
+    vector_search = VectorSearch(index_dir=index_dir, context_storage="mmap")
+    vector_search.build_index(test_contexts)
+    assert list(vector_search.contexts) == test_contexts
+    assert vector_search.search(test_contexts[2])[0] == test_contexts[2]
+
+    keys = vector_search.add_contexts(["Новый контекст про ипотеку"])
+    vector_search.upsert_contexts({keys[0]: "Обновленный контекст про ипотеку"})
+    vector_search.remove_contexts([vector_search._keys[0]])
+    assert vector_search.contexts[0] is None
+    assert "Обновленный контекст про ипотеку" in list(vector_search.contexts)
+
+    usage = vector_search.memory_usage()
+    assert usage['context_storage'] == "mmap"
+    assert usage['contexts_file_bytes'] > 0
+
+
+def test_context_store_list_interface():
+    """Тест списочного интерфейса ContextStore"""
+    store = ContextStore(["а", None, "ёлка"])
+    assert len(store) == 3
+    assert store == ["а", None, "ёлка"]
+    store[1] = "б"
+    store.append("в" * 5000)
+    assert store[1] == "б"
+    assert store[-1] == "в" * 5000
+    with pytest.raises(IndexError):
+        store[10]
+
+
+def test_parallel_build_index(index_dir, monkeypatch):
+    """Тест построения индекса с кодированием в пуле процессов"""
+    contexts = [f"Параллельный контекст {i} о счете {i * 3}" for i in range(40)]
+    sequential = VectorSearch(index_dir="")
+    sequential.build_index(contexts)
+
+    monkeypatch.setattr(config, "VECTOR_ENCODE_WORKERS", 2)
+    monkeypatch.setattr(config, "VECTOR_INGEST_BATCH_SIZE", 8)
+    parallel = VectorSearch(index_dir=index_dir)
+    encode = parallel.model.encode
+    parallel.model.encode = lambda *args, **kwargs: pytest.fail("кодирование должно идти в воркерах")
+    parallel.build_index(contexts)
+    parallel.model.encode = encode
+    assert list(parallel.contexts) == contexts
+    for context in contexts[::7]:
+        assert parallel.search(context) == sequential.search(context)
+
+
+def test_reload_swaps_index(index_dir, tmp_path):
+    """Тест перезагрузки базы знаний: поиск видит старый индекс до замены и новый после"""
+    context_file = tmp_path / "context.txt"
+    context_file.write_text("Старый ответ про кредит\n\nОтвет про вклад", encoding='utf-8')
+    vector_search = VectorSearch(index_dir=index_dir)
+    asyncio.run(vector_search.warm_up(str(context_file)))
+    old_state = vector_search._state
+    assert vector_search.search("Старый ответ про кредит")[0] == "Старый ответ про кредит"
+
+    context_file.write_text("Новый ответ про кредит\n\nОтвет про вклад", encoding='utf-8')
+    count = asyncio.run(vector_search.reload(str(context_file)))
+    assert count == 2
+    assert vector_search._state is not old_state
+    assert list(old_state.contexts) == ["Старый ответ про кредит", "Ответ про вклад"]
+    assert vector_search.search("Новый ответ про кредит")[0] == "Новый ответ про кредит"
+    assert "Старый ответ про кредит" not in list(vector_search.contexts)
+
+
+def test_watch_reloads_on_change(index_dir, tmp_path):
+    """Тест перезагрузки базы знаний при изменении контекстного файла"""
+    context_file = tmp_path / "context.txt"
+    context_file.write_text("Первый ответ", encoding='utf-8')
+    vector_search = VectorSearch(index_dir=index_dir)
+
+    async def scenario():
+        await vector_search.warm_up(str(context_file))
+        watcher = asyncio.create_task(vector_search.watch(str(context_file), interval=0.01))
+        context_file.write_text("Первый ответ\n\nВторой ответ", encoding='utf-8')
+        os.utime(context_file, (time.time() + 5, time.time() + 5))
+        for _ in range(500):
+            if len(vector_search) == 2:
+                break
+            await asyncio.sleep(0.01)
+        watcher.cancel()
+
+    asyncio.run(scenario())
+    assert sorted(vector_search.contexts) == ["Второй ответ", "Первый ответ"]
+
+
+def test_direct_answer(index_dir, test_contexts, monkeypatch):
+    """Тест прямого ответа из базы знаний: только уверенные совпадения и только после прогрева"""
+    vector_search = VectorSearch(index_dir=index_dir)
+    vector_search.build_index(test_contexts)
+    assert asyncio.run(vector_search.direct_answer(test_contexts[0])) is None  # Прогрев не завершен
+
+    asyncio.run(vector_search.warm_up())
+    monkeypatch.setattr(config, "FAQ_DIRECT_THRESHOLD", 1e-3)
+    assert asyncio.run(vector_search.direct_answer(test_contexts[0])) == test_contexts[0]
+    vector_search.threshold = 10.0
+    assert asyncio.run(vector_search.direct_answer("Совсем другой вопрос про погоду")) is None
+
+def test_ready_gauge(monkeypatch):
+    """Тест метрики готовности глобального сервиса для проверок состояния"""
+    monkeypatch.setattr(global_vector_search, "_ready", False)
+    assert REGISTRY.get_sample_value("vector_search_ready") == 0.0
+    monkeypatch.setattr(global_vector_search, "_ready", True)
+    monkeypatch.setattr(global_vector_search, "_model", object())
+    assert REGISTRY.get_sample_value("vector_search_ready") == 1.0